@@ -0,0 +1,170 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from rollups import TimeRollups, build_pyramid, hourly_base, merge_rollups, rollups_from_cube
+
+# Dimension columns the charts and prompts slice engagements by
+DIMENSIONS = ['sentiment', 'platform', 'media_type', 'location']
+
+
+@dataclass
+class DashboardAggregates:
+    """Every per-dimension sum and count the dashboard needs, derived from one scan of cleaned_df.
+
+    `cube` holds engagement sums and row counts per (day, sentiment, platform, media_type, location)
+    combination; the per-chart series below are cheap reductions of it.
+    """
+    total_rows: int
+    date_min: pd.Timestamp
+    date_max: pd.Timestamp
+    cube: pd.DataFrame
+    sentiment_counts: pd.Series = None
+    engagement_by_date: pd.Series = None
+    platform_engagements: pd.Series = None
+    media_type_counts: pd.Series = None
+    location_engagements: pd.Series = None
+    # Engagement trend at hour/day/week/month resolution (see rollups.TimeRollups)
+    rollups: TimeRollups = None
+    # Description of the filters these aggregates were cut with (see filters.FilterIndex); None when unfiltered
+    filters: str = None
+
+    def top_locations(self, n=5):
+        return self.location_engagements.nlargest(n)
+
+
+def _counts(cube, dim):
+    # Same ordering as Series.value_counts(): most frequent first
+    return cube.groupby(dim, observed=True)['count'].sum().sort_values(ascending=False, kind='stable')
+
+
+def _sums(cube, dim):
+    return cube.groupby(dim, observed=True)['engagements'].sum()
+
+
+def build_cube(cleaned_df):
+    dims = [c for c in DIMENSIONS if c in cleaned_df.columns]
+    keys = [cleaned_df['date'].dt.normalize().rename('day')] + [cleaned_df[c] for c in dims]
+    # Engagements are stored compactly (int32); sum in int64 so large totals cannot overflow
+    engagements = cleaned_df['engagements'].astype('int64')
+    return (
+        engagements.groupby(keys, dropna=False, observed=True, sort=False)
+        .agg(engagements='sum', count='size')
+        .reset_index()
+        # Day order lets appends and filters find a date range by binary search
+        .sort_values('day', kind='stable', ignore_index=True)
+    )
+
+
+def fold_cubes(cubes):
+    """Merges partial cubes (e.g. one per CSV chunk) into a single cube."""
+    cubes = [c for c in cubes if c is not None]
+    if len(cubes) == 1:
+        return cubes[0]
+    combined = pd.concat(cubes, ignore_index=True)
+    keys = [c for c in combined.columns if c not in ('engagements', 'count')]
+    return (
+        combined.groupby(keys, dropna=False, observed=True, sort=False)[['engagements', 'count']]
+        .sum()
+        .reset_index()
+    )
+
+
+def union_categories(frames, columns):
+    """Gives each categorical column the same categories across `frames`, so concatenating them
+    keeps the categorical dtype instead of falling back to object."""
+    frames = list(frames)
+    for col in columns:
+        parts = [f[col] for f in frames if col in f.columns]
+        if len(parts) < 2 or not all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            continue
+        categories = parts[0].cat.categories
+        for p in parts[1:]:
+            # Append unseen values so the first frame's codes stay valid
+            categories = categories.append(p.cat.categories.difference(categories))
+        for f in frames:
+            if col in f.columns:
+                f[col] = f[col].cat.set_categories(categories)
+    return frames
+
+
+def _merge_cubes(cube, delta_cube):
+    # Only the base rows on days the delta touches are regrouped; the rest is copied as is
+    if not cube['day'].is_monotonic_increasing:
+        cube = cube.sort_values('day', kind='stable', ignore_index=True)
+    days = cube['day'].to_numpy()
+    lo = np.searchsorted(days, delta_cube['day'].min().to_datetime64(), side='left')
+    hi = np.searchsorted(days, delta_cube['day'].max().to_datetime64(), side='right')
+    dims = [c for c in cube.columns if c not in ('day', 'engagements', 'count')]
+    head, overlap, tail, delta_cube = union_categories(
+        [cube.iloc[:lo].copy(), cube.iloc[lo:hi].copy(), cube.iloc[hi:].copy(), delta_cube.copy()], dims
+    )
+    merged = fold_cubes([overlap, delta_cube]).sort_values('day', kind='stable')
+    return pd.concat([head, merged, tail], ignore_index=True)
+
+
+def _add_series(base, delta, counts=False):
+    if base is None or delta is None:
+        return base if delta is None else delta
+    total = base.add(delta, fill_value=0).astype('int64')
+    return total.sort_values(ascending=False, kind='stable') if counts else total
+
+
+def append_to_aggregates(aggs, new_rows):
+    """`aggs` updated with freshly cleaned rows, at a cost that depends on the new rows, not the history.
+
+    The per-chart series are updated by adding the new rows' series, and only the part of the cube
+    on the new rows' days is regrouped.
+    """
+    if new_rows.empty:
+        return aggs
+    delta = compute_aggregates(new_rows)
+    if aggs is None:
+        return delta
+    engagement_by_date = _add_series(aggs.engagement_by_date, delta.engagement_by_date).sort_index()
+    engagement_by_date.index.name = 'date'
+    return DashboardAggregates(
+        total_rows=aggs.total_rows + delta.total_rows,
+        date_min=min(aggs.date_min, delta.date_min),
+        date_max=max(aggs.date_max, delta.date_max),
+        cube=_merge_cubes(aggs.cube, delta.cube),
+        sentiment_counts=_add_series(aggs.sentiment_counts, delta.sentiment_counts, counts=True),
+        engagement_by_date=engagement_by_date,
+        platform_engagements=_add_series(aggs.platform_engagements, delta.platform_engagements),
+        media_type_counts=_add_series(aggs.media_type_counts, delta.media_type_counts, counts=True),
+        location_engagements=_add_series(aggs.location_engagements, delta.location_engagements),
+        rollups=merge_rollups([aggs.rollups, delta.rollups]),
+    )
+
+
+def compute_aggregates(cleaned_df):
+    # The only pass over the full frame: everything else reduces the (much smaller) cube.
+    # Rows with a time of day take a second pass for the hourly rollup, which the day cube cannot give.
+    hourly = hourly_base(cleaned_df)
+    return aggregates_from_cube(
+        build_cube(cleaned_df),
+        total_rows=len(cleaned_df),
+        date_min=cleaned_df['date'].min(),
+        date_max=cleaned_df['date'].max(),
+        rollups=build_pyramid(hourly, 'hour') if hourly is not None else None,
+    )
+
+
+def aggregates_from_cube(cube, total_rows, date_min, date_max, rollups=None):
+    engagement_by_date = cube.groupby('day')['engagements'].sum()
+    engagement_by_date.index = engagement_by_date.index.date
+    engagement_by_date.index.name = 'date'
+
+    return DashboardAggregates(
+        total_rows=total_rows,
+        date_min=date_min,
+        date_max=date_max,
+        cube=cube,
+        sentiment_counts=_counts(cube, 'sentiment') if 'sentiment' in cube.columns else None,
+        engagement_by_date=engagement_by_date,
+        platform_engagements=_sums(cube, 'platform') if 'platform' in cube.columns else None,
+        media_type_counts=_counts(cube, 'media_type') if 'media_type' in cube.columns else None,
+        location_engagements=_sums(cube, 'location') if 'location' in cube.columns else None,
+        rollups=rollups if rollups is not None else rollups_from_cube(cube),
+    )
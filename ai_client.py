@@ -0,0 +1,377 @@
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import time
+
+import httpx
+import openai
+
+from llm_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# Overridable so a local stub server can stand in for OpenRouter
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# Recommended free models on OpenRouter (display name -> model ID), also the fallback order
+RECOMMENDED_MODELS = {
+    "Mistral 7B Instruct": "mistralai/mistral-7b-instruct",
+    "Google Gemini-2.0-flash": "google/gemini-2.0-flash-exp:free",
+    "llama-3.3-8b-instruct": "meta-llama/llama-3.3-8b-instruct:free",
+}
+
+# Generation parameters shared by every insight and recommendation request
+GENERATION_PARAMS = {"temperature": 0.7, "max_tokens": 500}
+# A combined report answers every slot at once, so it needs room for all of them; a lower
+# temperature keeps the JSON it is asked for well formed
+COMBINED_GENERATION_PARAMS = {"temperature": 0.4, "max_tokens": 1500}
+
+# Upper bound on concurrent OpenRouter requests. Six lets a full report (campaign plus five charts)
+# go out in a single wave; free-tier models rate-limit aggressively, so going higher mostly buys 429s.
+MAX_CONCURRENT_REQUESTS = 6
+
+# Connect fast, but give free models a generous read timeout (it also bounds the gap between streamed tokens)
+REQUEST_TIMEOUT = httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=5.0)
+# Keep idle connections around between clicks so follow-up calls skip TCP and TLS setup
+CONNECTION_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=300.0)
+
+# Retry policy: jittered exponential backoff, honouring Retry-After when the server sends one
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+MAX_RETRY_AFTER_SECONDS = 30.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# A model answering with these is saturated; once a fallback is available we retry it only this often
+SATURATED_STATUS_CODES = {429, 502, 503}
+SATURATED_RETRIES_BEFORE_FALLBACK = 1
+
+
+def create_client(api_key):
+    """Sync OpenRouter client with a keep-alive connection pool. Build once per API key and reuse."""
+    return openai.OpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=api_key,
+        timeout=REQUEST_TIMEOUT,
+        # Retries are handled here (with model fallback), not by the SDK
+        max_retries=0,
+        http_client=openai.DefaultHttpxClient(limits=CONNECTION_LIMITS, timeout=REQUEST_TIMEOUT),
+    )
+
+
+def create_async_client(api_key):
+    # Async clients are bound to the event loop they first run on, so these are per batch, not pooled
+    return openai.AsyncOpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=api_key,
+        timeout=REQUEST_TIMEOUT,
+        max_retries=0,
+        http_client=openai.DefaultAsyncHttpxClient(limits=CONNECTION_LIMITS, timeout=REQUEST_TIMEOUT),
+    )
+
+
+def retry_after_seconds(e):
+    """Delay requested by the server via Retry-After / retry-after-ms, or None."""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(e):
+    if isinstance(e, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code in RETRYABLE_STATUS_CODES
+
+
+def _is_saturated(e):
+    return isinstance(e, openai.APIStatusError) and e.status_code in SATURATED_STATUS_CODES
+
+
+def _retry_delay(attempt, e):
+    retry_after = retry_after_seconds(e)
+    if retry_after is not None:
+        return min(retry_after, MAX_RETRY_AFTER_SECONDS)
+    # "Full jitter" keeps concurrent requests from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _fallback_chain(model, fallback_models):
+    """Yields (model, next model or None) in the order they should be tried."""
+    models = [model] + [m for m in fallback_models if m != model]
+    for index, current in enumerate(models):
+        yield current, models[index + 1] if index + 1 < len(models) else None
+
+
+def _next_step(e, attempt, next_model):
+    """Decides what to do after a failed attempt: 'retry', 'fallback' or 'raise'."""
+    if not _is_retryable(e):
+        return "raise"
+    if _is_saturated(e) and next_model is not None:
+        return "retry" if attempt < SATURATED_RETRIES_BEFORE_FALLBACK else "fallback"
+    return "retry" if attempt < MAX_RETRIES else "raise"
+
+
+def call_with_retries(call, model, fallback_models=(), on_fallback=None):
+    """Runs call(model) with backoff, moving down `fallback_models` while models are saturated.
+
+    Returns (model that answered, result).
+    """
+    for current, next_model in _fallback_chain(model, fallback_models):
+        attempt = 0
+        while True:
+            try:
+                return current, call(current)
+            except Exception as e:
+                step = _next_step(e, attempt, next_model)
+                if step == "raise":
+                    raise
+                if step == "fallback":
+                    if on_fallback is not None:
+                        on_fallback(current, next_model, e)
+                    break
+                time.sleep(_retry_delay(attempt, e))
+                attempt += 1
+
+
+async def call_with_retries_async(call, model, fallback_models=(), on_fallback=None):
+    for current, next_model in _fallback_chain(model, fallback_models):
+        attempt = 0
+        while True:
+            try:
+                return current, await call(current)
+            except Exception as e:
+                step = _next_step(e, attempt, next_model)
+                if step == "raise":
+                    raise
+                if step == "fallback":
+                    if on_fallback is not None:
+                        on_fallback(current, next_model, e)
+                    break
+                await asyncio.sleep(_retry_delay(attempt, e))
+                attempt += 1
+
+
+def describe_error(e):
+    """Maps an exception from an AI call to (message for the user, text shown in place of the result)."""
+    if isinstance(e, openai.APIConnectionError):
+        return (
+            f"Could not connect to OpenRouter API: {e}. Please check your internet connection or API key.",
+            "Error: Could not connect to API.",
+        )
+    if isinstance(e, openai.RateLimitError):
+        retry_after = retry_after_seconds(e)
+        wait_hint = f"Try again in {retry_after:.0f}s" if retry_after else "Try again shortly"
+        return (
+            f"OpenRouter rate limit reached (429) for the selected model and its fallbacks. {wait_hint}, or select a different model.",
+            "Error: Rate limited by API.",
+        )
+    if isinstance(e, openai.APIStatusError):
+        return (
+            f"OpenRouter API returned an error: {e.status_code} - {e.response}. Please check your API key or model availability.",
+            "Error: API call failed.",
+        )
+    if isinstance(e, openai.APIError):
+        # An error event sent mid-stream carries a message but no HTTP status
+        return (
+            f"OpenRouter API returned an error: {e.message}. Please check your API key or model availability.",
+            "Error: API call failed.",
+        )
+    return (
+        f"An unexpected error occurred during AI generation: {e}",
+        "Error: Unexpected AI generation error.",
+    )
+
+
+def _messages(prompt):
+    return [{"role": "user", "content": prompt}]
+
+
+def _cached(cache, bypass_cache, model, prompt, params=GENERATION_PARAMS):
+    if cache is None or bypass_cache:
+        return None
+    return cache.get(cache_key(model, prompt, params))
+
+
+def _report(on_metrics, model, started, cached=False, first_token_at=None, usage=None):
+    """Hands one call's latency, time to first token and token usage to the on_metrics callback."""
+    if on_metrics is None:
+        return
+    on_metrics({
+        "model": model,
+        "cached": cached,
+        "seconds": time.perf_counter() - started,
+        "first_token_seconds": first_token_at - started if first_token_at is not None else None,
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+    })
+
+
+def _store(cache, model, prompt, text, params=GENERATION_PARAMS):
+    # Stored under the model that actually answered, so a fallback never masquerades as the requested model
+    if cache is not None and text:
+        cache.set(cache_key(model, prompt, params), text, model=model)
+
+
+def complete(client, prompt, model, cache=None, bypass_cache=False, fallback_models=(), on_fallback=None,
+             on_metrics=None):
+    started = time.perf_counter()
+    text = _cached(cache, bypass_cache, model, prompt)
+    if text is not None:
+        _report(on_metrics, model, started, cached=True)
+        return text
+
+    def _call(current):
+        return client.chat.completions.create(model=current, messages=_messages(prompt), **GENERATION_PARAMS)
+
+    answered_by, response = call_with_retries(_call, model, fallback_models, on_fallback)
+    text = response.choices[0].message.content
+    _report(on_metrics, answered_by, started, usage=response.usage)
+    _store(cache, answered_by, prompt, text)
+    return text
+
+
+async def complete_async(client, prompt, model, cache=None, bypass_cache=False, fallback_models=(), on_fallback=None,
+                         on_metrics=None, params=GENERATION_PARAMS):
+    started = time.perf_counter()
+    text = _cached(cache, bypass_cache, model, prompt, params)
+    if text is not None:
+        _report(on_metrics, model, started, cached=True)
+        return text
+
+    async def _call(current):
+        return await client.chat.completions.create(model=current, messages=_messages(prompt), **params)
+
+    answered_by, response = await call_with_retries_async(_call, model, fallback_models, on_fallback)
+    text = response.choices[0].message.content
+    _report(on_metrics, answered_by, started, usage=response.usage)
+    _store(cache, answered_by, prompt, text, params)
+    return text
+
+
+async def complete_many(client, prompts_by_key, model, max_concurrency=MAX_CONCURRENT_REQUESTS, cache=None,
+                        bypass_cache=False, fallback_models=(), on_fallback=None, on_metrics=None):
+    """Runs every prompt concurrently and yields (key, text, error) in completion order.
+
+    At most `max_concurrency` requests are in flight; `error` is the exception for a failed
+    request (and `text` is None), so one bad response never aborts the rest of the batch.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(key, prompt):
+        async with semaphore:
+            try:
+                text = await complete_async(
+                    client, prompt, model, cache=cache, bypass_cache=bypass_cache,
+                    fallback_models=fallback_models, on_fallback=on_fallback, on_metrics=on_metrics,
+                )
+                return key, text, None
+            except Exception as e:
+                return key, None, e
+
+    tasks = [asyncio.ensure_future(_run(key, prompt)) for key, prompt in prompts_by_key.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def complete_combined(client, combined_prompt, prompts_by_key, parse, model, max_concurrency=MAX_CONCURRENT_REQUESTS,
+                            cache=None, bypass_cache=False, fallback_models=(), on_fallback=None, on_metrics=None):
+    """Answers every key of `prompts_by_key` from one combined request where possible.
+
+    parse(text) splits the combined response into {key: text}. Keys it leaves out (a missing or
+    malformed section, or every key if the combined request fails) are sent as their own prompts
+    through complete_many; a failed combined request is logged first. Yields (key, text, error, combined) in the order answers arrive, where
+    `combined` tells whether the answer came from the combined response.
+    """
+    try:
+        sections = parse(await complete_async(
+            client, combined_prompt, model, cache=cache, bypass_cache=bypass_cache, fallback_models=fallback_models,
+            on_fallback=on_fallback, on_metrics=on_metrics, params=COMBINED_GENERATION_PARAMS,
+        ))
+    except Exception as e:
+        logger.warning("Combined request failed, requesting each section on its own: %s", e, exc_info=e)
+        sections = {}
+    for key in prompts_by_key:
+        if key in sections:
+            yield key, sections[key], None, True
+
+    remaining = {key: prompt for key, prompt in prompts_by_key.items() if key not in sections}
+    if remaining:
+        async for key, text, error in complete_many(
+            client, remaining, model, max_concurrency=max_concurrency, cache=cache, bypass_cache=bypass_cache,
+            fallback_models=fallback_models, on_fallback=on_fallback, on_metrics=on_metrics,
+        ):
+            yield key, text, error, False
+
+
+def _stream_chunks(response):
+    # Once the stream is open the SDK no longer wraps transport failures: a dropped connection or a
+    # stalled read surfaces as the raw httpx error, so it is re-raised as the SDK's own type
+    try:
+        yield from response
+    except httpx.TimeoutException as e:
+        raise openai.APITimeoutError(request=response.response.request) from e
+    except httpx.TransportError as e:
+        raise openai.APIConnectionError(message=f"Connection lost mid-stream: {e}", request=response.response.request) from e
+
+
+def stream(client, prompt, model, cache=None, bypass_cache=False, fallback_models=(), on_fallback=None, on_metrics=None):
+    """Yields the completion text piece by piece as tokens arrive.
+
+    A cached response is yielded in one piece. Opening the stream is retried (with model
+    fallback); a connection dropped after that is raised as openai.APIConnectionError (or
+    APITimeoutError), and an error event from the server as openai.APIError, after the pieces
+    already yielded. Only a completed stream is cached (and reported to on_metrics).
+    """
+    started = time.perf_counter()
+    text = _cached(cache, bypass_cache, model, prompt)
+    if text is not None:
+        _report(on_metrics, model, started, cached=True)
+        yield text
+        return
+
+    def _open(current):
+        # include_usage adds a final chunk (with no choices) carrying the token counts
+        return client.chat.completions.create(
+            model=current, messages=_messages(prompt), stream=True, stream_options={"include_usage": True}, **GENERATION_PARAMS
+        )
+
+    answered_by, response = call_with_retries(_open, model, fallback_models, on_fallback)
+    pieces = []
+    first_token_at = None
+    usage = None
+    try:
+        for chunk in _stream_chunks(response):
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                pieces.append(delta)
+                yield delta
+    finally:
+        response.close()
+
+    _report(on_metrics, answered_by, started, first_token_at=first_token_at, usage=usage)
+    _store(cache, answered_by, prompt, "".join(pieces))
@@ -0,0 +1,231 @@
+"""Headless batch reports for a directory of media intelligence CSVs.
+
+Runs the dashboard's cleaning, aggregations, charts and (optionally) AI insights for every CSV
+without a browser, spreading files across a process pool, and writes <name>.html and
+<name>.json per input plus an index.json summary.
+
+    python batch_report.py exports/ reports/ --workers 8 --ai --model mistralai/mistral-7b-instruct
+"""
+import argparse
+import asyncio
+import glob
+import html
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from plotly.offline import get_plotlyjs_version
+
+import ai_client
+import charts
+import data_pipeline
+import prompts
+import query_backends
+from llm_cache import DEFAULT_CACHE_PATH, ResponseCache
+
+# Shown in place of insights whose prompt the token budget can't cover
+OVER_BUDGET_TEXT = "Not generated: the prompt is over --prompt-token-budget even with its data summary cut."
+# The plotly.js release bundled with the installed plotly, which is what its figure JSON targets
+PLOTLY_CDN = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+
+
+def _series_dict(series):
+    if series is None:
+        return None
+    return {str(k): int(v) for k, v in series.items()}
+
+
+def summarize(dataset, name):
+    aggs = dataset.aggregates
+    return {
+        "source": name,
+        "source_hash": dataset.source_hash,
+        "raw_row_count": dataset.raw_row_count,
+        "cleaned_row_count": dataset.cleaned_row_count,
+        "warnings": dataset.warnings,
+        "dropped_rows": dataset.dropped_rows.to_dict(),
+        "dropped_rows_summary": dataset.dropped_rows.describe(),
+        "date_range": [aggs.date_min.strftime('%Y-%m-%d'), aggs.date_max.strftime('%Y-%m-%d')] if aggs else None,
+        "aggregates": {
+            "sentiment_counts": _series_dict(aggs.sentiment_counts),
+            "engagement_by_date": _series_dict(aggs.engagement_by_date),
+            "platform_engagements": _series_dict(aggs.platform_engagements),
+            "media_type_counts": _series_dict(aggs.media_type_counts),
+            "top_locations": _series_dict(aggs.top_locations(5)) if aggs.location_engagements is not None else None,
+        } if aggs else None,
+    }
+
+
+def generate_insights(prompts_by_slot, api_key, model, cache_path=None, report_prompt=None):
+    """All report prompts for one file, sent concurrently, or answered from one combined call when
+    `report_prompt` is given. Returns ({slot: text}, {key: prompt} for every prompt actually sent)."""
+    cache = ResponseCache(path=cache_path) if cache_path else None
+    fallback_models = [m for m in ai_client.RECOMMENDED_MODELS.values() if m != model]
+
+    async def _run():
+        results = {}
+        sent = {}
+        async_client = ai_client.create_async_client(api_key)
+        try:
+            if report_prompt is None:
+                sent.update(prompts_by_slot)
+                async for slot, text, error in ai_client.complete_many(
+                    async_client, prompts_by_slot, model, cache=cache, fallback_models=fallback_models
+                ):
+                    results[slot] = text if error is None else ai_client.describe_error(error)[1]
+            else:
+                sent[prompts.REPORT_SLOT] = report_prompt
+                async for slot, text, error, combined in ai_client.complete_combined(
+                    async_client, report_prompt, prompts_by_slot,
+                    lambda response: prompts.parse_report_response(response, list(prompts_by_slot)),
+                    model, cache=cache, fallback_models=fallback_models
+                ):
+                    if not combined:
+                        sent[slot] = prompts_by_slot[slot]
+                    results[slot] = text if error is None else ai_client.describe_error(error)[1]
+        finally:
+            await async_client.close()
+        return results, sent
+
+    return asyncio.run(_run())
+
+
+def render_html(summary, figures, insights):
+    title = html.escape(summary["source"])
+    parts = [
+        "<!DOCTYPE html>",
+        "<html><head><meta charset='utf-8'>",
+        f"<title>Media Intelligence Report - {title}</title>",
+        f"<script src='{PLOTLY_CDN}'></script>",
+        "<style>body{font-family:Inter,-apple-system,sans-serif;color:#1C1C1E;background:#F2F2F7;margin:0}"
+        ".page{max-width:1200px;margin:2rem auto;padding:2rem;background:#FFF;border-radius:16px;border:1px solid #E5E5EA}"
+        ".chart-container{border-radius:12px;padding:1.5rem;margin-bottom:2rem;border:1px solid #F0F0F5}"
+        "ul{color:#6B7280}</style>",
+        "</head><body><div class='page'>",
+        f"<h1 style='text-align:center'>Media Intelligence Report: {title}</h1>",
+        f"<p>{summary['raw_row_count']} rows read, {summary['cleaned_row_count']} valid rows after cleaning"
+        + (f" ({summary['date_range'][0]} to {summary['date_range'][1]})." if summary["date_range"] else ".") + "</p>",
+    ]
+    for warning in summary["warnings"]:
+        parts.append(f"<p><strong>Warning:</strong> {html.escape(warning)}</p>")
+    for sentence in summary["dropped_rows_summary"]:
+        parts.append(f"<p>{html.escape(sentence)}</p>")
+    if prompts.CAMPAIGN_SLOT in insights:
+        parts.append(f"<div class='chart-container'><h2>Overall Campaign Recommendation</h2><p>{insights[prompts.CAMPAIGN_SLOT]}</p></div>")
+    for slot, chart_title, _, _ in prompts.CHART_INSIGHTS:
+        if slot not in figures:
+            continue
+        parts.append(f"<div class='chart-container'><h3>{html.escape(chart_title)}</h3>")
+        parts.append(figures[slot].to_html(full_html=False, include_plotlyjs=False))
+        if slot in insights:
+            parts.append(f"<h4>Top 3 Insights:</h4><ul>{insights[slot]}</ul>")
+        parts.append("</div>")
+    parts.append("</div></body></html>")
+    return "\n".join(parts)
+
+
+def process_file(path, output_dir, api_key=None, model=None, cache_path=None, token_budget=prompts.PROMPT_TOKEN_BUDGET, backend="pandas",
+                 one_shot=False):
+    """Builds the HTML and JSON report for one CSV. Runs in a worker process."""
+    started = time.perf_counter()
+    name = os.path.basename(path)
+    stem = os.path.splitext(name)[0]
+    try:
+        if backend != "pandas":
+            # Other backends scan the file in place
+            dataset = query_backends.get_backend(backend).load_dataset(path)
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) > data_pipeline.STREAMING_THRESHOLD_BYTES:
+                dataset = data_pipeline.stream_dataset(data)
+            else:
+                dataset = data_pipeline.load_dataset(data)
+            del data
+
+        summary = summarize(dataset, name)
+        if dataset.aggregates is None:
+            raise data_pipeline.DataCleaningError("No valid data found after cleaning.", dataset.raw_row_count)
+        figures = charts.build_figures(dataset.aggregates)
+        insights = {}
+        sent = {}
+        prompt_tokens = {}
+        if api_key:
+            all_prompts = prompts.build_all_prompts(dataset.aggregates, token_budget)
+            # Prompts the budget can't cover even with their summary cut are not sent
+            over_budget = [slot for slot, prompt in all_prompts.items() if prompts.prompt_over_budget(prompt, token_budget)]
+            for slot in over_budget:
+                del all_prompts[slot]
+            report_prompt = prompts.build_report_prompt(dataset.aggregates, token_budget) if one_shot else None
+            if report_prompt is not None and prompts.prompt_over_budget(report_prompt, token_budget * prompts.REPORT_BUDGET_SCALE):
+                report_prompt = None
+            if all_prompts:
+                insights, sent = generate_insights(all_prompts, api_key, model, cache_path, report_prompt)
+            insights.update({slot: OVER_BUDGET_TEXT for slot in over_budget})
+            prompt_tokens = {key: prompts.estimate_tokens(prompt) for key, prompt in sent.items()}
+
+        report = dict(summary, insights=insights, prompt_tokens=prompt_tokens, figures={slot: json.loads(fig.to_json()) for slot, fig in figures.items()})
+        with open(os.path.join(output_dir, f"{stem}.json"), "w") as f:
+            json.dump(report, f)
+        with open(os.path.join(output_dir, f"{stem}.html"), "w", encoding="utf-8") as f:
+            f.write(render_html(summary, figures, insights))
+        return {
+            "source": name, "status": "ok", "rows": dataset.cleaned_row_count,
+            "prompt_tokens": sum(prompt_tokens.values()), "seconds": time.perf_counter() - started,
+        }
+    except Exception as e:
+        return {"source": name, "status": "error", "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - started}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate static dashboard reports for a directory of CSV files.")
+    parser.add_argument("input_dir", help="Directory containing the CSV exports.")
+    parser.add_argument("output_dir", help="Directory the HTML/JSON reports are written to.")
+    parser.add_argument("--pattern", default="*.csv", help="Glob for input files (default: *.csv).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: one per core).")
+    parser.add_argument("--ai", action="store_true", help="Also generate AI insights (needs an OpenRouter API key).")
+    parser.add_argument("--api-key", default=os.environ.get("OPENROUTER_API_KEY"), help="OpenRouter API key (default: $OPENROUTER_API_KEY).")
+    parser.add_argument("--model", default=next(iter(ai_client.RECOMMENDED_MODELS.values())), help="OpenRouter model ID.")
+    parser.add_argument("--prompt-token-budget", type=int, default=prompts.PROMPT_TOKEN_BUDGET, help="Estimated tokens allowed per prompt, 0 for no limit (default: %(default)s).")
+    parser.add_argument(
+        "--backend", choices=query_backends.available_backends(), default=query_backends.DEFAULT_BACKEND,
+        help="Engine for cleaning and aggregation (default: %(default)s). duckdb is multithreaded itself, so pair it with fewer --workers.",
+    )
+    parser.add_argument("--one-shot", action="store_true", help="Ask for each file's whole AI report in one structured call, re-requesting only sections it misses.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the shared LLM response cache.")
+    args = parser.parse_args(argv)
+
+    if args.ai and not args.api_key:
+        parser.error("--ai needs --api-key or OPENROUTER_API_KEY")
+    paths = sorted(glob.glob(os.path.join(args.input_dir, args.pattern)))
+    if not paths:
+        parser.error(f"no files matching {args.pattern!r} in {args.input_dir}")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    api_key = args.api_key if args.ai else None
+    cache_path = None if args.no_cache else DEFAULT_CACHE_PATH
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [pool.submit(process_file, path, args.output_dir, api_key, args.model, cache_path, args.prompt_token_budget, args.backend, args.one_shot) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["status"] == "ok":
+                detail = f"{result['rows']} rows" + (f", ~{result['prompt_tokens']} prompt tokens" if result["prompt_tokens"] else "")
+            else:
+                detail = result["error"]
+            print(f"[{len(results)}/{len(paths)}] {result['source']}: {result['status']} ({detail}, {result['seconds']:.1f}s)")
+
+    results.sort(key=lambda r: r["source"])
+    with open(os.path.join(args.output_dir, "index.json"), "w") as f:
+        json.dump({"elapsed_seconds": time.perf_counter() - started, "reports": results}, f, indent=2)
+    failed = sum(r["status"] != "ok" for r in results)
+    print(f"Done: {len(results) - failed} reports written, {failed} failed, {time.perf_counter() - started:.1f}s total.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
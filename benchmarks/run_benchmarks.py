@@ -0,0 +1,211 @@
+"""Per-stage timing and peak-memory benchmarks for the dashboard pipeline.
+
+Each stage runs exactly the code the dashboard runs (data_pipeline, aggregates, charts, prompts)
+against synthetic exports, and one JSON line per (row count, stage) is appended to --output so
+results can be compared across versions.
+
+Two peaks are reported per stage. peak_bytes is the Python heap as tracemalloc sees it
+(pandas/NumPy allocations, but not pyarrow's or DuckDB's native buffers). peak_rss_bytes is how
+far the process's resident set rose above its size at the start of the stage. It includes native
+allocations, but it is Linux only (None elsewhere) and misses memory the allocator reuses from
+earlier stages.
+
+    python -m benchmarks.run_benchmarks --rows 10000 100000 1000000 --output bench.jsonl --label my-branch
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import pandas as pd
+
+import aggregates
+import charts
+import data_pipeline
+import prompts
+import query_backends
+import rollups
+from benchmarks.synthetic_data import add_generator_arguments, generator_options, write_csv
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pipeline_stages(data):
+    """Yields (stage name, callable). Each callable consumes the previous stage's state."""
+    state = {}
+
+    def parse():
+        state["df"] = data_pipeline.read_csv_bytes(data)
+
+    def normalize():
+        df = state["df"]
+        df.columns = [data_pipeline.normalize_column_name(c) for c in df.columns]
+        data_pipeline.apply_schema(df)
+
+    def dates():
+        state["df"]["date"] = data_pipeline.coerce_dates(state["df"]["date"])
+
+    def engagements():
+        state["df"]["engagements"] = data_pipeline.coerce_engagements(state["df"]["engagements"])
+
+    def drop_invalid():
+        state["cleaned"] = state["df"].dropna(subset=["date"]).copy()
+        del state["df"]
+
+    def cube():
+        state["cube"] = aggregates.build_cube(state["cleaned"])
+
+    def derive(name, fn):
+        def _run():
+            state[name] = fn(state["cube"])
+        return _run
+
+    def aggs():
+        cleaned = state["cleaned"]
+        state["aggs"] = aggregates.aggregates_from_cube(
+            state["cube"], len(cleaned), cleaned["date"].min(), cleaned["date"].max()
+        )
+
+    def figure(builder):
+        def _run():
+            builder(state["aggs"])
+        return _run
+
+    def prompt_assembly():
+        prompts.build_all_prompts(state["aggs"])
+
+    yield "csv_parse", parse
+    yield "normalize_schema", normalize
+    yield "date_coercion", dates
+    yield "engagement_coercion", engagements
+    yield "drop_invalid_rows", drop_invalid
+    yield "aggregate_cube", cube
+    yield "agg_sentiment_counts", derive("sentiment", lambda c: aggregates._counts(c, "sentiment"))
+    yield "agg_engagement_by_date", derive("daily", lambda c: c.groupby("day")["engagements"].sum())
+    yield "agg_platform_engagements", derive("platform", lambda c: aggregates._sums(c, "platform"))
+    yield "agg_media_type_counts", derive("media_type", lambda c: aggregates._counts(c, "media_type"))
+    yield "agg_location_engagements", derive("location", lambda c: aggregates._sums(c, "location").nlargest(5))
+    yield "agg_time_rollups", derive("rollups", rollups.rollups_from_cube)
+    yield "aggregates_from_cube", aggs
+    for slot, builder in charts.FIGURE_BUILDERS.items():
+        yield f"figure_{slot}", figure(builder)
+    yield "prompt_assembly", prompt_assembly
+    if query_backends.DuckDBBackend.available():
+        # The whole load (parse, clean, cube, rollups) in DuckDB, for comparison with the stages above
+        yield "duckdb_load_dataset", lambda: query_backends.get_backend("duckdb").load_dataset(data)
+
+
+def _rss_status(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def _start_rss_peak():
+    """Resets the kernel's peak-RSS mark to the current RSS and returns that, or None where unsupported."""
+    try:
+        # Writing 5 to clear_refs resets VmHWM (Linux 4.0+)
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _rss_status("VmRSS")
+    except OSError:
+        return None
+
+
+def run_pipeline(data, trace_memory):
+    """Runs every stage once; returns {stage: (seconds, peak heap bytes or None, peak RSS growth or None)}."""
+    results = {}
+    for stage, fn in pipeline_stages(data):
+        rss_start = _start_rss_peak()
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        peak_rss = _rss_status("VmHWM") - rss_start if rss_start is not None else None
+        results[stage] = (elapsed, peak, peak_rss)
+    return results
+
+
+def benchmark(data, repeat):
+    # Timing and RSS come from untraced passes (tracemalloc slows Python-heavy stages and adds
+    # its own bookkeeping to RSS); the Python heap peak is a separate, traced pass
+    timings = [run_pipeline(data, trace_memory=False) for _ in range(repeat)]
+    memory = run_pipeline(data, trace_memory=True)
+    for stage in memory:
+        peaks_rss = [t[stage][2] for t in timings if t[stage][2] is not None]
+        yield stage, min(t[stage][0] for t in timings), memory[stage][1], max(peaks_rss) if peaks_rss else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the dashboard pipeline on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Row counts to benchmark.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions per size; the best is reported.")
+    parser.add_argument("--output", help="JSON-lines file results are appended to.")
+    parser.add_argument("--label", default=None, help="Free-form label stored with each result (e.g. branch name).")
+    parser.add_argument("--data-dir", default=None, help="Where generated CSVs are kept (default: a temp dir).")
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="mediaintel-bench-")
+    os.makedirs(data_dir, exist_ok=True)
+    options = generator_options(args)
+    run_info = {
+        "run_id": uuid.uuid4().hex[:12],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "label": args.label,
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "parser_engine": data_pipeline.PARSER_ENGINE,
+        "generator": options,
+    }
+
+    output = open(args.output, "a") if args.output else None
+    try:
+        for rows in args.rows:
+            path = os.path.join(data_dir, f"synthetic_{rows}_{options['seed']}.csv")
+            if not os.path.exists(path):
+                write_csv(path, rows, **options)
+            with open(path, "rb") as f:
+                data = f.read()
+
+            print(f"\n{rows:,} rows ({len(data) / 1e6:.1f} MB CSV)")
+            print(f"{'stage':<28}{'seconds':>10}{'heap MB':>10}{'RSS MB':>10}")
+            for stage, seconds, peak, peak_rss in benchmark(data, max(1, args.repeat)):
+                rss_column = f"{peak_rss / 1e6:>10.1f}" if peak_rss is not None else f"{'n/a':>10}"
+                print(f"{stage:<28}{seconds:>10.4f}{peak / 1e6:>10.1f}{rss_column}")
+                record = dict(
+                    run_info, rows=rows, csv_bytes=len(data), stage=stage, seconds=seconds, peak_bytes=peak,
+                    peak_rss_bytes=peak_rss,
+                )
+                if output:
+                    output.write(json.dumps(record) + "\n")
+    finally:
+        if output:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Synthetic media intelligence exports with the dashboard's columns.
+
+    python -m benchmarks.synthetic_data data.csv --rows 1000000 --locations 200 --skew 1.2
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+PLATFORMS = ["Twitter", "Facebook", "Instagram", "News Site", "TikTok", "YouTube", "LinkedIn", "Reddit", "Blog", "Forum"]
+SENTIMENTS = ["Positive", "Neutral", "Negative"]
+MEDIA_TYPES = ["Text", "Image", "Video", "Link", "Audio", "Carousel"]
+MALFORMED_DATES = ["not a date", "2024-13-45", "", "N/A", "31/31/2024"]
+
+# Rows generated per batch; keeps memory flat when writing tens of millions of rows
+GENERATION_CHUNK_ROWS = 1_000_000
+
+
+def _labels(prefix, base, count):
+    if count <= len(base):
+        return list(base[:count])
+    return list(base) + [f"{prefix} {i}" for i in range(len(base) + 1, count + 1)]
+
+
+def _zipf_weights(count, skew):
+    # skew=0 is uniform; larger values concentrate rows on the first few categories
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    return weights / weights.sum()
+
+
+def generate_chunks(rows, platforms=6, locations=50, media_types=4, start="2023-01-01", days=365,
+                    malformed_date_rate=0.01, missing_engagement_rate=0.02, skew=1.0, seed=0,
+                    chunk_rows=GENERATION_CHUNK_ROWS):
+    """Yields DataFrames with the raw CSV columns (Date, Platform, Sentiment, Location, Engagements, Media Type)."""
+    rng = np.random.default_rng(seed)
+    platform_labels = np.array(_labels("Platform", PLATFORMS, platforms))
+    location_labels = np.array([f"City {i}" for i in range(1, locations + 1)])
+    media_labels = np.array(_labels("Media", MEDIA_TYPES, media_types))
+    start = pd.Timestamp(start)
+
+    remaining = rows
+    while remaining > 0:
+        n = min(chunk_rows, remaining)
+        remaining -= n
+
+        dates = (start + pd.to_timedelta(rng.integers(0, days, n), unit="D")).strftime("%Y-%m-%d").to_numpy(dtype=object)
+        malformed = rng.random(n) < malformed_date_rate
+        dates[malformed] = rng.choice(MALFORMED_DATES, malformed.sum())
+
+        # Heavy-tailed engagement counts, with blanks where the export had no value
+        engagements = rng.lognormal(mean=3.0, sigma=1.5, size=n).astype(np.int64).astype(object)
+        engagements[rng.random(n) < missing_engagement_rate] = ""
+
+        yield pd.DataFrame({
+            "Date": dates,
+            "Platform": rng.choice(platform_labels, n, p=_zipf_weights(len(platform_labels), skew)),
+            "Sentiment": rng.choice(SENTIMENTS, n, p=[0.45, 0.35, 0.20]),
+            "Location": rng.choice(location_labels, n, p=_zipf_weights(len(location_labels), skew)),
+            "Engagements": engagements,
+            "Media Type": rng.choice(media_labels, n, p=_zipf_weights(len(media_labels), skew)),
+        })
+
+
+def write_csv(path, rows, **options):
+    for i, chunk in enumerate(generate_chunks(rows, **options)):
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return path
+
+
+def add_generator_arguments(parser):
+    parser.add_argument("--platforms", type=int, default=6, help="Distinct platforms (default: 6).")
+    parser.add_argument("--locations", type=int, default=50, help="Distinct locations (default: 50).")
+    parser.add_argument("--media-types", type=int, default=4, help="Distinct media types (default: 4).")
+    parser.add_argument("--days", type=int, default=365, help="Date span in days (default: 365).")
+    parser.add_argument("--malformed-date-rate", type=float, default=0.01, help="Share of rows with unparseable dates.")
+    parser.add_argument("--missing-engagement-rate", type=float, default=0.02, help="Share of rows with blank engagements.")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent for category frequencies (0 = uniform).")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generator_options(args):
+    return {
+        "platforms": args.platforms,
+        "locations": args.locations,
+        "media_types": args.media_types,
+        "days": args.days,
+        "malformed_date_rate": args.malformed_date_rate,
+        "missing_engagement_rate": args.missing_engagement_rate,
+        "skew": args.skew,
+        "seed": args.seed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic media intelligence CSV.")
+    parser.add_argument("path", help="Output CSV path.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+    write_csv(args.path, args.rows, **generator_options(args))
+    print(f"Wrote {args.rows} rows to {args.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
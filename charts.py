@@ -0,0 +1,195 @@
+import json
+
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import downsampling
+from prompts import CHART_INSIGHTS
+
+# The engagement trend is downsampled (LTTB) to this many points, so the figure payload and
+# browser render time stay flat however long the date range is
+TREND_POINT_BUDGET = 1500
+# Upper bound when full resolution is requested for a zoom window
+TREND_FULL_RESOLUTION_LIMIT = 100_000
+# Above this many points the trend is drawn with WebGL (Scattergl) instead of SVG, without markers
+WEBGL_POINT_THRESHOLD = 1000
+
+# --- Apple Color Palette ---
+apple_colors = {
+    'blue': '#007AFF',
+    'green': '#34C759',
+    'red': '#FF3B30',
+    'orange': '#FF9500',
+    'purple': '#AF52DE',
+    'gray': '#8E8E93',
+    'lightGray': '#E5E5EA',
+    'darkGray': '#1C1C1E'
+}
+# Line colors when the trend is split by platform or sentiment
+trend_split_colors = [apple_colors[c] for c in ('blue', 'green', 'orange', 'purple', 'red', 'gray')]
+SPLIT_LABELS = {'platform': 'Platform', 'sentiment': 'Sentiment'}
+
+# The Apple styling, shared by every chart: plotly's default template with the palette, fonts,
+# transparent backgrounds and light grid on top. Registered as "apple" for use elsewhere.
+APPLE_TEMPLATE = go.layout.Template(pio.templates['plotly'])
+APPLE_TEMPLATE.layout.update(
+    font_family="Inter",
+    title_font_color=apple_colors['darkGray'],
+    title_x=0.5,
+    paper_bgcolor='rgba(0,0,0,0)',
+    plot_bgcolor='rgba(0,0,0,0)',
+    legend=dict(bgcolor='rgba(255,255,255,0.7)', bordercolor=apple_colors['lightGray'], borderwidth=1, font=dict(color=apple_colors['darkGray'])),
+)
+APPLE_TEMPLATE.layout.xaxis.update(
+    title_font_color=apple_colors['gray'], tickfont_color=apple_colors['gray'],
+    gridcolor=apple_colors['lightGray'], linecolor=apple_colors['lightGray'],
+)
+APPLE_TEMPLATE.layout.yaxis.update(
+    title_font_color=apple_colors['gray'], tickfont_color=apple_colors['gray'],
+    gridcolor=apple_colors['lightGray'], linecolor=apple_colors['lightGray'],
+)
+pio.templates['apple'] = APPLE_TEMPLATE
+_TEMPLATE = APPLE_TEMPLATE.to_plotly_json()
+
+
+def _figure(data, **layout):
+    # Plain trace and layout dicts with validation off: these specs are fixed and known good,
+    # and validating them (as plotly.express does) is most of the cost of building a figure
+    return go.Figure({'data': data, 'layout': dict(template=_TEMPLATE, **layout)}, _validate=False)
+
+
+def _pie(series, label, value, title, colors):
+    return _figure(
+        [{
+            'type': 'pie',
+            'labels': series.index.tolist(),
+            'values': series.to_numpy(),
+            'hole': 0.4,
+            'hovertemplate': f"{label}=%{{label}}<br>{value}=%{{value}}<extra></extra>",
+        }],
+        title=dict(text=title),
+        piecolorway=colors,
+    )
+
+
+def _bar(series, label, title, color):
+    return _figure(
+        [{
+            'type': 'bar',
+            'x': series.index.tolist(),
+            'y': series.to_numpy(),
+            'marker': {'color': color},
+            'hovertemplate': f"{label}=%{{x}}<br>Total Engagements=%{{y}}<extra></extra>",
+        }],
+        title=dict(text=title),
+        xaxis=dict(title=dict(text=label)),
+        yaxis=dict(title=dict(text='Total Engagements')),
+    )
+
+
+def sentiment_figure(aggs):
+    return _pie(
+        aggs.sentiment_counts, 'Sentiment', 'Count', 'Sentiment Breakdown',
+        [apple_colors['red'], apple_colors['orange'], apple_colors['green'], apple_colors['gray']],
+    )
+
+
+def trend_series(aggs, window=None, granularity='day', split=None):
+    """The full-resolution engagement series the trend is drawn from, read from the precomputed
+    rollups at `granularity` (one column per value of `split` if given) and optionally cut to a
+    (start, end) day window."""
+    if aggs.rollups is not None:
+        return aggs.rollups.series(granularity, window, split)
+    series = aggs.engagement_by_date
+    return downsampling.window(series, *window) if window is not None else series
+
+
+def trend_points(aggs, window=None, max_points=TREND_POINT_BUDGET, granularity='day', split=None):
+    """trend_series(), downsampled to max_points unless that is None."""
+    series = trend_series(aggs, window, granularity, split)
+    return series if max_points is None else downsampling.lttb(series, max_points)
+
+
+def engagement_trend_figure(aggs, window=None, max_points=TREND_POINT_BUDGET, granularity='day', split=None):
+    points = trend_points(aggs, window, max_points, granularity, split)
+    label = SPLIT_LABELS.get(split, split)
+    if isinstance(points, pd.DataFrame):
+        lines = [(str(name), points[name], trend_split_colors[i % len(trend_split_colors)]) for i, name in enumerate(points.columns)]
+    else:
+        lines = [('', points, apple_colors['blue'])]
+    webgl = len(points) * len(lines) > WEBGL_POINT_THRESHOLD
+    traces = []
+    for name, series, color in lines:
+        trace = {
+            'type': 'scattergl' if webgl else 'scatter',
+            'x': series.index.tolist() if not isinstance(series.index, pd.DatetimeIndex) else series.index.to_numpy(),
+            'y': series.to_numpy(),
+            'name': name,
+            'legendgroup': name,
+            'showlegend': label is not None,
+            'line': {'color': color},
+            'mode': 'lines' if webgl else 'lines+markers',
+            'hovertemplate': (f"{label}={name}<br>" if label is not None else "") + "Date=%{x}<br>Total Engagements=%{y}<extra></extra>",
+        }
+        if not webgl:
+            trace['marker'] = {'symbol': 'circle-open', 'size': 6}
+            if label is None:
+                trace['marker']['line'] = {'width': 1, 'color': color}
+        traces.append(trace)
+    return _figure(
+        traces,
+        title=dict(text='Engagement Trend Over Time'),
+        xaxis=dict(title=dict(text='Date')),
+        yaxis=dict(title=dict(text='Total Engagements')),
+        legend=dict(title=dict(text=label)) if label is not None else {},
+    )
+
+
+def platform_figure(aggs):
+    return _bar(aggs.platform_engagements, 'Platform', 'Platform Engagements', apple_colors['purple'])
+
+
+def media_type_figure(aggs):
+    return _pie(
+        aggs.media_type_counts, 'Media Type', 'Count', 'Media Type Mix',
+        [apple_colors['orange'], apple_colors['green'], apple_colors['blue'], apple_colors['gray']],
+    )
+
+
+def locations_figure(aggs):
+    return _bar(aggs.top_locations(5), 'Location', 'Top 5 Locations by Engagement', apple_colors['blue'])
+
+
+# Figure builders keyed by the chart's insight slot (see prompts.CHART_INSIGHTS)
+FIGURE_BUILDERS = {
+    "sentiment": sentiment_figure,
+    "engagement_trend": engagement_trend_figure,
+    "platform": platform_figure,
+    "media_type": media_type_figure,
+    "locations": locations_figure,
+}
+
+
+# What each chart is drawn from, keyed like FIGURE_BUILDERS (the figure cache hashes it)
+FIGURE_INPUTS = {
+    "sentiment": lambda aggs: aggs.sentiment_counts,
+    "engagement_trend": trend_series,
+    "platform": lambda aggs: aggs.platform_engagements,
+    "media_type": lambda aggs: aggs.media_type_counts,
+    "locations": lambda aggs: aggs.top_locations(5),
+}
+
+
+def figure_from_json(spec):
+    """A Figure for cached figure JSON, without re-validating it."""
+    return go.Figure(json.loads(spec), _validate=False)
+
+
+def build_figures(aggs):
+    """Every chart whose data is present, keyed by slot."""
+    figures = {}
+    for slot, _, _, required in CHART_INSIGHTS:
+        if getattr(aggs, required) is not None:
+            figures[slot] = FIGURE_BUILDERS[slot](aggs)
+    return figures
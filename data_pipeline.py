@@ -0,0 +1,559 @@
+import datetime
+import hashlib
+import importlib.util
+import io
+import sys
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from aggregates import (
+    aggregates_from_cube, append_to_aggregates, build_cube, compute_aggregates, fold_cubes, union_categories
+)
+from rollups import merge_rollups, rollups_from_rows
+
+# Version of the cleaning rules and the Dataset/aggregates layout. Anything persisted from a
+# Dataset (snapshots) records it, and a mismatch is treated as a miss, so bump it whenever a change
+# would make an earlier run clean the same file differently
+PIPELINE_VERSION = 3
+
+# Rows per chunk in streaming mode; peak memory scales with this, not with the file size
+STREAMING_CHUNK_ROWS = 250_000
+# Uploads larger than this default to streaming ingest
+STREAMING_THRESHOLD_BYTES = 500 * 1024 * 1024
+
+# Typed schema for the expected (normalized) columns. Dimensions are low-cardinality strings,
+# so categoricals store them as small integer codes plus one copy of each distinct value.
+DIMENSION_COLUMNS = ['platform', 'sentiment', 'media_type', 'location']
+SCHEMA = {
+    # One resolution however the dates arrive (pyarrow types ISO dates itself, at second resolution)
+    'date': 'datetime64[us]',
+    'platform': 'category',
+    'sentiment': 'category',
+    'media_type': 'category',
+    'location': 'category',
+    'engagements': 'int32',
+}
+
+# Explicit formats tried against a sample of the distinct date strings; the one parsing the most wins,
+# so day-first and month-first exports are told apart by values like 31/01 vs 01/31. On a tie the
+# earlier one wins: month-first comes first, so a sample of only ambiguous dates (01/02/2024) reads
+# as pandas reads it, 2 January
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y/%m/%d',
+    '%m/%d/%Y',
+    '%d/%m/%Y',
+    '%m-%d-%Y',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%d %b %Y',
+    '%b %d, %Y',
+    '%m/%d/%Y %H:%M',
+    '%d/%m/%Y %H:%M',
+]
+DAY_FIRST_FORMATS = {fmt for fmt in DATE_FORMATS if fmt.startswith('%d')}
+DATE_SAMPLE_SIZE = 500
+
+# Reasons a row is dropped during cleaning
+MISSING_DATE = 'missing_date'
+UNPARSEABLE_DATE = 'unparseable_date'
+DUPLICATE_ROW = 'duplicate_row'
+DROP_REASON_LABELS = {
+    MISSING_DATE: 'no date',
+    UNPARSEABLE_DATE: 'an unparseable date',
+    DUPLICATE_ROW: 'a duplicate key',
+}
+
+# pyarrow's multithreaded CSV reader is several times faster than the C engine when installed
+PARSER_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+
+# Strings pandas' CSV readers treat as missing; the pyarrow reader and DuckDB are given the same
+# list so every backend drops and zero-fills the same cells
+NA_STRINGS = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+
+class CSVReadError(Exception):
+    """Raised when the uploaded bytes cannot be parsed as CSV."""
+
+
+class DataCleaningError(Exception):
+    """Raised when the parsed CSV cannot be normalized into the dashboard schema."""
+
+    def __init__(self, cause, raw_row_count=None):
+        super().__init__(cause)
+        self.raw_row_count = raw_row_count
+
+
+@dataclass
+class DroppedRows:
+    """Rows removed during cleaning: counts and a few example raw values per reason."""
+    counts: dict = field(default_factory=dict)
+    examples: dict = field(default_factory=dict)
+
+    MAX_EXAMPLES = 3
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def add(self, reason, count, examples=()):
+        if not count:
+            return
+        self.counts[reason] = self.counts.get(reason, 0) + int(count)
+        kept = self.examples.setdefault(reason, [])
+        kept.extend(e for e in examples if e not in kept)
+        del kept[self.MAX_EXAMPLES:]
+
+    def merge(self, other):
+        for reason, count in other.counts.items():
+            self.add(reason, count, other.examples.get(reason, ()))
+
+    def describe(self):
+        """One sentence per reason, e.g. "12 rows dropped with an unparseable date (e.g. 'N/A')"."""
+        sentences = []
+        for reason, count in self.counts.items():
+            examples = self.examples.get(reason)
+            example_text = f" (e.g. {', '.join(repr(e) for e in examples)})" if examples else ""
+            sentences.append(f"{count} rows dropped with {DROP_REASON_LABELS.get(reason, reason)}{example_text}.")
+        return sentences
+
+    def to_dict(self):
+        return {'counts': self.counts, 'examples': self.examples}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(counts=dict(data.get('counts', {})), examples=dict(data.get('examples', {})))
+
+
+@dataclass
+class Dataset:
+    source_hash: str
+    raw_row_count: int
+    cleaned_row_count: int
+    # None in streaming mode, where only the aggregates are retained
+    cleaned_df: pd.DataFrame
+    warnings: list = field(default_factory=list)
+    # Computed once at load time so charts and prompts share it across reruns
+    aggregates: object = None
+    dropped_rows: DroppedRows = field(default_factory=DroppedRows)
+    # (key columns, sorted uint64 row-key hashes) kept by append_dataset for duplicate detection
+    row_keys: tuple = None
+
+
+def content_hash(data):
+    # blake2b is considerably faster than sha256 on large uploads and 128 bits is plenty for a cache key
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_content_hash(path, chunk_bytes=16 * 1024 * 1024):
+    """content_hash() of a file's bytes, read in chunks so large sources are never held in memory."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_column_name(name):
+    return str(name).strip().lower().replace(' ', '_')
+
+
+def duplicate_columns_warning(names):
+    """Warning for headers that normalize to the same name (e.g. "Media Type" and "media type");
+    every ingest path keeps only the first such column."""
+    return f"Duplicate column(s) after normalizing headers: {', '.join(sorted(set(names)))}. Only the first of each was used."
+
+
+def naive_utc(values):
+    """Datetimes for `values` with any UTC offset applied and dropped, so every path ends up with
+    naive UTC times whether a source typed its dates as tz-aware or not."""
+    return pd.to_datetime(values, errors='coerce', utc=True).dt.tz_localize(None)
+
+
+def _dimension_dtypes(data):
+    # Map the raw header names (e.g. "Media Type") to categorical so the C engine never builds string columns
+    header = pd.read_csv(io.BytesIO(data), nrows=0).columns
+    return {raw: 'category' for raw in header if normalize_column_name(raw) in DIMENSION_COLUMNS}
+
+
+def _read_csv_pyarrow(data):
+    # pandas' pyarrow engine infers every column's type before it applies dtype=, so a Location of
+    # "01234" would already be the number 1234; pyarrow itself is told to read the dimensions as text
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    dimensions = _dimension_dtypes(data)
+    convert_options = pa_csv.ConvertOptions(
+        column_types={raw: pa.string() for raw in dimensions}, null_values=NA_STRINGS, strings_can_be_null=True
+    )
+    df = pa_csv.read_csv(io.BytesIO(data), convert_options=convert_options).to_pandas()
+    return df.astype({raw: dtype for raw, dtype in dimensions.items() if raw in df.columns})
+
+
+def read_csv_bytes(data, engine=None):
+    engine = engine or PARSER_ENGINE
+    try:
+        if engine == 'pyarrow':
+            try:
+                return _read_csv_pyarrow(data)
+            except Exception:
+                # pyarrow is stricter about malformed rows; the C engine gets the final say
+                pass
+        return pd.read_csv(io.BytesIO(data), dtype=_dimension_dtypes(data))
+    except Exception as e:
+        raise CSVReadError(e) from e
+
+
+def detect_date_format(values):
+    """The DATE_FORMATS entry that parses most of `values` (a sample of date strings), or None."""
+    values = pd.Series(values, dtype=object).dropna()
+    best, best_parsed = None, 0
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(values, format=fmt, errors='coerce').notna().sum()
+        if parsed > best_parsed:
+            best, best_parsed = fmt, parsed
+            if parsed == len(values):
+                break
+    return best
+
+
+def parse_dates(values):
+    """Parses a date column and returns (datetimes with NaT for failures, DroppedRows).
+
+    Exports repeat a few thousand distinct date strings across millions of rows, so only the
+    distinct values are parsed, with a format detected from a sample of them, and the results are
+    mapped back by code. Values the detected format rejects get a per-value parse of their own,
+    and whatever still fails becomes NaT, as with pd.to_datetime(errors='coerce').
+    """
+    dropped = DroppedRows()
+    first = values.first_valid_index()
+    if pd.api.types.is_datetime64_any_dtype(values) or (first is not None and isinstance(values[first], datetime.date)):
+        # pyarrow already typed the column (it only does so when every value parsed as a date)
+        parsed = naive_utc(values).astype(SCHEMA['date'])
+        dropped.add(MISSING_DATE, parsed.isna().sum())
+        return parsed, dropped
+
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    uniques, parsed = parse_distinct_dates(uniques)
+
+    # Map back: code -1 (missing) picks the trailing NaT
+    lookup = np.append(parsed.to_numpy(), np.datetime64('NaT'))
+    result = pd.Series(lookup[codes], index=values.index, name=values.name)
+
+    rows_per_value = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return result, count_date_drops(uniques, parsed, rows_per_value, (codes == -1).sum())
+
+
+def parse_distinct_dates(uniques):
+    """Parses distinct date strings, in order of first appearance. Returns (stripped strings, datetimes).
+
+    The format is detected from the first DATE_SAMPLE_SIZE values; values it rejects get a
+    per-value parse of their own, and whatever still fails is NaT. Values with a UTC offset
+    (a trailing Z or +hh:mm) are converted to UTC, so every result is naive UTC time.
+    """
+    uniques = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.strip()
+    fmt = detect_date_format(uniques.head(DATE_SAMPLE_SIZE))
+    if fmt is not None:
+        parsed = pd.to_datetime(uniques, format=fmt, errors='coerce')
+    else:
+        parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+    failed = parsed.isna().to_numpy()
+    if failed.any():
+        # Per-value fallback for anything outside the detected format, reading ambiguous days and
+        # months in the same order as it; offsets may differ per value, so they are normalized to
+        # UTC and dropped rather than kept as a tz-aware dtype
+        parsed[failed] = pd.to_datetime(
+            uniques[failed], errors='coerce', format='mixed', dayfirst=fmt in DAY_FIRST_FORMATS, utc=True
+        ).dt.tz_localize(None)
+    return uniques, parsed.astype(SCHEMA['date'])
+
+
+def count_date_drops(uniques, parsed, rows_per_value, missing_rows):
+    """DroppedRows for a parsed date column, given the rows behind each distinct value and the rows with none."""
+    dropped = DroppedRows()
+    dropped.add(MISSING_DATE, missing_rows)
+    failed = parsed.isna().to_numpy()
+    if failed.any():
+        failed_counts = pd.Series(np.asarray(rows_per_value)[failed], index=uniques[failed].to_numpy()).sort_values(ascending=False)
+        dropped.add(UNPARSEABLE_DATE, failed_counts.sum(), failed_counts.index[:DroppedRows.MAX_EXAMPLES])
+    return dropped
+
+
+def coerce_dates(values):
+    # Convert 'Date' to datetime, coercing errors to NaT
+    return parse_dates(values)[0]
+
+
+def coerce_engagements(values):
+    # Non-numeric and non-finite ("inf") counts become 0, like missing ones
+    values = pd.to_numeric(values, errors='coerce').replace([np.inf, -np.inf], np.nan).fillna(0).astype('int64')
+    info = np.iinfo(SCHEMA['engagements'])
+    if values.empty or (values.min() >= info.min and values.max() <= info.max):
+        return values.astype(SCHEMA['engagements'])
+    return values
+
+
+def apply_schema(df):
+    """Casts dimension columns to categoricals in place; engagements and date are typed during cleaning."""
+    for col in DIMENSION_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def clean_media_data(df, dropped_rows=None):
+    """Normalizes a raw upload in place and returns (cleaned_df, warnings).
+
+    Rows removed along the way are counted into `dropped_rows` when one is given.
+    """
+    warnings = []
+
+    # Normalize column names
+    with metrics.stage('normalize_schema'):
+        df.columns = [normalize_column_name(c) for c in df.columns]
+        duplicated = df.columns.duplicated()
+        if duplicated.any():
+            warnings.append(duplicate_columns_warning(df.columns[duplicated]))
+            df = df.loc[:, ~duplicated]
+        apply_schema(df)
+
+    with metrics.stage('date_coercion'):
+        df['date'], date_drops = parse_dates(df['date'])
+    if dropped_rows is not None:
+        dropped_rows.merge(date_drops)
+
+    # Fill missing 'Engagements' with 0
+    with metrics.stage('engagement_coercion'):
+        if 'engagements' in df.columns:
+            df['engagements'] = coerce_engagements(df['engagements'])
+        else:
+            warnings.append("'Engagements' column not found. Some charts may not display correctly.")
+            df['engagements'] = np.zeros(len(df), dtype=SCHEMA['engagements']) # Add a placeholder column
+
+    # Filter out rows where date conversion failed
+    with metrics.stage('drop_invalid_rows'):
+        cleaned_df = df.dropna(subset=['date']).copy() # Use .copy() to avoid SettingWithCopyWarning
+    return cleaned_df, warnings
+
+
+def load_dataset(data, source_hash=None):
+    """Reads and cleans raw CSV bytes. Pure: the same bytes always give the same Dataset."""
+    with metrics.stage('csv_parse'):
+        df = read_csv_bytes(data)
+    return load_frame(df, source_hash or content_hash(data))
+
+
+def load_frame(df, source_hash):
+    """Cleans and aggregates an already parsed raw frame (e.g. a Parquet export); modifies `df` in place."""
+    raw_row_count = len(df)
+    dropped_rows = DroppedRows()
+    try:
+        cleaned_df, warnings = clean_media_data(df, dropped_rows)
+    except Exception as e:
+        raise DataCleaningError(e, raw_row_count) from e
+    with metrics.stage('aggregation'):
+        aggregates = compute_aggregates(cleaned_df) if not cleaned_df.empty else None
+    return Dataset(
+        source_hash=source_hash,
+        raw_row_count=raw_row_count,
+        cleaned_row_count=len(cleaned_df),
+        cleaned_df=cleaned_df,
+        warnings=warnings,
+        aggregates=aggregates,
+        dropped_rows=dropped_rows,
+    )
+
+
+def stream_dataset(data, source_hash=None, chunk_rows=STREAMING_CHUNK_ROWS):
+    """Reads and cleans CSV bytes chunk by chunk, folding each chunk into running aggregates.
+
+    The full frame is never materialized; the returned Dataset has cleaned_df=None.
+    """
+    try:
+        # pyarrow cannot stream in chunks, so streaming always uses the C engine
+        reader = pd.read_csv(io.BytesIO(data), chunksize=chunk_rows, dtype=_dimension_dtypes(data))
+    except Exception as e:
+        raise CSVReadError(e) from e
+
+    raw_row_count = 0
+    cleaned_row_count = 0
+    date_min = date_max = pd.NaT
+    warnings = []
+    dropped_rows = DroppedRows()
+    cubes = []
+    rollup_parts = []
+    while True:
+        try:
+            with metrics.stage('csv_parse'):
+                chunk = next(reader)
+        except StopIteration:
+            break
+        except Exception as e:
+            raise CSVReadError(e) from e
+        raw_row_count += len(chunk)
+        try:
+            cleaned_chunk, chunk_warnings = clean_media_data(chunk, dropped_rows)
+        except Exception as e:
+            raise DataCleaningError(e, raw_row_count) from e
+        warnings.extend(w for w in chunk_warnings if w not in warnings)
+        if cleaned_chunk.empty:
+            continue
+
+        cleaned_row_count += len(cleaned_chunk)
+        chunk_min, chunk_max = cleaned_chunk['date'].min(), cleaned_chunk['date'].max()
+        date_min = chunk_min if pd.isna(date_min) else min(date_min, chunk_min)
+        date_max = chunk_max if pd.isna(date_max) else max(date_max, chunk_max)
+        # Fold eagerly so at most two partial cubes are alive at once
+        with metrics.stage('aggregation'):
+            chunk_cube = build_cube(cleaned_chunk)
+            rollup_parts = [merge_rollups(rollup_parts + [rollups_from_rows(cleaned_chunk, chunk_cube)])]
+            cubes = [fold_cubes(cubes + [chunk_cube])]
+        del chunk, cleaned_chunk
+
+    aggregates = None
+    if cleaned_row_count:
+        with metrics.stage('aggregation'):
+            aggregates = aggregates_from_cube(
+                cubes[0], total_rows=cleaned_row_count, date_min=date_min, date_max=date_max, rollups=rollup_parts[0]
+            )
+    return Dataset(
+        source_hash=source_hash or content_hash(data),
+        raw_row_count=raw_row_count,
+        cleaned_row_count=cleaned_row_count,
+        cleaned_df=None,
+        warnings=warnings,
+        aggregates=aggregates,
+        dropped_rows=dropped_rows,
+    )
+
+
+def default_dedup_key(columns):
+    """Every schema column present: a row only counts as a duplicate if all of its fields match."""
+    return [c for c in SCHEMA if c in columns]
+
+
+def row_key_hashes(df, key_columns):
+    """64-bit hash per row of `key_columns`, independent of categorical codes and integer widths."""
+    key = {}
+    for col in key_columns:
+        values = df[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.astype('datetime64[ns]')
+        elif pd.api.types.is_integer_dtype(values):
+            values = values.astype('int64')
+        key[col] = values
+    return pd.util.hash_pandas_object(pd.DataFrame(key), index=False).to_numpy()
+
+
+def _history_hashes(base, key_columns):
+    if base.row_keys is not None and base.row_keys[0] == tuple(key_columns):
+        return base.row_keys[1]
+    if base.cleaned_df is None:
+        return None
+    missing = [c for c in key_columns if c not in base.cleaned_df.columns]
+    if missing:
+        raise DataCleaningError(f"Duplicate key column(s) missing from the current dataset: {', '.join(missing)}")
+    # Hashed once per key choice; later appends with the same key reuse the sorted array
+    with metrics.stage('hash_history'):
+        return np.sort(row_key_hashes(base.cleaned_df, key_columns))
+
+
+def append_dataset(base, data, key_columns=None, source_hash=None):
+    """Cleans the rows in `data` and merges them into `base`, skipping duplicate rows.
+
+    A row is a duplicate when its `key_columns` match a row already in `base` or an earlier row
+    of `data`. Only the new rows are parsed, cleaned, hashed and aggregated; the history's key
+    hashes are kept sorted on the returned Dataset, so each check is a binary search. The
+    retained cleaned frame (if any) is extended by one concatenation.
+    """
+    delta_hash = content_hash(data)
+    with metrics.stage('csv_parse'):
+        df = read_csv_bytes(data)
+    raw_row_count = len(df)
+    dropped_rows = DroppedRows()
+    try:
+        cleaned, warnings = clean_media_data(df, dropped_rows)
+    except Exception as e:
+        raise DataCleaningError(e, raw_row_count) from e
+
+    key_columns = list(key_columns or default_dedup_key(cleaned.columns))
+    missing = [c for c in key_columns if c not in cleaned.columns]
+    if missing:
+        raise DataCleaningError(f"Duplicate key column(s) missing from the new file: {', '.join(missing)}", raw_row_count)
+
+    with metrics.stage('deduplicate'):
+        hashes = row_key_hashes(cleaned, key_columns)
+        duplicate = pd.Series(hashes).duplicated().to_numpy()
+        history = _history_hashes(base, key_columns)
+        if history is None:
+            warnings.append("Earlier rows were not retained (streaming ingest), so appended rows are only checked for duplicates within the new file.")
+        elif len(history):
+            positions = np.minimum(np.searchsorted(history, hashes), len(history) - 1)
+            duplicate = duplicate | (history[positions] == hashes)
+        dropped_rows.add(DUPLICATE_ROW, duplicate.sum())
+        if duplicate.any():
+            cleaned = cleaned[~duplicate]
+            hashes = hashes[~duplicate]
+
+    with metrics.stage('aggregation'):
+        aggregates = append_to_aggregates(base.aggregates, cleaned)
+
+    cleaned_df = None
+    if base.cleaned_df is not None:
+        with metrics.stage('merge_rows'):
+            frames = union_categories([base.cleaned_df.copy(deep=False), cleaned.copy()], DIMENSION_COLUMNS)
+            cleaned_df = pd.concat(frames, ignore_index=True)
+
+    row_keys = None
+    if history is not None:
+        new_hashes = np.sort(hashes)
+        row_keys = (tuple(key_columns), np.insert(history, np.searchsorted(history, new_hashes), new_hashes))
+
+    all_dropped = DroppedRows()
+    all_dropped.merge(base.dropped_rows)
+    all_dropped.merge(dropped_rows)
+    return Dataset(
+        source_hash=source_hash or content_hash(f"{base.source_hash}+{delta_hash}:{','.join(key_columns)}".encode()),
+        raw_row_count=base.raw_row_count + raw_row_count,
+        cleaned_row_count=base.cleaned_row_count + len(cleaned),
+        cleaned_df=cleaned_df,
+        warnings=base.warnings + [w for w in warnings if w not in base.warnings],
+        aggregates=aggregates,
+        dropped_rows=all_dropped,
+        row_keys=row_keys,
+    )
+
+
+def _object_bytes(series):
+    # What memory_usage(deep=True) would report for the same column as object dtype
+    n = len(series)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        sizes = np.array([sys.getsizeof(c) for c in series.cat.categories] + [sys.getsizeof(np.nan)])
+        counts = np.bincount(np.where(codes < 0, len(sizes) - 1, codes), minlength=len(sizes))
+        return 8 * n + int(counts @ sizes)
+    sample = series.iloc[0] if n else None
+    return 8 * n + n * sys.getsizeof(sample)
+
+
+def memory_report(df):
+    """Per-column memory of the typed frame versus the same data held as object dtype."""
+    rows = []
+    for col in df.columns:
+        rows.append({
+            'Column': col,
+            'Dtype': str(df[col].dtype),
+            'Typed (MB)': df[col].memory_usage(deep=True, index=False) / 1e6,
+            'As object (MB)': _object_bytes(df[col]) / 1e6,
+        })
+    report = pd.DataFrame(rows)
+    total = {'Column': 'Total', 'Dtype': '', 'Typed (MB)': report['Typed (MB)'].sum(), 'As object (MB)': report['As object (MB)'].sum()}
+    return pd.concat([report, pd.DataFrame([total])], ignore_index=True).round(2)
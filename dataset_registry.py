@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Memory allowed for resident datasets across every session; datasets a session is still using
+# are never evicted, so the total can exceed this while they are all in use
+DEFAULT_MAX_BYTES = int(os.environ.get("MEDIAINTEL_DATASET_CACHE_MB", "4096")) * 1024 * 1024
+# A session that hasn't touched the registry for this long is treated as closed and its references
+# dropped (Streamlit has no public session-end hook)
+SESSION_IDLE_SECONDS = 2 * 60 * 60
+
+
+def dataset_nbytes(dataset):
+    """Memory held by a Dataset's cleaned frame, aggregation cube, time rollups and duplicate-key hashes."""
+    total = 0
+    if dataset.cleaned_df is not None:
+        total += int(dataset.cleaned_df.memory_usage(deep=True).sum())
+    aggs = dataset.aggregates
+    if aggs is not None and aggs.cube is not None:
+        total += int(aggs.cube.memory_usage(deep=True).sum())
+    if aggs is not None and aggs.rollups is not None:
+        # The hourly level split by every dimension can outweigh the day cube
+        for level in aggs.rollups.levels.values():
+            total += int(level.memory_usage(deep=True).sum())
+        for totals in aggs.rollups.totals.values():
+            total += int(totals.memory_usage(deep=True))
+    if dataset.row_keys is not None:
+        total += dataset.row_keys[1].nbytes
+    return total
+
+
+class _Entry:
+    def __init__(self, dataset, name):
+        self.dataset = dataset
+        self.name = name
+        self.nbytes = dataset_nbytes(dataset)
+        self.sessions = set()
+        self.loaded = time.time()
+        self.last_used = self.loaded
+        self.hits = 0
+        # name -> object derived from the dataset (e.g. its filter index), dropped with it
+        self.derived = {}
+
+
+class DatasetRegistry:
+    """Process-wide registry of loaded Datasets, one per key (the upload's content hash).
+
+    Every session viewing the same data gets the same object, so memory scales with the number of
+    distinct datasets rather than the number of sessions. Datasets are shared and must be treated
+    as read-only. Each session holds references to the keys it is using; once no session holds a
+    dataset it becomes evictable, least recently used first, whenever the total goes over max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, session_idle_seconds=SESSION_IDLE_SECONDS):
+        self.max_bytes = max_bytes
+        self.session_idle_seconds = session_idle_seconds
+        self._lock = threading.Lock()
+        # key -> _Entry, least recently used first
+        self._entries = OrderedDict()
+        # session id -> (keys it holds, last seen)
+        self._sessions = {}
+        # key -> lock held while that key loads, so concurrent uploads of one file parse it once
+        self._loading = {}
+        self.evictions = 0
+
+    # --- internal helpers (called with self._lock held) ---
+
+    def _touch_session(self, session_id):
+        now = time.time()
+        keys = self._sessions[session_id][0] if session_id in self._sessions else set()
+        self._sessions[session_id] = (keys, now)
+        for other, (other_keys, seen) in list(self._sessions.items()):
+            if now - seen > self.session_idle_seconds:
+                for key in other_keys:
+                    if key in self._entries:
+                        self._entries[key].sessions.discard(other)
+                del self._sessions[other]
+        return keys
+
+    def _hold(self, session_id, key, entry):
+        self._touch_session(session_id).add(key)
+        entry.sessions.add(session_id)
+        entry.last_used = time.time()
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        total = sum(entry.nbytes for entry in self._entries.values())
+        for key, entry in list(self._entries.items()):
+            if total <= self.max_bytes:
+                break
+            if entry.sessions:
+                continue
+            total -= entry.nbytes
+            del self._entries[key]
+            self.evictions += 1
+
+    # --- public API ---
+
+    def acquire(self, session_id, key, load=None, name=None):
+        """The dataset for `key`, held for `session_id`. If it isn't resident it is built with
+        load() (once, however many sessions ask at the same time); None if there is no loader."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._hold(session_id, key, entry)
+                return entry.dataset
+            if load is None:
+                return None
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                try:
+                    dataset = load()
+                finally:
+                    with self._lock:
+                        self._loading.pop(key, None)
+                entry = _Entry(dataset, name or key[:12])
+            with self._lock:
+                entry = self._entries.setdefault(key, entry)
+                self._hold(session_id, key, entry)
+                return entry.dataset
+
+    def derived(self, key, name, build):
+        """An object derived from the dataset at `key`, such as its filter index, built once with
+        build() and kept until the dataset is evicted. Built but not kept if `key` isn't resident."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and name in entry.derived:
+                return entry.derived[name]
+        value = build()
+        if entry is None:
+            return value
+        with self._lock:
+            return entry.derived.setdefault(name, value)
+
+    def put(self, session_id, key, dataset, name=None):
+        """Registers a dataset built outside the registry (e.g. an append) and holds it for
+        `session_id`. Returns the resident copy, which is an earlier one if the key already exists."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(dataset, name or key[:12])
+            self._hold(session_id, key, entry)
+            return entry.dataset
+
+    def retain(self, session_id, keys):
+        """Drops every reference `session_id` holds except `keys` (the datasets its current run uses)."""
+        with self._lock:
+            held = self._touch_session(session_id)
+            for key in held - set(keys):
+                if key in self._entries:
+                    self._entries[key].sessions.discard(session_id)
+            held &= set(keys)
+            self._evict()
+
+    def evict_unused(self):
+        """Drops every dataset no session holds. Returns how many were dropped."""
+        with self._lock:
+            unused = [key for key, entry in self._entries.items() if not entry.sessions]
+            for key in unused:
+                del self._entries[key]
+            self.evictions += len(unused)
+            return len(unused)
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def entries(self):
+        """One dict per resident dataset, most recently used first (for the admin view)."""
+        with self._lock:
+            return [
+                {
+                    "key": key,
+                    "name": entry.name,
+                    "rows": entry.dataset.cleaned_row_count,
+                    "bytes": entry.nbytes,
+                    "sessions": len(entry.sessions),
+                    "hits": entry.hits,
+                    "loaded": entry.loaded,
+                    "last_used": entry.last_used,
+                }
+                for key, entry in reversed(self._entries.items())
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "datasets": len(self._entries),
+                "resident_bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "sessions": len(self._sessions),
+                "evictions": self.evictions,
+            }
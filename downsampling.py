@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+
+def _x_values(index):
+    # Dates become nanoseconds since the epoch; anything else is taken by position
+    try:
+        return pd.to_datetime(index).asi8.astype('float64')
+    except (TypeError, ValueError):
+        return np.arange(len(index), dtype='float64')
+
+
+def lttb_indices(x, y, threshold):
+    """Positions of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    Always keeps the first and last point; every bucket in between keeps the point forming the
+    largest triangle with the previously kept point and the next bucket's average, which keeps
+    peaks, dips and the overall shape of the line.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # threshold - 2 buckets over the interior points; the last point is the final "next bucket"
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    edges = np.append(edges, n)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def lttb(series, threshold):
+    """`series` reduced to at most `threshold` points with LTTB; returned unchanged if already small enough.
+
+    A DataFrame (several lines over one index) is sampled on its row totals, so every line keeps the same x values.
+    """
+    if len(series) <= threshold:
+        return series
+    y = series.sum(axis=1) if isinstance(series, pd.DataFrame) else series
+    keep = lttb_indices(_x_values(series.index), y.to_numpy(dtype='float64'), threshold)
+    return series.iloc[keep]
+
+
+def window(series, start=None, end=None):
+    """Points of a date-indexed series between two calendar days, both inclusive."""
+    dates = pd.to_datetime(series.index)
+    mask = np.ones(len(series), dtype=bool)
+    if start is not None:
+        mask &= dates >= pd.Timestamp(start).normalize()
+    if end is not None:
+        mask &= dates < pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+    return series[mask]
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Memory allowed for cached figure JSON across every session
+DEFAULT_MAX_BYTES = int(os.environ.get("MEDIAINTEL_FIGURE_CACHE_MB", "64")) * 1024 * 1024
+
+
+def figure_key(slot, *inputs):
+    """Hash of a chart slot and everything its figure is drawn from: aggregate Series/DataFrames by
+    content (values, index, names and dtypes), anything else (drawing parameters) by repr."""
+    digest = hashlib.blake2b(slot.encode(), digest_size=16)
+    for part in inputs:
+        if isinstance(part, (pd.Series, pd.DataFrame)):
+            columns = list(part.columns) if isinstance(part, pd.DataFrame) else part.name
+            digest.update(repr((type(part).__name__, columns, str(part.dtypes), str(part.index.dtype))).encode())
+            digest.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """Process-wide LRU of serialized Plotly figures, keyed by figure_key().
+
+    Entries are immutable JSON strings, so every session can share them safely, and a hit skips
+    both building the figure and serializing it. Total size is capped at max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> figure JSON, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        """The figure JSON for `key`, from build() (a Figure) on a miss."""
+        with self._lock:
+            spec = self._entries.get(key)
+            if spec is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return spec
+            self.misses += 1
+        # Built outside the lock; two sessions missing the same key at once both build, and the
+        # results are identical
+        spec = build().to_json()
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = spec
+                self._bytes += len(spec)
+                while self._bytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted)
+        return spec
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
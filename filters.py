@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from aggregates import DIMENSIONS, aggregates_from_cube
+from rollups import SPLIT_DIMENSIONS
+
+# Sidebar labels for the filterable dimensions
+FILTER_LABELS = {
+    'platform': 'Platform',
+    'sentiment': 'Sentiment',
+    'media_type': 'Media Type',
+    'location': 'Location',
+}
+
+
+class FilterIndex:
+    """Precomputed structures for filtering a dataset's aggregation cube without touching its rows.
+
+    The cube is sorted by day, so a date range is two binary searches, and every dimension is held
+    as an integer code array, so a multi-select is one np.isin over small integers. Filtered
+    aggregates are then ordinary reductions of the selected cube rows, which also works for
+    streamed datasets that never kept their rows.
+    """
+
+    def __init__(self, aggs):
+        cube = aggs.cube.sort_values('day', kind='stable', ignore_index=True)
+        for dim in DIMENSIONS:
+            # Folding per-chunk cubes (streaming ingest) can drop the categorical dtype
+            if dim in cube.columns and not isinstance(cube[dim].dtype, pd.CategoricalDtype):
+                cube[dim] = cube[dim].astype('category')
+        self.aggs = aggs
+        self.cube = cube
+        self.days = cube['day'].to_numpy()
+        self.codes = {dim: cube[dim].cat.codes.to_numpy() for dim in DIMENSIONS if dim in cube.columns}
+        self.categories = {dim: cube[dim].cat.categories for dim in self.codes}
+        counts = cube['count'].to_numpy()
+        self._row_counts = {
+            dim: np.bincount(codes[codes >= 0], weights=counts[codes >= 0], minlength=len(self.categories[dim]))
+            for dim, codes in self.codes.items()
+        }
+
+    def options(self, dim):
+        """The values of `dim`, most rows first."""
+        order = np.argsort(-self._row_counts[dim], kind='stable')
+        return list(self.categories[dim][order])
+
+    def _date_bounds(self, date_range):
+        if date_range is None:
+            return 0, len(self.days)
+        start, end = date_range
+        lo = np.searchsorted(self.days, pd.Timestamp(start).normalize().to_datetime64(), side='left')
+        hi = np.searchsorted(self.days, (pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).to_datetime64(), side='left')
+        return lo, hi
+
+    def apply(self, date_range=None, selections=None):
+        """Aggregates for the rows within `date_range` (inclusive days) and `selections`
+        ({dimension: values}, an empty selection meaning all). None when nothing matches."""
+        selections = {dim: list(values) for dim, values in (selections or {}).items() if values and dim in self.codes}
+        if date_range is None and not selections:
+            return self.aggs
+
+        lo, hi = self._date_bounds(date_range)
+        cube = self.cube.iloc[lo:hi]
+        if selections:
+            mask = np.ones(hi - lo, dtype=bool)
+            for dim, values in selections.items():
+                wanted = self.categories[dim].get_indexer(values)
+                mask &= np.isin(self.codes[dim][lo:hi], wanted[wanted >= 0])
+            cube = cube[mask]
+        if cube.empty:
+            return None
+
+        # The rollups are split by platform and sentiment, so those filters cut them directly and keep
+        # any hourly level; other dimensions fall back to day rollups of the selected cube rows
+        rollups = None
+        if self.aggs.rollups is not None and set(selections) <= set(SPLIT_DIMENSIONS):
+            rollups = self.aggs.rollups.filtered(date_range, selections)
+        aggs = aggregates_from_cube(
+            cube,
+            total_rows=int(cube['count'].sum()),
+            date_min=cube['day'].iloc[0],
+            date_max=cube['day'].iloc[-1],
+            rollups=rollups,
+        )
+        aggs.filters = describe(date_range, selections)
+        return aggs
+
+
+def describe(date_range=None, selections=None):
+    """Human-readable summary of the active filters, or None when nothing is filtered."""
+    parts = []
+    if date_range is not None:
+        start, end = date_range
+        parts.append(f"Date {pd.Timestamp(start):%Y-%m-%d} to {pd.Timestamp(end):%Y-%m-%d}")
+    for dim, values in (selections or {}).items():
+        if values:
+            parts.append(f"{FILTER_LABELS.get(dim, dim)}: {', '.join(str(v) for v in values)}")
+    return "; ".join(parts) or None
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "MEDIAINTEL_LLM_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "mediaintel", "llm_cache.sqlite")
+)
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_DISK_ENTRIES = 5000
+# How long a disk operation waits on another process's lock (e.g. batch_report's worker pool sharing
+# the file) before the cache gives up on it
+DEFAULT_BUSY_TIMEOUT_SECONDS = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model, prompt, params):
+    """Content address for a completion: model ID, prompt hash and generation parameters."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    payload = json.dumps({"model": model, "prompt": prompt_hash, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (in-memory LRU + SQLite) cache of LLM responses with TTL and size-based eviction.
+
+    Only successful completions are stored. Safe to share between sessions and threads. SQLite
+    errors (a locked or corrupt file) are logged and never reach the caller: a failed read is a
+    miss and a failed write only skips the disk tier.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 memory_entries=DEFAULT_MEMORY_ENTRIES, disk_entries=DEFAULT_DISK_ENTRIES,
+                 busy_timeout=DEFAULT_BUSY_TIMEOUT_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            try:
+                self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, last_used REAL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning("LLM response cache at %s is unusable, keeping responses in memory only: %s", path, e)
+                self._db = None
+
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def _disk_failed(self, action, e):
+        # Called with self._lock held; rolls back so a half-done write doesn't keep the file locked
+        logger.warning("LLM response cache %s failed, skipping the disk tier: %s", action, e)
+        try:
+            self._db.rollback()
+        except sqlite3.Error:
+            pass
+
+    def _remember(self, key, response, created):
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        response, created = row
+                        if not self._expired(created, now):
+                            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                            self._db.commit()
+                            self._remember(key, response, created)
+                            self.disk_hits += 1
+                            return response
+                        self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self._db.commit()
+                except sqlite3.Error as e:
+                    self._disk_failed("read", e)
+
+            self.misses += 1
+            return None
+
+    def set(self, key, response, model=None):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, response, now, now),
+                )
+                # Size-based eviction: keep only the most recently used rows
+                self._db.execute(
+                    "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                    (self.disk_entries,),
+                )
+                if self.ttl_seconds is not None:
+                    self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._disk_failed("write", e)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM responses")
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    self._disk_failed("clear", e)
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
@@ -0,0 +1,216 @@
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Where finished runs are exported. A path ending in .prom gets Prometheus text exposition
+# (rewritten after every run, for node_exporter's textfile collector); anything else gets JSON lines.
+DEFAULT_METRICS_PATH = os.environ.get(
+    "MEDIAINTEL_METRICS_PATH", os.path.join(os.path.expanduser("~"), ".cache", "mediaintel", "metrics.jsonl")
+)
+# A JSON-lines file is rotated to <path>.1 once it grows past this
+MAX_METRICS_FILE_BYTES = 50 * 1024 * 1024
+
+# The run being recorded in the current thread/task, if any; stage() is a no-op without one
+_current_run = contextvars.ContextVar("mediaintel_current_run", default=None)
+
+
+def rss_bytes():
+    """Current resident set size of the process, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RunMetrics:
+    """Wall time and memory per pipeline stage, plus every LLM call, for one dashboard run.
+
+    Memory is the process RSS after each stage and its change over the stage; sessions share the
+    process, so deltas from concurrent runs can bleed into each other.
+    """
+
+    def __init__(self, kind="dashboard"):
+        self.kind = kind
+        self.started = time.time()
+        self._started_perf = time.perf_counter()
+        self.stages = {}
+        self.llm_calls = []
+        self.counters = {}
+        self.info = {}
+        self.total_seconds = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            rss_after = rss_bytes()
+            with self._lock:
+                # Repeated stages (chunks, one per chart) accumulate into one entry
+                entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "rss_bytes": None, "rss_delta_bytes": 0})
+                entry["seconds"] += seconds
+                entry["calls"] += 1
+                if rss_after is not None and rss_before is not None:
+                    entry["rss_bytes"] = rss_after
+                    entry["rss_delta_bytes"] += rss_after - rss_before
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_llm_call(self, record):
+        """Callback for ai_client's on_metrics."""
+        with self._lock:
+            self.llm_calls.append(record)
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self._started_perf
+        return self
+
+    def llm_cache_hit_rate(self):
+        if not self.llm_calls:
+            return None
+        return sum(call["cached"] for call in self.llm_calls) / len(self.llm_calls)
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "total_seconds": self.total_seconds,
+            "rss_bytes": rss_bytes(),
+            "stages": self.stages,
+            "llm_calls": self.llm_calls,
+            "llm_cache_hit_rate": self.llm_cache_hit_rate(),
+            "counters": self.counters,
+            "info": self.info,
+        }
+
+
+@contextmanager
+def recording(run):
+    """Makes `run` the target of stage() and increment() for the duration of the block."""
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+
+
+def activate(run):
+    """Like recording(), for the rest of the current context (e.g. one Streamlit script run)."""
+    _current_run.set(run)
+    return run
+
+
+def current():
+    """The run being recorded in this context, or None."""
+    return _current_run.get()
+
+
+@contextmanager
+def stage(name):
+    run = _current_run.get()
+    if run is None:
+        yield
+        return
+    with run.stage(name):
+        yield
+
+
+def increment(name, amount=1):
+    run = _current_run.get()
+    if run is not None:
+        run.increment(name, amount)
+
+
+def record_llm_call(record):
+    """on_metrics callback that records into whichever run is current when the call finishes."""
+    run = _current_run.get()
+    if run is not None:
+        run.record_llm_call(record)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsSink:
+    """Exports finished runs to a JSON-lines or Prometheus text file. Safe to share between sessions."""
+
+    def __init__(self, path=DEFAULT_METRICS_PATH, max_bytes=MAX_METRICS_FILE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.prometheus = path.endswith(".prom")
+        self._lock = threading.Lock()
+        # Process-lifetime totals for the Prometheus exposition: {(metric, labels): value}
+        self._totals = {}
+        self._gauges = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(self, run):
+        record = run.to_dict()
+        with self._lock:
+            if self.prometheus:
+                self._accumulate(record)
+                self._write_prometheus()
+            else:
+                self._append_json(record)
+
+    def _append_json(self, record):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    def _add(self, metric, labels, value):
+        key = (metric, tuple(sorted(labels.items())))
+        self._totals[key] = self._totals.get(key, 0) + value
+
+    def _accumulate(self, record):
+        self._add("mediaintel_runs_total", {"kind": record["kind"]}, 1)
+        if record["total_seconds"] is not None:
+            self._add("mediaintel_run_seconds_sum", {"kind": record["kind"]}, record["total_seconds"])
+            self._add("mediaintel_run_seconds_count", {"kind": record["kind"]}, 1)
+        for name, entry in record["stages"].items():
+            self._add("mediaintel_stage_seconds_sum", {"stage": name}, entry["seconds"])
+            self._add("mediaintel_stage_seconds_count", {"stage": name}, entry["calls"])
+        for call in record["llm_calls"]:
+            labels = {"model": call["model"], "cached": str(call["cached"]).lower()}
+            self._add("mediaintel_llm_requests_total", labels, 1)
+            if call["cached"]:
+                continue
+            self._add("mediaintel_llm_latency_seconds_sum", {"model": call["model"]}, call["seconds"])
+            self._add("mediaintel_llm_latency_seconds_count", {"model": call["model"]}, 1)
+            if call.get("first_token_seconds") is not None:
+                self._add("mediaintel_llm_first_token_seconds_sum", {"model": call["model"]}, call["first_token_seconds"])
+                self._add("mediaintel_llm_first_token_seconds_count", {"model": call["model"]}, 1)
+            for kind in ("prompt", "completion"):
+                if call.get(f"{kind}_tokens") is not None:
+                    self._add("mediaintel_llm_tokens_total", {"model": call["model"], "kind": kind}, call[f"{kind}_tokens"])
+        for name, value in record["counters"].items():
+            self._add("mediaintel_events_total", {"event": name}, value)
+        if record["rss_bytes"] is not None:
+            self._gauges[("mediaintel_process_rss_bytes", ())] = record["rss_bytes"]
+        cache = record["info"].get("response_cache")
+        if cache is not None:
+            self._gauges[("mediaintel_response_cache_hit_ratio", ())] = cache["hit_rate"]
+
+    def _write_prometheus(self):
+        lines = []
+        for (metric, labels), value in sorted(self._totals.items()) + sorted(self._gauges.items()):
+            label_text = ",".join(f'{k}="{_label(v)}"' for k, v in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        # Write then rename so a scraper never reads a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
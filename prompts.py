@@ -0,0 +1,304 @@
+# Prompt builders for the campaign recommendation and per-chart insights.
+# All of them read from DashboardAggregates so no prompt ever touches the raw rows.
+#
+# Summaries are encoded compactly (rounded shares, top-k plus an "other" bucket, trend statistics
+# instead of raw rows) and every prompt is fitted to a token budget: each builder renders at
+# decreasing levels of detail until the estimated token count fits, and cuts the least detailed
+# summary short if even that is over.
+import html
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from rollups import rollups_from_cube
+
+# Estimated tokens allowed per prompt; 0 or less disables the budget
+PROMPT_TOKEN_BUDGET = int(os.environ.get("MEDIAINTEL_PROMPT_TOKEN_BUDGET", "600"))
+# Entries listed per breakdown at each level of detail, most detailed first
+DETAIL_LEVELS = (10, 5, 3, 1)
+
+# Appended where a summary was cut short to fit the budget
+TRUNCATION_NOTE = "... (summary truncated)"
+
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text):
+    """Rough BPE token count without a tokenizer: words cost one token per 5 letters, digit runs
+    one per 3 digits and every punctuation mark one. Errs on the high side for English text."""
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text):
+        if piece[0].isdigit():
+            tokens += -(-len(piece) // 3)
+        elif piece[0].isalpha():
+            tokens += -(-len(piece) // 5)
+        else:
+            tokens += 1
+    return tokens
+
+
+def _fit(render, summarize, token_budget):
+    """render(summary) for the most detailed summarize(top_k) within budget.
+
+    If none fits, the least detailed summary is cut at the last word that still fits. Only when
+    the prompt is over budget with no data at all (the budget is below the cost of its fixed
+    instructions) is it returned over budget; prompt_over_budget() tells the caller.
+    """
+    for top_k in DETAIL_LEVELS:
+        text = render(summarize(top_k))
+        if not token_budget or token_budget <= 0 or estimate_tokens(text) <= token_budget:
+            return text
+    summary = summarize(DETAIL_LEVELS[-1])
+    # Binary search over the word boundaries for the longest prefix whose prompt fits
+    cuts = [match.start() for match in re.finditer(r"\s+", summary)]
+    low, high, fitted = 0, len(cuts) - 1, None
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = render(summary[:cuts[middle]] + TRUNCATION_NOTE)
+        if estimate_tokens(candidate) <= token_budget:
+            fitted, low = candidate, middle + 1
+        else:
+            high = middle - 1
+    return fitted if fitted is not None else text
+
+
+def prompt_over_budget(prompt, token_budget):
+    """True when `prompt` is estimated over a (positive) budget, which _fit only allows when the
+    budget can't even cover the prompt's instructions."""
+    return bool(token_budget) and token_budget > 0 and estimate_tokens(prompt) > token_budget
+
+
+def _number(value):
+    value = float(value)
+    for threshold, suffix in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if abs(value) >= threshold:
+            return f"{value / threshold:.1f}{suffix}"
+    return f"{value:.0f}"
+
+
+def _shares(series, top_k):
+    """'A 52% (1.2K), B 30% (700), other (3) 18% (410)' for the top_k largest entries."""
+    if series is None or series.empty:
+        return "n/a"
+    total = series.sum()
+    top = series.nlargest(top_k)
+    parts = [f"{key} {value / total:.0%} ({_number(value)})" if total else f"{key} ({_number(value)})" for key, value in top.items()]
+    rest = series.drop(top.index)
+    if len(rest):
+        parts.append(f"other ({len(rest)}) {rest.sum() / total:.0%} ({_number(rest.sum())})" if total else f"other ({len(rest)})")
+    return ", ".join(parts)
+
+
+def _trend(aggs, top_k):
+    """Trend statistics from the precomputed rollups: totals, fitted daily slope, peak and low days,
+    the last full week against the one before, recent weekly and monthly totals, and the busiest
+    hour of day when the data has times."""
+    rollups = aggs.rollups if aggs.rollups is not None else rollups_from_cube(aggs.cube)
+    daily = rollups.totals['day']
+    if daily.empty:
+        return "n/a"
+    mean = daily.mean()
+    lines = [f"{len(daily)} days with data, {_number(daily.sum())} engagements, {_number(mean)}/day average"]
+    if len(daily) > 1:
+        days = (daily.index - daily.index[0]).days.to_numpy(dtype='float64')
+        slope = np.polyfit(days, daily.to_numpy(dtype='float64'), 1)[0]
+        relative = f" ({slope * 7 / mean:+.1%} of the daily average per week)" if mean else ""
+        lines.append(f"Linear trend: {slope:+,.1f}/day{relative}")
+    lines.append("Peaks: " + ", ".join(f"{day:%Y-%m-%d} {_number(value)}" for day, value in daily.nlargest(min(top_k, 3)).items()))
+    low_day, low_value = next(iter(daily.nsmallest(1).items()))
+    lines.append(f"Lowest: {low_day:%Y-%m-%d} {_number(low_value)}")
+
+    # Only weeks fully inside the data are compared, so a partial first or last week can't fake a swing
+    weekly = rollups.totals['week']
+    weekly = weekly[(weekly.index >= daily.index[0]) & (weekly.index + pd.Timedelta(days=7) <= daily.index[-1] + pd.Timedelta(days=1))]
+    if len(weekly) > 1:
+        latest, previous = weekly.iloc[-1], weekly.iloc[-2]
+        change = f"{latest / previous - 1:+.1%}" if previous else "n/a"
+        lines.append(f"Last full week (from {weekly.index[-1]:%Y-%m-%d}) vs the week before: {_number(latest)} vs {_number(previous)} ({change})")
+    if len(weekly) > 2 and top_k > 1:
+        recent = weekly.iloc[-top_k:]
+        lines.append(f"Last {len(recent)} full weekly totals (oldest first): " + ", ".join(_number(v) for v in recent))
+    monthly = rollups.totals['month']
+    if len(monthly) > 2 and top_k > 1:
+        recent = monthly.iloc[-top_k:]
+        lines.append("Monthly totals (first and last may be partial): " + ", ".join(f"{month:%Y-%m} {_number(v)}" for month, v in recent.items()))
+    if 'hour' in rollups.totals:
+        by_hour = rollups.totals['hour'].groupby(rollups.totals['hour'].index.hour).sum()
+        if by_hour.sum():
+            lines.append(f"Busiest hour of day: {by_hour.idxmax():02d}:00 ({by_hour.max() / by_hour.sum():.0%} of engagements)")
+    return "\n".join(lines)
+
+
+def _filters_line(aggs):
+    return f"\nFilters applied: {aggs.filters}" if aggs.filters else ""
+
+
+def _describe(aggs, describe, top_k):
+    # Tell the model the data is a filtered subset, so it doesn't read the subset as the whole
+    # campaign; it leads, so cutting the description short to fit the budget never drops it
+    description = describe(aggs, top_k)
+    return f"(Filtered to: {aggs.filters})\n{description}" if aggs.filters else description
+
+
+def _data_summary(aggs, top_k):
+    # Summarize data for the LLM
+    return f"""Overall Data Summary:
+Total entries: {aggs.total_rows}
+Date range: {aggs.date_min.strftime('%Y-%m-%d')} to {aggs.date_max.strftime('%Y-%m-%d')}{_filters_line(aggs)}
+
+Sentiment (share of entries): {_shares(aggs.sentiment_counts, top_k)}
+Platforms (share of engagements): {_shares(aggs.platform_engagements, top_k)}
+Media types (share of entries): {_shares(aggs.media_type_counts, top_k)}
+Locations (share of engagements): {_shares(aggs.location_engagements, top_k)}
+
+Engagement trend:
+{_trend(aggs, top_k)}"""
+
+
+def build_campaign_prompt(aggs, token_budget=PROMPT_TOKEN_BUDGET):
+    def render(summary):
+        return f"""Analyze the following media intelligence data. Based on the sentiment breakdown, engagement trends, platform performance, media type mix, and top locations, provide a concise campaign recommendation.
+The recommendation should clearly state 'What's Working' and 'What Needs to be Improved' to optimize future media strategies. Focus on actionable advice.
+
+{summary}
+
+Campaign Recommendation:
+"""
+
+    return _fit(render, lambda top_k: _data_summary(aggs, top_k), token_budget)
+
+
+def build_chart_insights_prompt(chart_title, data_description):
+    return f"""Given the following data for a "{chart_title}" chart:
+{data_description}
+
+Provide 3 concise and actionable insights based on this data. Format them as a bulleted list.
+"""
+
+
+def describe_sentiment(aggs, top_k=DETAIL_LEVELS[0]):
+    return f"Sentiment distribution (share of entries): {_shares(aggs.sentiment_counts, top_k)}"
+
+
+def describe_engagement_trend(aggs, top_k=DETAIL_LEVELS[0]):
+    return f"Engagement over time:\n{_trend(aggs, top_k)}"
+
+
+def describe_platform(aggs, top_k=DETAIL_LEVELS[0]):
+    return f"Platform engagements (share of total): {_shares(aggs.platform_engagements, top_k)}"
+
+
+def describe_media_type(aggs, top_k=DETAIL_LEVELS[0]):
+    return f"Media type distribution (share of entries): {_shares(aggs.media_type_counts, top_k)}"
+
+
+def describe_locations(aggs, top_k=DETAIL_LEVELS[0]):
+    # The chart shows the top 5, so never list more than that
+    return f"Top locations by engagement (share of total): {_shares(aggs.location_engagements, min(top_k, 5))}"
+
+
+# Chart insight slots: (slot key, chart title, description builder, aggregate the chart needs)
+CHART_INSIGHTS = [
+    ("sentiment", "Sentiment Breakdown", describe_sentiment, "sentiment_counts"),
+    ("engagement_trend", "Engagement Trend Over Time", describe_engagement_trend, "engagement_by_date"),
+    ("platform", "Platform Engagements", describe_platform, "platform_engagements"),
+    ("media_type", "Media Type Mix", describe_media_type, "media_type_counts"),
+    ("locations", "Top 5 Locations by Engagement", describe_locations, "location_engagements"),
+]
+
+CAMPAIGN_SLOT = "campaign"
+
+
+def _chart_prompt(aggs, title, describe, token_budget):
+    return _fit(lambda summary: build_chart_insights_prompt(title, summary), lambda top_k: _describe(aggs, describe, top_k), token_budget)
+
+
+def build_chart_prompt(aggs, slot, token_budget=PROMPT_TOKEN_BUDGET):
+    for key, title, describe, _ in CHART_INSIGHTS:
+        if key == slot:
+            return _chart_prompt(aggs, title, describe, token_budget)
+    raise KeyError(slot)
+
+
+def build_all_prompts(aggs, token_budget=PROMPT_TOKEN_BUDGET):
+    """Every prompt for a full report, keyed by slot; charts whose data is missing are skipped."""
+    all_prompts = {CAMPAIGN_SLOT: build_campaign_prompt(aggs, token_budget)}
+    for key, title, describe, required in CHART_INSIGHTS:
+        if getattr(aggs, required) is not None:
+            all_prompts[key] = _chart_prompt(aggs, title, describe, token_budget)
+    return all_prompts
+
+
+# --- One-shot report: the campaign recommendation and every chart's insights from a single call ---
+
+# Token-count key for the combined report prompt (it fills every slot, so it has none of its own)
+REPORT_SLOT = "report"
+# The report prompt carries the same data summary as the campaign prompt plus the answer format
+# for every section, so it gets this many times the per-prompt budget
+REPORT_BUDGET_SCALE = 1.5
+# Bullets every section of a report response must have
+REPORT_ITEMS = 3
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def build_report_prompt(aggs, token_budget=PROMPT_TOKEN_BUDGET):
+    """One prompt asking for the campaign recommendation and each chart's insights as a JSON object
+    (parse it with parse_report_response). The data summary is sent once instead of once per slot."""
+    charts = [(key, title) for key, title, _, required in CHART_INSIGHTS if getattr(aggs, required) is not None]
+    chart_keys = ", ".join(f'"{key}": [3 insights on the {title} chart]' for key, title in charts)
+
+    def render(summary):
+        return f"""Analyze the following media intelligence data and write a full campaign report.
+
+{summary}
+
+Answer with a single JSON object and nothing else, in this format:
+{{"whats_working": [3 points], "needs_improvement": [3 points], "charts": {{{chart_keys}}}}}
+Every point and insight is one concise, actionable sentence (a JSON string).
+"""
+
+    return _fit(render, lambda top_k: _data_summary(aggs, top_k), token_budget * REPORT_BUDGET_SCALE)
+
+
+def _bullets(items):
+    # "<li>a</li><li>b</li><li>c</li>" from a list of REPORT_ITEMS non-empty strings; None for
+    # anything else (a bare string, too few or too many points), so the section is re-requested
+    if not isinstance(items, list) or len(items) != REPORT_ITEMS:
+        return None
+    if not all(isinstance(item, str) and item.strip() for item in items):
+        return None
+    return "".join(f"<li>{html.escape(item.strip())}</li>" for item in items)
+
+
+def parse_report_response(text, slots):
+    """Splits a report response into {slot: text} for the slots whose section is present and well formed.
+
+    Tolerates prose or code fences around the JSON object. Sections come back as HTML list items
+    (the chart insight slots render inside a <ul>), with the campaign slot headed "What's Working"
+    and "What Needs to be Improved"; anything missing or malformed is left out for the caller to re-request.
+    """
+    match = _JSON_OBJECT.search(text or "")
+    try:
+        report = json.loads(match.group(0)) if match else None
+    except ValueError:
+        report = None
+    if not isinstance(report, dict):
+        return {}
+
+    sections = {}
+    charts = report.get("charts")
+    charts = charts if isinstance(charts, dict) else {}
+    for slot in slots:
+        if slot == CAMPAIGN_SLOT:
+            working, improve = _bullets(report.get("whats_working")), _bullets(report.get("needs_improvement"))
+            if working and improve:
+                sections[slot] = f"<strong>What's Working</strong><ul>{working}</ul><strong>What Needs to be Improved</strong><ul>{improve}</ul>"
+        else:
+            insights = _bullets(charts.get(slot))
+            if insights:
+                sections[slot] = insights
+    return sections
@@ -0,0 +1,277 @@
+import csv
+import importlib.util
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+import metrics
+from aggregates import DIMENSIONS, aggregates_from_cube
+from data_pipeline import (
+    NA_STRINGS, SCHEMA, CSVReadError, DataCleaningError, Dataset, content_hash, count_date_drops, duplicate_columns_warning,
+    file_content_hash, load_dataset, load_frame, naive_utc, normalize_column_name, parse_distinct_dates
+)
+from rollups import SPLIT_DIMENSIONS, build_pyramid
+
+# Backend used when none is named (the app's default engine and batch_report's --backend default)
+DEFAULT_BACKEND = os.environ.get("MEDIAINTEL_QUERY_BACKEND", "pandas")
+# DuckDB limits; unset means DuckDB's own defaults (every core, 80% of RAM), and work beyond the
+# memory limit spills to the temp directory instead of failing
+DUCKDB_MEMORY_LIMIT = os.environ.get("MEDIAINTEL_DUCKDB_MEMORY_LIMIT")
+DUCKDB_THREADS = int(os.environ.get("MEDIAINTEL_DUCKDB_THREADS", "0")) or None
+DUCKDB_TEMP_DIR = os.environ.get(
+    "MEDIAINTEL_DUCKDB_TEMP_DIR", os.path.join(tempfile.gettempdir(), "mediaintel-duckdb")
+)
+
+PARQUET_MAGIC = b'PAR1'
+
+
+def _is_parquet(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:4]) == PARQUET_MAGIC
+    return str(source).lower().endswith('.parquet')
+
+
+def _source_hash(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return content_hash(source)
+    return file_content_hash(source)
+
+
+class PandasBackend:
+    """The default: pandas parses and cleans every row in memory (data_pipeline.load_dataset)."""
+
+    name = 'pandas'
+    label = 'pandas (in memory)'
+
+    @staticmethod
+    def available():
+        return True
+
+    def load_dataset(self, source, source_hash=None):
+        """Dataset for CSV or Parquet `source` (bytes or a file path)."""
+        source_hash = source_hash or _source_hash(source)
+        if _is_parquet(source):
+            with metrics.stage('csv_parse'):
+                try:
+                    df = pd.read_parquet(io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source)
+                except Exception as e:
+                    raise CSVReadError(e) from e
+            return load_frame(df, source_hash)
+        if not isinstance(source, (bytes, bytearray, memoryview)):
+            with open(source, 'rb') as f:
+                source = f.read()
+        return load_dataset(source, source_hash)
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+class DuckDBBackend:
+    """Cleaning and aggregation as SQL over the CSV or Parquet file itself, in embedded DuckDB.
+
+    The scan is multithreaded and spills to disk past the memory limit, and only small frames come
+    back into pandas: the distinct date strings (parsed with the pandas backend's own rules, so
+    both backends keep and drop exactly the same rows), the day cube and, for exports with times
+    of day, the hourly rollup base. The five chart series are then reduced from the cube exactly
+    as for the pandas backend. Like streaming ingest, the Dataset has cleaned_df=None.
+    """
+
+    name = 'duckdb'
+    label = 'DuckDB (out of core, multithreaded)'
+
+    def __init__(self, memory_limit=DUCKDB_MEMORY_LIMIT, threads=DUCKDB_THREADS, temp_directory=DUCKDB_TEMP_DIR):
+        self.memory_limit = memory_limit
+        self.threads = threads
+        self.temp_directory = temp_directory
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec('duckdb') is not None
+
+    def _connect(self):
+        import duckdb
+
+        config = {'temp_directory': self.temp_directory}
+        if self.memory_limit:
+            config['memory_limit'] = self.memory_limit
+        if self.threads:
+            config['threads'] = self.threads
+        con = duckdb.connect(config=config)
+        con.execute("SET enable_progress_bar = false")
+        return con
+
+    def load_dataset(self, source, source_hash=None):
+        """Dataset for CSV or Parquet `source` (bytes or a file path). Paths are scanned in place."""
+        if not isinstance(source, (bytes, bytearray, memoryview)):
+            return self._load_path(str(source), source_hash or file_content_hash(source))
+        # DuckDB scans files, so uploaded bytes are written out first
+        with tempfile.NamedTemporaryFile(suffix='.parquet' if _is_parquet(source) else '.csv', delete=False) as f:
+            f.write(source)
+        try:
+            return self._load_path(f.name, source_hash or content_hash(source))
+        finally:
+            os.remove(f.name)
+
+    def _load_path(self, path, source_hash):
+        con = self._connect()
+        try:
+            return self._query(con, path, source_hash)
+        finally:
+            con.close()
+
+    def _query(self, con, path, source_hash):
+        with metrics.stage('csv_parse'):
+            try:
+                if _is_parquet(path):
+                    scan = f"read_parquet({_literal(path)})"
+                else:
+                    # Every column as text, as pandas sees it before cleaning
+                    nulls = ", ".join(_literal(v) for v in NA_STRINGS)
+                    scan = f"read_csv({_literal(path)}, header = true, all_varchar = true, nullstr = [{nulls}])"
+                con.execute(f"CREATE VIEW raw AS SELECT * FROM {scan}")
+                raw_columns = [(name, col_type) for name, col_type, *_ in con.execute("DESCRIBE raw").fetchall()]
+                header = self._header(con, path, [name for name, _ in raw_columns])
+                raw_row_count = con.execute("SELECT count(*) FROM raw").fetchone()[0]
+            except Exception as e:
+                raise CSVReadError(e) from e
+
+        # Cleaning errors are reported like the pandas backend's, with the rows read so far
+        try:
+            return self._clean(con, raw_columns, header, raw_row_count, source_hash)
+        except DataCleaningError:
+            raise
+        except Exception as e:
+            raise DataCleaningError(e, raw_row_count) from e
+
+    def _header(self, con, path, scanned):
+        # The source's own column names: DuckDB trims them and renames repeats ("media type_1"),
+        # so duplicates are only visible in the original header
+        if _is_parquet(path):
+            fields = con.execute(f"SELECT name, num_children FROM parquet_schema({_literal(path)})").fetchall()[1:]
+            names = [name for name, _ in fields] if all(children is None for _, children in fields) else []
+        else:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                names = next(csv.reader(f), [])
+        return names if len(names) == len(scanned) else scanned
+
+    def _clean(self, con, raw_columns, header, raw_row_count, source_hash):
+        warnings = []
+        # Normalized name -> (quoted raw column, its type); like pandas, the first of any
+        # columns whose names normalize alike is used
+        columns = {}
+        duplicates = []
+        for source_name, (name, col_type) in zip(header, raw_columns):
+            normalized = normalize_column_name(source_name)
+            if normalized in columns:
+                duplicates.append(normalized)
+            else:
+                columns[normalized] = (_quote(name), col_type)
+        if duplicates:
+            warnings.append(duplicate_columns_warning(duplicates))
+        raw_date_type = columns['date'][1] if 'date' in columns else None
+        columns = {normalized: quoted for normalized, (quoted, _) in columns.items()}
+        if 'date' not in columns:
+            raise DataCleaningError(KeyError('date'), raw_row_count)
+
+        with metrics.stage('date_coercion'):
+            dates, dropped_rows = self._parse_dates(con, columns['date'], raw_date_type)
+        if 'engagements' in columns:
+            # Non-numeric and non-finite counts become 0, as in data_pipeline.coerce_engagements
+            value = f"TRY_CAST({columns['engagements']} AS DOUBLE)"
+            engagements = f"CAST(coalesce(trunc(CASE WHEN isfinite({value}) THEN {value} END), 0) AS BIGINT)"
+        else:
+            warnings.append("'Engagements' column not found. Some charts may not display correctly.")
+            engagements = "CAST(0 AS BIGINT)"
+
+        aggregates = None
+        cleaned_row_count = 0
+        with metrics.stage('aggregation'):
+            if not dates.empty:
+                con.register('parsed_dates', dates)
+                parsed = dates['parsed']
+                con.execute(
+                    f"CREATE VIEW cleaned AS SELECT d.parsed AS date, {engagements} AS engagements"
+                    + "".join(f", {columns[dim]} AS {dim}" for dim in DIMENSIONS if dim in columns)
+                    + f" FROM raw JOIN parsed_dates d ON raw.{columns['date']} = d.raw"
+                )
+                cube = self._group(con, "date_trunc('day', date)", 'day', [dim for dim in DIMENSIONS if dim in columns], parsed.dtype)
+                cleaned_row_count = int(cube['count'].sum())
+                rollups = None
+                if (parsed != parsed.dt.normalize()).any():
+                    hourly = self._group(con, "date_trunc('hour', date)", 'bucket', [dim for dim in SPLIT_DIMENSIONS if dim in columns], parsed.dtype)
+                    rollups = build_pyramid(hourly, 'hour')
+                aggregates = aggregates_from_cube(
+                    cube, total_rows=cleaned_row_count, date_min=parsed.min(), date_max=parsed.max(), rollups=rollups
+                )
+        return Dataset(
+            source_hash=source_hash,
+            raw_row_count=raw_row_count,
+            cleaned_row_count=cleaned_row_count,
+            cleaned_df=None,
+            warnings=warnings,
+            aggregates=aggregates,
+            dropped_rows=dropped_rows,
+        )
+
+    def _parse_dates(self, con, column, raw_type):
+        """(raw value -> parsed datetime for every value that parses, DroppedRows).
+
+        Only the distinct values leave DuckDB, in order of first appearance with their row counts,
+        so data_pipeline.parse_distinct_dates sees them exactly as the pandas backend does.
+        """
+        distinct = con.execute(
+            f"SELECT value, count(*) AS rows FROM (SELECT {column} AS value, row_number() OVER () AS position FROM raw) "
+            "GROUP BY value ORDER BY min(position)"
+        ).df()
+        missing = distinct['value'].isna()
+        missing_rows = int(distinct.loc[missing, 'rows'].sum())
+        distinct = distinct[~missing].reset_index(drop=True)
+        if raw_type.startswith(('TIMESTAMP', 'DATE')):
+            # A typed Parquet column: nothing to parse, so only missing dates are dropped
+            values, parsed = distinct['value'], naive_utc(distinct['value']).astype(SCHEMA['date'])
+        else:
+            values, parsed = parse_distinct_dates(distinct['value'])
+        dropped_rows = count_date_drops(values, parsed, distinct['rows'].to_numpy(), missing_rows)
+        kept = parsed.notna().to_numpy()
+        dates = pd.DataFrame({'raw': distinct['value'][kept].to_numpy(), 'parsed': parsed[kept].to_numpy()})
+        return dates, dropped_rows
+
+    def _group(self, con, bucket, bucket_name, dims, bucket_dtype):
+        # Engagement sums and row counts per bucket and dimension combination, in bucket order,
+        # typed like the pandas backend's cube (categorical dimensions, the parsed dates' time unit)
+        keys = [bucket] + dims
+        frame = con.execute(
+            f"SELECT {bucket} AS {bucket_name}" + "".join(f", {dim}" for dim in dims)
+            + ", sum(engagements) AS engagements, count(*) AS count FROM cleaned"
+            + f" GROUP BY {', '.join(keys)} ORDER BY {bucket_name}"
+        ).df()
+        for dim in dims:
+            frame[dim] = frame[dim].astype('category')
+        frame['engagements'] = frame['engagements'].astype('int64')
+        frame['count'] = frame['count'].astype('int64')
+        frame[bucket_name] = frame[bucket_name].astype(bucket_dtype)
+        return frame
+
+
+BACKENDS = {backend.name: backend for backend in (PandasBackend, DuckDBBackend)}
+
+
+def available_backends():
+    """Names of the backends whose dependencies are installed, the default first."""
+    return [name for name, backend in BACKENDS.items() if backend.available()]
+
+
+def get_backend(name=None):
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown query backend: {name} (expected one of {', '.join(BACKENDS)})")
+    if not BACKENDS[name].available():
+        raise ValueError(f"Query backend '{name}' is not installed (pip install {name})")
+    return BACKENDS[name]()
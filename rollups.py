@@ -0,0 +1,149 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# Trend resolutions, finest first
+GRANULARITIES = ['hour', 'day', 'week', 'month']
+# Dimensions every rollup level is split by, so per-platform / per-sentiment trend lines and
+# platform/sentiment filters read the same buckets
+SPLIT_DIMENSIONS = ['platform', 'sentiment']
+# The automatic granularity is the finest one giving at most this many buckets over the shown range
+DEFAULT_MAX_BUCKETS = 400
+
+_BUCKET_SPAN = {
+    'hour': pd.Timedelta(hours=1),
+    'day': pd.Timedelta(days=1),
+    'week': pd.Timedelta(days=7),
+    'month': pd.Timedelta(days=30),
+}
+
+
+def floor_to(times, granularity):
+    """Start of the hour/day/week (Monday)/month bucket each timestamp falls in."""
+    times = pd.Series(times)
+    if granularity == 'hour':
+        return times.dt.floor('h')
+    days = times.dt.normalize()
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        return days - pd.to_timedelta(days.dt.dayofweek, unit='D')
+    if granularity == 'month':
+        return days - pd.to_timedelta(days.dt.day - 1, unit='D')
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def _group(frame, granularity):
+    # One row per (bucket, platform, sentiment) with engagement sums and row counts, in bucket order
+    splits = [c for c in SPLIT_DIMENSIONS if c in frame.columns]
+    keys = [floor_to(frame['bucket'], granularity).rename('bucket')] + [frame[c] for c in splits]
+    return (
+        frame.groupby(keys, dropna=False, observed=True, sort=False)[['engagements', 'count']]
+        .sum()
+        .reset_index()
+        .sort_values('bucket', kind='stable', ignore_index=True)
+    )
+
+
+@dataclass
+class TimeRollups:
+    """Engagement sums and row counts per time bucket at several resolutions, split by platform and sentiment.
+
+    Only the finest level is built from rows (or from the day cube); every coarser level is a
+    regrouping of the one below it, so switching granularity or zooming only reads small frames.
+    """
+    # granularity -> DataFrame [bucket, platform, sentiment, engagements, count], sorted by bucket
+    levels: dict
+    # granularity -> engagement totals per bucket
+    totals: dict = field(default_factory=dict)
+
+    @property
+    def granularities(self):
+        return [g for g in GRANULARITIES if g in self.levels]
+
+    def _window(self, frame, window):
+        if window is None:
+            return frame
+        start, end = window
+        buckets = frame['bucket'] if isinstance(frame, pd.DataFrame) else frame.index
+        lo = np.searchsorted(buckets, pd.Timestamp(start).normalize().to_datetime64(), side='left')
+        hi = np.searchsorted(buckets, (pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).to_datetime64(), side='left')
+        return frame.iloc[lo:hi]
+
+    def series(self, granularity, window=None, split=None):
+        """Engagements per bucket (a Series), or one column per `split` value (a DataFrame), for
+        buckets starting within `window` (inclusive days)."""
+        if split is None:
+            return self._window(self.totals[granularity], window)
+        level = self._window(self.levels[granularity], window)
+        return level.pivot_table(index='bucket', columns=split, values='engagements', aggfunc='sum', fill_value=0, observed=True)
+
+    def default_granularity(self, window=None, max_buckets=DEFAULT_MAX_BUCKETS):
+        """The finest granularity that keeps the shown range within max_buckets."""
+        totals = self.totals[self.granularities[0]]
+        if totals.empty:
+            return self.granularities[-1]
+        start, end = window if window is not None else (totals.index[0], totals.index[-1])
+        span = pd.Timestamp(end).normalize() + pd.Timedelta(days=1) - pd.Timestamp(start).normalize()
+        for granularity in self.granularities:
+            if span / _BUCKET_SPAN[granularity] <= max_buckets:
+                return granularity
+        return self.granularities[-1]
+
+    def filtered(self, date_range=None, selections=None):
+        """Rollups of the rows within `date_range` and `selections` ({split dimension: values}).
+
+        The finest level is cut and the coarser ones regrouped from it, so buckets straddling the
+        range edges only count rows inside the range.
+        """
+        base_granularity = self.granularities[0]
+        base = self._window(self.levels[base_granularity], date_range)
+        for dim, values in (selections or {}).items():
+            base = base[base[dim].isin(values)]
+        return build_pyramid(base.reset_index(drop=True), base_granularity)
+
+
+def build_pyramid(base, base_granularity):
+    """TimeRollups with `base` as the finest level and every coarser granularity derived from it."""
+    levels = {base_granularity: base}
+    for granularity in GRANULARITIES[GRANULARITIES.index(base_granularity) + 1:]:
+        levels[granularity] = _group(base, granularity)
+    totals = {granularity: level.groupby('bucket', sort=True)['engagements'].sum() for granularity, level in levels.items()}
+    return TimeRollups(levels=levels, totals=totals)
+
+
+def rollups_from_cube(cube):
+    """Day-level rollups from an aggregation cube (which has no time of day)."""
+    return build_pyramid(_group(cube.rename(columns={'day': 'bucket'}), 'day'), 'day')
+
+
+def hourly_base(cleaned_df):
+    """The hour level built from rows, or None when no row has a time of day (date-only exports),
+    in which case the cube's days are the finest resolution there is."""
+    dates = cleaned_df['date']
+    if dates.empty or (dates == dates.dt.normalize()).all():
+        return None
+    frame = cleaned_df[[c for c in SPLIT_DIMENSIONS if c in cleaned_df.columns]].assign(
+        bucket=dates, engagements=cleaned_df['engagements'].astype('int64'), count=1
+    )
+    return _group(frame, 'hour')
+
+
+def merge_rollups(parts):
+    """Merges rollups of disjoint row sets (CSV chunks, an append) at the finest granularity they
+    all have, then rebuilds the coarser levels."""
+    parts = [p for p in parts if p is not None]
+    if len(parts) == 1:
+        return parts[0]
+    base_granularity = max((p.granularities[0] for p in parts), key=GRANULARITIES.index)
+    base = _group(pd.concat([p.levels[base_granularity] for p in parts], ignore_index=True), base_granularity)
+    return build_pyramid(base, base_granularity)
+
+
+def rollups_from_rows(cleaned_df, cube=None):
+    """Rollups for freshly cleaned rows: hourly when they carry a time of day, otherwise from the day cube."""
+    hourly = hourly_base(cleaned_df)
+    if hourly is not None:
+        return build_pyramid(hourly, 'hour')
+    return rollups_from_cube(cube) if cube is not None else None
@@ -0,0 +1,243 @@
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from aggregates import aggregates_from_cube, compute_aggregates, union_categories
+from data_pipeline import DIMENSION_COLUMNS, PIPELINE_VERSION, Dataset, DroppedRows
+from rollups import build_pyramid
+
+DEFAULT_SNAPSHOT_DIR = os.environ.get(
+    "MEDIAINTEL_SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".cache", "mediaintel", "snapshots")
+)
+DEFAULT_SNAPSHOT_MAX_BYTES = int(os.environ.get("MEDIAINTEL_SNAPSHOT_MAX_MB", "2048")) * 1024 * 1024
+
+INDEX_FILE = "index.json"
+
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None or importlib.util.find_spec("fastparquet") is not None
+
+
+class SnapshotStore:
+    """On-disk Parquet snapshots of cleaned datasets, keyed by source content hash.
+
+    Typed columns (categoricals, int32, datetime64) round-trip through Parquet, so a reload
+    skips CSV parsing and date coercion entirely. A dataset built by appending rows is stored as
+    a delta on top of its base's snapshot. Total size is capped with LRU eviction. Snapshots
+    written by another data_pipeline.PIPELINE_VERSION are stale and are removed instead of loaded.
+    """
+
+    def __init__(self, root=DEFAULT_SNAPSHOT_DIR, max_bytes=DEFAULT_SNAPSHOT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._remove_stale()
+
+    # --- storage helpers ---
+
+    def _index_path(self):
+        return os.path.join(self.root, INDEX_FILE)
+
+    def _snapshot_path(self, source_hash):
+        return os.path.join(self.root, f"{source_hash}.parquet")
+
+    def _cube_path(self, source_hash):
+        return os.path.join(self.root, f"{source_hash}.cube.parquet")
+
+    def _hourly_path(self, source_hash):
+        return os.path.join(self.root, f"{source_hash}.hourly.parquet")
+
+    def _remove_files(self, source_hash):
+        for path in (self._snapshot_path(source_hash), self._cube_path(source_hash), self._hourly_path(source_hash)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _read_index(self):
+        try:
+            with open(self._index_path()) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Snapshots cleaned by other rules would load stale frames and aggregates, and entries whose
+        # file was removed behind our back can't load at all; deltas go with their base
+        index = {
+            h: meta for h, meta in index.items()
+            if meta.get("pipeline_version") == PIPELINE_VERSION and os.path.exists(self._snapshot_path(h))
+        }
+        return {h: meta for h, meta in index.items() if all(base in index for base in self._chain(h, index)[1:])}
+
+    @staticmethod
+    def _chain(source_hash, index):
+        """source_hash followed by the base it is a delta of, that base's base and so on."""
+        chain = [source_hash]
+        while index.get(chain[-1], {}).get("base") is not None:
+            chain.append(index[chain[-1]]["base"])
+        return chain
+
+    def _remove_stale(self):
+        # Deletes what _read_index no longer lists (snapshots from another PIPELINE_VERSION and
+        # deltas of them), so their files stop taking up the size budget
+        with self._lock:
+            index = self._read_index()
+            try:
+                with open(self._index_path()) as f:
+                    stale = set(json.load(f)) - set(index)
+            except (OSError, ValueError):
+                return
+            if stale:
+                for source_hash in stale:
+                    self._remove_files(source_hash)
+                self._write_index(index)
+
+    def _write_index(self, index):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".json.tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _evict(self, index, keep):
+        total = sum(meta["size_bytes"] for meta in index.values())
+        protected = set(self._chain(keep, index))
+        for source_hash, _ in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if source_hash in protected or source_hash not in index:
+                continue
+            # Deltas on top of an evicted snapshot can't be loaded any more, so they go with it
+            for evicted in [h for h in index if source_hash in self._chain(h, index)]:
+                self._remove_files(evicted)
+                total -= index.pop(evicted)["size_bytes"]
+
+    def _write_parquet(self, df, path):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".parquet.tmp")
+        os.close(fd)
+        try:
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.path.getsize(path)
+
+    # --- public API ---
+
+    def entries(self):
+        """Snapshot metadata, most recently used first."""
+        with self._lock:
+            index = self._read_index()
+        entries = [dict(meta, source_hash=h) for h, meta in index.items()]
+        return sorted(entries, key=lambda meta: meta["last_used"], reverse=True)
+
+    def save(self, dataset, name=None):
+        if dataset.cleaned_df is None:
+            # Streaming datasets keep only aggregates; there is no frame to snapshot
+            return False
+        return self._save(dataset, dataset.cleaned_df, name)
+
+    def save_delta(self, dataset, base, name=None):
+        """Snapshots `dataset`, built by appending rows to `base`, as only those appended rows.
+
+        The cost follows the size of the append, not of the history; load() stacks the rows on
+        base's snapshot. Returns False (and writes nothing) when base has no snapshot.
+        """
+        if dataset.cleaned_df is None or base.cleaned_df is None:
+            return False
+        with self._lock:
+            if base.source_hash not in self._read_index():
+                return False
+        # append_dataset puts the new rows after the base's
+        return self._save(dataset, dataset.cleaned_df.iloc[len(base.cleaned_df):], name, base=base.source_hash)
+
+    def _save(self, dataset, rows, name, base=None):
+        aggs = dataset.aggregates
+        size_bytes = self._write_parquet(rows, self._snapshot_path(dataset.source_hash))
+        if aggs is not None:
+            # The cube is tiny next to the frame and saves a full groupby on reload
+            size_bytes += self._write_parquet(aggs.cube, self._cube_path(dataset.source_hash))
+            # The hourly rollup can't be rebuilt from the day cube; coarser levels are rederived on load
+            if aggs.rollups is not None and 'hour' in aggs.rollups.levels:
+                size_bytes += self._write_parquet(aggs.rollups.levels['hour'], self._hourly_path(dataset.source_hash))
+
+        now = time.time()
+        with self._lock:
+            index = self._read_index()
+            index[dataset.source_hash] = {
+                "name": name or dataset.source_hash[:12],
+                "raw_row_count": dataset.raw_row_count,
+                "cleaned_row_count": dataset.cleaned_row_count,
+                "warnings": dataset.warnings,
+                "dropped_rows": dataset.dropped_rows.to_dict(),
+                "date_min": aggs.date_min.isoformat() if aggs is not None else None,
+                "date_max": aggs.date_max.isoformat() if aggs is not None else None,
+                "size_bytes": size_bytes,
+                "base": base,
+                "pipeline_version": PIPELINE_VERSION,
+                "created": now,
+                "last_used": now,
+            }
+            for source_hash in self._chain(dataset.source_hash, index)[1:]:
+                if source_hash in index:
+                    index[source_hash]["last_used"] = now
+            self._evict(index, keep=dataset.source_hash)
+            self._write_index(index)
+        return True
+
+    def load(self, source_hash):
+        """Returns the snapshotted Dataset, or None if there is no usable snapshot."""
+        with self._lock:
+            index = self._read_index()
+            meta = index.get(source_hash)
+            if meta is None:
+                return None
+            now = time.time()
+            for chained in self._chain(source_hash, index):
+                index[chained]["last_used"] = now
+            self._write_index(index)
+
+        try:
+            cleaned_df = self._read_rows(source_hash, index)
+        except Exception:
+            return None
+        return Dataset(
+            source_hash=source_hash,
+            raw_row_count=meta["raw_row_count"],
+            cleaned_row_count=meta["cleaned_row_count"],
+            cleaned_df=cleaned_df,
+            warnings=meta.get("warnings", []),
+            aggregates=self._load_aggregates(source_hash, meta, cleaned_df),
+            dropped_rows=DroppedRows.from_dict(meta.get("dropped_rows", {})),
+        )
+
+    def _read_rows(self, source_hash, index):
+        rows = pd.read_parquet(self._snapshot_path(source_hash))
+        base = index[source_hash].get("base")
+        if base is None:
+            return rows
+        # A delta holds only the rows appended to its base, which come first
+        return pd.concat(union_categories([self._read_rows(base, index), rows], DIMENSION_COLUMNS), ignore_index=True)
+
+    def _load_aggregates(self, source_hash, meta, cleaned_df):
+        if cleaned_df.empty:
+            return None
+        if meta.get("date_min") and os.path.exists(self._cube_path(source_hash)):
+            try:
+                hourly_path = self._hourly_path(source_hash)
+                return aggregates_from_cube(
+                    pd.read_parquet(self._cube_path(source_hash)),
+                    total_rows=len(cleaned_df),
+                    date_min=pd.Timestamp(meta["date_min"]),
+                    date_max=pd.Timestamp(meta["date_max"]),
+                    rollups=build_pyramid(pd.read_parquet(hourly_path), 'hour') if os.path.exists(hourly_path) else None,
+                )
+            except Exception:
+                pass
+        return compute_aggregates(cleaned_df)
@@ -1,8 +1,25 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import openai # Import the openai library
+
+import ai_client
+import charts
+import data_pipeline
+import dataset_registry
+import figure_cache
+import filters
+import llm_cache
+import metrics
+import prompts
+import query_backends
+import snapshot_store
+
+logger = logging.getLogger(__name__)
 
 # --- Streamlit App Configuration ---
 st.set_page_config(
@@ -11,6 +28,39 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+# Per-run stage timings, memory and LLM call metrics (shown in the sidebar, exported at the end of the run)
+run_metrics = metrics.activate(metrics.RunMetrics())
+
+@st.cache_resource
+def get_metrics_sink():
+    try:
+        return metrics.MetricsSink()
+    except OSError as e:
+        logger.warning("Could not open metrics file: %s", e)
+        return None
+
+def finish_run(run):
+    run.info["response_cache"] = get_response_cache().stats()
+    run.info["figure_cache"] = get_figure_cache().stats()
+    run.finish()
+    sink = get_metrics_sink()
+    if sink is not None:
+        try:
+            sink.write(run)
+        except OSError as e:
+            logger.warning("Could not write run metrics: %s", e)
+    # Keep the latest LLM calls across reruns so they stay visible after the run that made them
+    recent_llm_calls = st.session_state.setdefault("recent_llm_calls", [])
+    recent_llm_calls.extend(run.llm_calls)
+    del recent_llm_calls[:-20]
+
+show_diagnostics = st.sidebar.checkbox(
+    "Show diagnostics",
+    value=False,
+    help="Per-stage timings and memory, LLM latency and token usage, and cache hit rates for the latest run.",
+    key="show_diagnostics"
+)
+
 # --- Apple UI Inspired Styling (via Markdown/HTML) ---
 st.markdown(
     """
@@ -92,18 +142,6 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# --- Apple Color Palette ---
-apple_colors = {
-    'blue': '#007AFF',
-    'green': '#34C759',
-    'red': '#FF3B30',
-    'orange': '#FF9500',
-    'purple': '#AF52DE',
-    'gray': '#8E8E93',
-    'lightGray': '#E5E5EA',
-    'darkGray': '#1C1C1E'
-}
-
 # --- Title ---
 st.markdown("<h1 style='text-align: center;'>Interactive Media Intelligence Dashboard</h1>", unsafe_allow_html=True)
 
@@ -142,13 +180,201 @@ uploaded_file = st.file_uploader(
     key="csv_uploader"
 )
 
-df = None
-if uploaded_file is not None:
+# Loaded datasets live in one process-wide registry keyed by the upload's content hash, so reruns
+# triggered by other widgets (API key, model selector, insight buttons) skip parsing and cleaning
+# entirely and every session that uploads the same export shares a single copy. Each session holds
+# references to the datasets its current run uses; unused ones are evicted (least recently used
+# first) once the registry goes over its memory cap. Shared datasets must be treated as read-only.
+@st.cache_resource
+def get_dataset_registry():
+    return dataset_registry.DatasetRegistry()
+
+registry = get_dataset_registry()
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+# Registry keys used by this run; references to anything else are released once the dataset is resolved
+held_dataset_keys = []
+# Registry key of the dataset this run shows; anything derived from it (filter index, AI results) is keyed by it
+dataset_key = None
+
+def dataset_registry_key(source_hash, streaming=False, backend="pandas"):
+    # Each engine builds its own Dataset from the same upload, so each gets its own entry
+    if backend != "pandas":
+        return f"{source_hash}:{backend}"
+    return f"{source_hash}:streamed" if streaming else source_hash
+
+def load_cached_dataset(source_hash, _file_bytes=None, streaming=False, _file_name=None, backend="pandas"):
+    key = dataset_registry_key(source_hash, streaming, backend)
+    held_dataset_keys.append(key)
+
+    def load():
+        metrics.increment("dataset_cache_misses")
+        with st.spinner("Reading and cleaning CSV..."):
+            return _load_dataset(source_hash, _file_bytes, streaming, _file_name, backend)
+
+    return registry.acquire(session_id, key, load, name=_file_name)
+
+def _load_dataset(source_hash, _file_bytes=None, streaming=False, _file_name=None, backend="pandas"):
+    if backend != "pandas":
+        # Aggregates only (no cleaned rows), like streaming ingest, so there is nothing to snapshot
+        return query_backends.get_backend(backend).load_dataset(_file_bytes, source_hash=source_hash)
+    if streaming:
+        return data_pipeline.stream_dataset(_file_bytes, source_hash=source_hash)
+
+    # A Parquet snapshot from an earlier session skips CSV parsing and cleaning entirely
+    store = get_snapshot_store()
+    if store is not None:
+        with metrics.stage("snapshot_load"):
+            dataset = store.load(source_hash)
+        if dataset is not None:
+            metrics.increment("snapshot_hits")
+            return dataset
+    if _file_bytes is None:
+        raise data_pipeline.CSVReadError("The selected snapshot is no longer available.")
+
+    dataset = data_pipeline.load_dataset(_file_bytes, source_hash=source_hash)
+    if store is not None:
+        try:
+            with metrics.stage("snapshot_save"):
+                store.save(dataset, name=_file_name)
+        except Exception as e:
+            # A failed snapshot only costs the next session a re-parse
+            logger.warning("Could not write dataset snapshot: %s", e)
+    return dataset
+
+@st.cache_resource
+def get_snapshot_store():
+    if not snapshot_store.parquet_available():
+        return None
     try:
-        df = pd.read_csv(uploaded_file)
-        st.success(f"CSV file uploaded successfully! {len(df)} rows detected.")
-    except Exception as e:
+        return snapshot_store.SnapshotStore()
+    except OSError:
+        return None
+
+def get_upload_hash(file):
+    # Hash each upload once; later reruns reuse the digest stored against the uploader's file_id
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    if file.file_id not in hashes:
+        hashes.clear()
+        hashes[file.file_id] = data_pipeline.content_hash(file.getbuffer())
+    return hashes[file.file_id]
+
+store = get_snapshot_store()
+previous_snapshot = None
+if uploaded_file is None and store is not None:
+    snapshots = store.entries()
+    if snapshots:
+        previous_snapshot = st.selectbox(
+            "Or load a previous dataset",
+            options=[None] + snapshots,
+            format_func=lambda meta: "—" if meta is None else f"{meta['name']} ({meta['cleaned_row_count']} rows, {time.strftime('%Y-%m-%d %H:%M', time.localtime(meta['created']))})",
+            help="Reloads a previously uploaded dataset from its on-disk snapshot without re-parsing the CSV.",
+            key="previous_dataset"
+        )
+
+dataset = None
+load_error = None
+if previous_snapshot is not None:
+    try:
+        with metrics.stage("ingest"):
+            dataset = load_cached_dataset(previous_snapshot["source_hash"], _file_name=previous_snapshot["name"])
+            dataset_key = dataset_registry_key(previous_snapshot["source_hash"])
+        st.success(f"Loaded previous dataset '{previous_snapshot['name']}'! {dataset.raw_row_count} rows detected.")
+    except data_pipeline.CSVReadError as e:
+        st.error(f"Failed to load previous dataset: {e}")
+elif uploaded_file is not None:
+    backends = query_backends.available_backends()
+    query_backend = "pandas"
+    if len(backends) > 1:
+        query_backend = st.selectbox(
+            "Query engine",
+            options=backends,
+            index=backends.index(query_backends.DEFAULT_BACKEND) if query_backends.DEFAULT_BACKEND in backends else 0,
+            format_func=lambda name: query_backends.BACKENDS[name].label,
+            help="Engine that cleans and aggregates the upload. DuckDB scans the file with every core and spills to disk instead of holding all rows in memory; the charts and insights are identical.",
+            key="query_backend"
+        )
+    streaming_ingest = False
+    if query_backend == "pandas":
+        streaming_ingest = st.checkbox(
+            "Streaming ingest (large files)",
+            value=uploaded_file.size > data_pipeline.STREAMING_THRESHOLD_BYTES,
+            help="Reads the CSV in chunks and keeps only the aggregated results, so memory stays bounded for multi-GB exports.",
+            key="streaming_ingest"
+        )
+    try:
+        with metrics.stage("upload_read"):
+            file_bytes = uploaded_file.getvalue()
+            source_hash = get_upload_hash(uploaded_file)
+        with metrics.stage("ingest"):
+            dataset = load_cached_dataset(source_hash, file_bytes, streaming=streaming_ingest, _file_name=uploaded_file.name, backend=query_backend)
+            dataset_key = dataset_registry_key(source_hash, streaming_ingest, query_backend)
+        st.success(f"CSV file uploaded successfully! {dataset.raw_row_count} rows detected.")
+    except data_pipeline.CSVReadError as e:
         st.error(f"Failed to read CSV file: {e}")
+    except data_pipeline.DataCleaningError as e:
+        st.success(f"CSV file uploaded successfully! {e.raw_row_count} rows detected.")
+        load_error = e
+
+# Rows appended to the loaded dataset live in session state on top of the cached base, so the
+# base stays shared and read-only and discarding the appends is just dropping the entry
+if dataset is not None:
+    append_state = st.session_state.get("append_state")
+    if append_state is not None and append_state["base_hash"] != dataset.source_hash:
+        append_state = st.session_state["append_state"] = None
+    if append_state is not None:
+        # Re-registered every run, so it is held (and counted) like any other resident dataset
+        dataset = registry.put(session_id, append_state["dataset"].source_hash, append_state["dataset"], name=" + ".join(append_state["deltas"]))
+        held_dataset_keys.append(dataset.source_hash)
+        dataset_key = dataset.source_hash
+
+    with st.expander("Append new rows"):
+        st.caption("Adds a newer export to the current dataset without re-processing it: only the new rows are cleaned and folded into the charts, and rows whose duplicate key is already present are skipped.")
+        delta_file = st.file_uploader("New rows (CSV)", type="csv", key="delta_uploader")
+        column_options = dataset.cleaned_df.columns.tolist() if dataset.cleaned_df is not None else list(data_pipeline.SCHEMA)
+        dedup_key = st.multiselect(
+            "Duplicate key",
+            options=column_options,
+            default=data_pipeline.default_dedup_key(column_options),
+            help="A new row is skipped when all of these columns match a row already in the dataset (or an earlier row of the new file).",
+            key="dedup_key"
+        )
+        if st.button("Append to current dataset", key="append_btn", disabled=delta_file is None):
+            try:
+                with metrics.stage("append"):
+                    appended = data_pipeline.append_dataset(dataset, delta_file.getvalue(), key_columns=dedup_key)
+            except (data_pipeline.CSVReadError, data_pipeline.DataCleaningError) as e:
+                st.error(f"Could not append '{delta_file.name}': {e}")
+            else:
+                added = appended.cleaned_row_count - dataset.cleaned_row_count
+                duplicates = appended.dropped_rows.counts.get(data_pipeline.DUPLICATE_ROW, 0) - dataset.dropped_rows.counts.get(data_pipeline.DUPLICATE_ROW, 0)
+                base_dataset = dataset
+                deltas = (append_state["deltas"] if append_state is not None else []) + [delta_file.name]
+                # Another session appending the same file to the same base gets the copy already resident
+                appended = registry.put(session_id, appended.source_hash, appended, name=" + ".join(deltas))
+                held_dataset_keys.append(appended.source_hash)
+                append_state = st.session_state["append_state"] = {
+                    "base_hash": append_state["base_hash"] if append_state is not None else dataset.source_hash,
+                    "dataset": appended,
+                    "deltas": deltas,
+                }
+                dataset = appended
+                dataset_key = appended.source_hash
+                st.success(f"Appended {added} rows from '{delta_file.name}' ({duplicates} duplicates skipped).")
+                if store is not None:
+                    try:
+                        # Only the appended rows are written, on top of the base's snapshot
+                        with metrics.stage("snapshot_save"):
+                            store.save_delta(dataset, base_dataset, name=" + ".join(deltas))
+                    except Exception as e:
+                        logger.warning("Could not write dataset snapshot: %s", e)
+        if append_state is not None:
+            st.caption(f"Appended so far: {', '.join(append_state['deltas'])}")
+            if st.button("Discard appended rows", key="discard_append_btn"):
+                st.session_state["append_state"] = None
+                st.rerun()
+
+# Release this session's hold on datasets it no longer shows, so they become evictable
+registry.retain(session_id, held_dataset_keys)
 
 # --- Section 2: Data Cleaning Status ---
 st.markdown(
@@ -162,36 +388,76 @@ st.markdown(
 )
 
 cleaned_df = None
-if df is not None:
-    try:
-        # Normalize column names
-        df.columns = df.columns.str.lower().str.replace(' ', '_')
-
-        # Convert 'Date' to datetime, coercing errors to NaT
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-
-        # Fill missing 'Engagements' with 0
-        if 'engagements' in df.columns:
-            df['engagements'] = pd.to_numeric(df['engagements'], errors='coerce').fillna(0).astype(int)
-        else:
-            st.warning("'Engagements' column not found. Some charts may not display correctly.")
-            df['engagements'] = 0 # Add a placeholder column
-
-        # Filter out rows where date conversion failed
-        cleaned_df = df.dropna(subset=['date']).copy() # Use .copy() to avoid SettingWithCopyWarning
-
-        if not cleaned_df.empty:
-            st.success(f"Data cleaning complete! {len(cleaned_df)} valid rows processed.")
-        else:
-            st.warning("No valid data found after cleaning. Please check your CSV file format and 'Date' column.")
-            cleaned_df = None
+aggs = None
+if dataset is not None:
+    for warning in dataset.warnings:
+        st.warning(warning)
+    if dataset.dropped_rows.total:
+        st.info(
+            f"{dataset.dropped_rows.total} of {dataset.raw_row_count} rows were dropped during cleaning. "
+            + " ".join(dataset.dropped_rows.describe())
+        )
+    cleaned_df = dataset.cleaned_df
+    aggs = dataset.aggregates
 
-    except Exception as e:
-        st.error(f"Error during data cleaning: {e}")
+    if dataset.cleaned_row_count:
+        st.success(f"Data cleaning complete! {dataset.cleaned_row_count} valid rows processed.")
+        if cleaned_df is not None:
+            with st.expander("Memory report"):
+                st.caption("Memory used by the typed columns compared with holding the same data as object dtype.")
+                st.dataframe(data_pipeline.memory_report(cleaned_df), hide_index=True)
+    else:
+        st.warning("No valid data found after cleaning. Please check your CSV file format and 'Date' column.")
         cleaned_df = None
+        aggs = None
+elif load_error is not None:
+    st.error(f"Error during data cleaning: {load_error}")
 else:
     st.info("Awaiting CSV file upload for data cleaning.")
 
+# --- Sidebar Filters ---
+active_filters = None
+filtered_out = False
+if aggs is not None:
+    # Built once per resident dataset from its aggregation cube, shared by every session viewing it
+    # and dropped with the dataset when the registry evicts it
+    filter_index = registry.derived(dataset_key, "filter_index", lambda: filters.FilterIndex(aggs))
+    data_start, data_end = aggs.date_min.date(), aggs.date_max.date()
+    with st.sidebar:
+        st.header("Filters")
+        date_range = st.date_input(
+            "Date range",
+            value=(data_start, data_end),
+            min_value=data_start,
+            max_value=data_end,
+            help="Limits every chart and AI prompt to mentions in this date range.",
+            key="filter_date_range"
+        )
+        selections = {
+            dim: st.multiselect(
+                label,
+                options=filter_index.options(dim),
+                default=[],
+                placeholder="All",
+                key=f"filter_{dim}"
+            )
+            for dim, label in filters.FILTER_LABELS.items()
+            if dim in filter_index.codes
+        }
+    # The date picker returns a single date while the end of the range is still being chosen
+    date_filter = tuple(date_range) if len(date_range) == 2 and tuple(date_range) != (data_start, data_end) else None
+    with metrics.stage("filter"):
+        aggs = filter_index.apply(date_filter, selections)
+    active_filters = filters.describe(date_filter, selections)
+    if aggs is None:
+        filtered_out = True
+        st.warning("No rows match the current filters. Widen the date range or clear some selections in the sidebar.")
+    elif active_filters:
+        st.info(f"Filtered to {aggs.total_rows} of {dataset.cleaned_row_count} rows ({active_filters}).")
+
+# Results and figures are kept per dataset and filter combination
+view_key = (dataset_key if dataset is not None else None, active_filters)
+
 # --- AI Capabilities Section ---
 st.markdown(
     """
@@ -211,11 +477,7 @@ openrouter_api_key = st.text_input(
 )
 
 # Recommended free models on OpenRouter
-recommended_models = {
-    "Mistral 7B Instruct": "mistralai/mistral-7b-instruct",
-    "Google Gemini-2.0-flash": "google/gemini-2.0-flash-exp:free",
-    "llama-3.3-8b-instruct": "meta-llama/llama-3.3-8b-instruct:free",
-}
+recommended_models = ai_client.RECOMMENDED_MODELS
 
 selected_model_display = st.selectbox(
     "Select AI Model",
@@ -225,364 +487,545 @@ selected_model_display = st.selectbox(
 )
 selected_model_id = recommended_models[selected_model_display]
 
+# Process-wide LLM response cache shared by every session
+@st.cache_resource
+def get_response_cache():
+    try:
+        return llm_cache.ResponseCache()
+    except Exception as e:
+        # Fall back to an in-memory only cache if the on-disk tier can't be opened
+        logger.warning("Could not open LLM response cache on disk: %s", e)
+        return llm_cache.ResponseCache(path=None)
+
+response_cache = get_response_cache()
+bypass_ai_cache = st.checkbox(
+    "Bypass response cache",
+    value=False,
+    help="Always call the model, even if an identical request (same model, prompt and settings) was answered before.",
+    key="bypass_ai_cache"
+)
+stream_ai_responses = st.checkbox(
+    "Stream responses",
+    value=True,
+    help="Show the campaign recommendation and chart insights token by token as the model writes them.",
+    key="stream_ai_responses"
+)
+prompt_token_budget = st.number_input(
+    "Prompt token budget",
+    min_value=0,
+    value=prompts.PROMPT_TOKEN_BUDGET,
+    step=50,
+    help="Estimated tokens allowed per prompt. Summaries are shortened (fewer top entries, fewer trend details, then cut short) until the prompt fits; a prompt whose instructions alone are over the budget is not sent. 0 sends the most detailed summary.",
+    key="prompt_token_budget"
+)
+cache_stats = response_cache.stats()
+st.caption(
+    f"Response cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits, {cache_stats['misses']} misses "
+    f"({cache_stats['hit_rate']:.0%} hit rate)"
+)
+
+# One pooled OpenAI client per API key, kept alive across reruns so repeat calls reuse
+# the open HTTPS connection instead of paying TCP and TLS setup every time
+@st.cache_resource(max_entries=32)
+def get_ai_client(api_key):
+    return ai_client.create_client(api_key)
+
 # Initialize OpenAI client
 client = None
 if openrouter_api_key:
     try:
-        client = openai.OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=openrouter_api_key,
-        )
+        client = get_ai_client(openrouter_api_key)
     except Exception as e:
         st.error(f"Error initializing OpenAI client: {e}")
         client = None
 
+# Other recommended models to fall back to, in order, when the selected one is saturated
+fallback_model_ids = [m for m in recommended_models.values() if m != selected_model_id]
+
+def notify_model_fallback(from_model, to_model, error):
+    st.toast(f"{from_model} is busy ({getattr(error, 'status_code', 'error')}); trying {to_model} instead.")
+
 # Function to generate text using OpenAI/OpenRouter
 def generate_text_with_ai(prompt, model, client_obj):
     if not client_obj:
         st.error("AI client not initialized. Please provide a valid API key.")
         return "AI client not available."
     try:
-        response = client_obj.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=500,
+        return ai_client.complete(
+            client_obj, prompt, model, cache=response_cache, bypass_cache=bypass_ai_cache,
+            fallback_models=fallback_model_ids, on_fallback=notify_model_fallback,
+            on_metrics=metrics.record_llm_call
         )
-        return response.choices[0].message.content
-    except openai.APIConnectionError as e:
-        st.error(f"Could not connect to OpenRouter API: {e}. Please check your internet connection or API key.")
-        return "Error: Could not connect to API."
-    except openai.APIStatusError as e:
-        st.error(f"OpenRouter API returned an error: {e.status_code} - {e.response}. Please check your API key or model availability.")
-        return "Error: API call failed."
     except Exception as e:
-        st.error(f"An unexpected error occurred during AI generation: {e}")
-        return "Error: Unexpected AI generation error."
+        message, fallback_text = ai_client.describe_error(e)
+        st.error(message)
+        return fallback_text
 
-# --- Overall Campaign Recommendation ---
-if cleaned_df is not None and not cleaned_df.empty and client:
-    st.markdown(
-        """
-        <div class="chart-container">
-            <h2 title="Generates an overall campaign recommendation based on your media data.">Overall Campaign Recommendation</h2>
-            <p>This AI-powered recommendation provides insights into what's working and what needs improvement in your media campaigns.</p>
-        </div>
-        """,
-        unsafe_allow_html=True
+# AI results live in session state, scoped to the current dataset and filters, so a rerun caused by
+# another widget does not wipe recommendations and insights that are already on screen.
+def get_ai_results():
+    state = st.session_state.setdefault("ai_results", {"view": view_key, "results": {}, "prompt_tokens": {}})
+    if state["view"] != view_key:
+        state["view"] = view_key
+        state["results"] = {}
+        state["prompt_tokens"] = {}
+    return state["results"], state["prompt_tokens"]
+
+ai_results, ai_prompt_tokens = get_ai_results()
+# Placeholder per result slot, filled in place when results arrive
+ai_result_slots = {}
+# Prompts requested by a button click this run, generated when their slot is rendered
+ai_requests = {}
+
+# Streamed responses are re-rendered at most this often while tokens arrive
+STREAM_RENDER_INTERVAL = 0.1
+
+def stream_text_with_ai(prompt, model, client_obj, slot, placeholder):
+    if not client_obj:
+        st.error("AI client not initialized. Please provide a valid API key.")
+        return "AI client not available."
+    text = ""
+    last_render = 0.0
+    try:
+        pieces = ai_client.stream(
+            client_obj, prompt, model, cache=response_cache, bypass_cache=bypass_ai_cache,
+            fallback_models=fallback_model_ids, on_fallback=notify_model_fallback,
+            on_metrics=metrics.record_llm_call
+        )
+        for piece in pieces:
+            text += piece
+            if time.monotonic() - last_render >= STREAM_RENDER_INTERVAL:
+                with placeholder.container():
+                    render_ai_result(slot, text + " ▌")
+                last_render = time.monotonic()
+        return text
+    except Exception as e:
+        # Keep whatever arrived before the stream broke and flag the failure after it
+        message, fallback_text = ai_client.describe_error(e)
+        st.error(message)
+        return f"{text}\n\n{fallback_text}" if text else fallback_text
+
+def render_ai_result(slot, text):
+    if slot == prompts.CAMPAIGN_SLOT:
+        st.markdown(f"<div class='chart-container'><p>{text}</p></div>", unsafe_allow_html=True)
+    else:
+        st.markdown(f"<h4 style='color: #4A4A4A; font-weight: 500; margin-top: 1.5rem; margin-bottom: 0.5rem;'>Top 3 Insights:</h4>", unsafe_allow_html=True)
+        st.markdown(f"<ul style='color: #6B7280; list-style-type: disc; margin-left: 20px; padding-left: 0;'>{text}</ul>", unsafe_allow_html=True)
+
+def count_prompt_tokens(slot, prompt):
+    # Estimated locally before the call; the provider's own count arrives with the response metrics
+    tokens = prompts.estimate_tokens(prompt)
+    ai_prompt_tokens[slot] = (tokens, prompt_token_budget)
+    metrics.increment("prompt_tokens_estimated", tokens)
+    return tokens
+
+def warn_over_budget(label, prompt):
+    st.warning(
+        f"{label}: even with its data summary cut, the prompt needs ~{prompts.estimate_tokens(prompt)} tokens, "
+        f"over the budget of {prompt_token_budget}, so it was not sent. Raise \"Prompt token budget\" to generate it."
     )
 
-    if st.button("Generate Campaign Recommendation", key="generate_campaign_btn"):
-        with st.spinner("Generating campaign recommendation..."):
-            # Summarize data for the LLM
-            data_summary = f"""
-            Overall Data Summary:
-            Total entries: {len(cleaned_df)}
-            Date range: {cleaned_df['date'].min().strftime('%Y-%m-%d')} to {cleaned_df['date'].max().strftime('%Y-%m-%d')}
+def show_ai_result(slot):
+    prompt = ai_requests.pop(slot, None)
+    if prompt is not None and prompts.prompt_over_budget(prompt, prompt_token_budget):
+        warn_over_budget("Not generated", prompt)
+        prompt = None
+    if prompt is not None:
+        count_prompt_tokens(slot, prompt)
+    if slot in ai_prompt_tokens:
+        tokens, budget = ai_prompt_tokens[slot]
+        st.caption(f"Prompt: ~{tokens} tokens (budget {budget or 'off'}).")
+    placeholder = st.empty()
+    ai_result_slots[slot] = placeholder
+    if prompt is not None:
+        if stream_ai_responses:
+            ai_results[slot] = stream_text_with_ai(prompt, selected_model_id, client, slot, placeholder)
+        else:
+            spinner_text = "Generating campaign recommendation..." if slot == prompts.CAMPAIGN_SLOT else "Generating insights..."
+            with st.spinner(spinner_text):
+                ai_results[slot] = generate_text_with_ai(prompt, selected_model_id, client)
+    if slot in ai_results:
+        with placeholder.container():
+            render_ai_result(slot, ai_results[slot])
 
-            Sentiment Breakdown:
-            {cleaned_df['sentiment'].value_counts().to_dict()}
+def generate_all_insights(prompts_by_slot, model, api_key, status, report_prompt=None):
+    # Sends every prompt at once over an async client (bounded by MAX_CONCURRENT_REQUESTS),
+    # so a full report costs roughly one LLM round trip instead of one per button. With a
+    # report prompt, one combined call answers every slot and only the sections it misses
+    # (or gets wrong) are sent as their own prompts.
+    fallback_slots = []
 
-            Top 5 Platforms by Engagements:
-            {cleaned_df.groupby('platform')['engagements'].sum().nlargest(5).to_dict()}
+    def show(slot, text, error):
+        with ai_result_slots[slot].container():
+            if error is not None:
+                message, text = ai_client.describe_error(error)
+                st.error(message)
+            render_ai_result(slot, text)
+        ai_results[slot] = text
+        status.info(f"Generating all insights... {sum(slot in ai_results for slot in prompts_by_slot)}/{len(prompts_by_slot)} ready.")
 
-            Top 5 Media Types by Count:
-            {cleaned_df['media_type'].value_counts().nlargest(5).to_dict()}
+    async def _run():
+        async_client = ai_client.create_async_client(api_key)
+        options = dict(
+            cache=response_cache, bypass_cache=bypass_ai_cache, fallback_models=fallback_model_ids,
+            on_fallback=notify_model_fallback, on_metrics=metrics.record_llm_call
+        )
+        try:
+            if report_prompt is None:
+                async for slot, text, error in ai_client.complete_many(async_client, prompts_by_slot, model, **options):
+                    show(slot, text, error)
+                return
+            parse = lambda text: prompts.parse_report_response(text, list(prompts_by_slot))
+            async for slot, text, error, combined in ai_client.complete_combined(
+                async_client, report_prompt, prompts_by_slot, parse, model, **options
+            ):
+                if not combined:
+                    fallback_slots.append(slot)
+                    count_prompt_tokens(slot, prompts_by_slot[slot])
+                show(slot, text, error)
+        finally:
+            await async_client.close()
 
-            Top 5 Locations by Engagements:
-            {cleaned_df.groupby('location')['engagements'].sum().nlargest(5).to_dict()}
+    asyncio.run(_run())
+    if report_prompt is None:
+        status.success(f"All {len(prompts_by_slot)} insights generated.")
+    elif fallback_slots:
+        status.success(f"All {len(prompts_by_slot)} insights generated: {len(prompts_by_slot) - len(fallback_slots)} from one report call, {len(fallback_slots)} re-requested individually.")
+    else:
+        status.success(f"All {len(prompts_by_slot)} insights generated from one report call.")
 
-            Engagement trend (first 5 and last 5 dates):
-            {cleaned_df.groupby(cleaned_df['date'].dt.date)['engagements'].sum().head(5).to_dict()}
-            ...
-            {cleaned_df.groupby(cleaned_df['date'].dt.date)['engagements'].sum().tail(5).to_dict()}
-            """
+# Chart figures are cached process-wide as ready-to-send JSON, keyed by a hash of the aggregates
+# each chart is drawn from plus its drawing parameters, so a chart whose inputs haven't changed is
+# neither rebuilt nor re-serialized, in this session or any other showing the same data
+@st.cache_resource
+def get_figure_cache():
+    return figure_cache.FigureCache()
+
+def cached_figure(slot, build, *inputs):
+    def _build():
+        with metrics.stage(f"figure_{slot}"):
+            return build()
 
-            campaign_prompt = f"""
-            Analyze the following media intelligence data. Based on the sentiment breakdown, engagement trends, platform performance, media type mix, and top locations, provide a concise campaign recommendation.
-            The recommendation should clearly state 'What's Working' and 'What Needs to be Improved' to optimize future media strategies. Focus on actionable advice.
+    return charts.figure_from_json(get_figure_cache().get_or_build(figure_cache.figure_key(slot, *inputs), _build))
 
-            {data_summary}
+@contextmanager
+def fragment_run(name):
+    # During a full run a section records into the page's run; a fragment rerun is a run of its own
+    run = metrics.current()
+    if run is not None and run.total_seconds is None:
+        yield
+        return
+    run = metrics.RunMetrics(kind=f"fragment:{name}")
+    with metrics.recording(run):
+        yield
+    finish_run(run)
 
-            Campaign Recommendation:
+def chart_insights(slot, button_label):
+    if client:
+        if st.button(f"Generate Insights for {button_label}", key=f"insights_{slot}"):
+            ai_requests[slot] = prompts.build_chart_prompt(aggs, slot, prompt_token_budget)
+    else:
+        st.info("Enter API key and select model to generate AI insights for this chart.")
+    show_ai_result(slot)
+
+# The AI panel and each chart section are fragments: their buttons and controls rerun only that
+# section, not the whole page
+@st.fragment
+def campaign_section():
+    with fragment_run(prompts.CAMPAIGN_SLOT):
+        if st.button("Generate Campaign Recommendation", key="generate_campaign_btn"):
+            ai_requests[prompts.CAMPAIGN_SLOT] = prompts.build_campaign_prompt(aggs, prompt_token_budget)
+        show_ai_result(prompts.CAMPAIGN_SLOT)
+
+# Aggregate each chart needs, by slot
+chart_requirements = {slot: required for slot, _, _, required in prompts.CHART_INSIGHTS}
+
+@st.fragment
+def chart_section(slot, heading, tooltip, button_label, missing_message):
+    with fragment_run(slot):
+        st.markdown(
+            f"""
+            <div class="chart-container">
+                <h3 title="{tooltip}">{heading}</h3>
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
+        if getattr(aggs, chart_requirements[slot]) is None:
+            st.warning(missing_message)
+            return
+        fig = cached_figure(slot, lambda: charts.FIGURE_BUILDERS[slot](aggs), charts.FIGURE_INPUTS[slot](aggs))
+        with metrics.stage(f"render_{slot}"):
+            st.plotly_chart(fig, use_container_width=True)
+        chart_insights(slot, button_label)
+
+@st.fragment
+def engagement_trend_section():
+    with fragment_run("engagement_trend"):
+        st.markdown(
             """
-            recommendation = generate_text_with_ai(campaign_prompt, selected_model_id, client)
-            st.markdown(f"<div class='chart-container'><p>{recommendation}</p></div>", unsafe_allow_html=True)
-else:
-    if cleaned_df is None or cleaned_df.empty:
-        st.info("Upload a CSV and ensure data cleaning is complete to enable AI capabilities.")
-    elif not openrouter_api_key:
-        st.info("Please enter your OpenRouter API Key to enable AI capabilities.")
+            <div class="chart-container">
+                <h3 title="A line chart illustrating how total engagements evolve over time.">Engagement Trend Over Time</h3>
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
+        if aggs.engagement_by_date is None:
+            st.warning("Date or Engagements column not found in the uploaded CSV. Cannot generate Engagement Trend chart.")
+            return
 
+        # The trend reads precomputed rollups: the zoom window and granularity pick buckets without
+        # regrouping rows. Long series are still downsampled unless "Full resolution" is ticked.
+        rollups = aggs.rollups
+        trend_window = None
+        trend_start, trend_end = aggs.date_min.date(), aggs.date_max.date()
+        if trend_start < trend_end:
+            trend_window = st.slider(
+                "Zoom window",
+                min_value=trend_start,
+                max_value=trend_end,
+                value=(trend_start, trend_end),
+                help="Limits the trend chart to this date range.",
+                key="trend_window"
+            )
+            if trend_window == (trend_start, trend_end):
+                trend_window = None
+        auto_granularity = rollups.default_granularity(trend_window)
+        granularity_col, split_col, resolution_col = st.columns([1, 1, 1])
+        with granularity_col:
+            trend_granularity = st.selectbox(
+                "Granularity",
+                options=["auto"] + rollups.granularities,
+                format_func=lambda g: f"Auto ({auto_granularity})" if g == "auto" else g.capitalize(),
+                help="Bucket size for the trend. Auto picks the finest one that keeps the shown range readable; hourly needs timestamps with a time of day.",
+                key="trend_granularity"
+            )
+            if trend_granularity == "auto":
+                trend_granularity = auto_granularity
+        with split_col:
+            trend_split = st.selectbox(
+                "Split by",
+                options=[None] + [dim for dim in charts.SPLIT_LABELS if dim in rollups.levels[trend_granularity].columns],
+                format_func=lambda dim: "Total" if dim is None else charts.SPLIT_LABELS[dim],
+                help="Draw one line per platform or sentiment.",
+                key="trend_split"
+            )
+        trend_max_points = charts.TREND_POINT_BUDGET
+        if len(rollups.series(trend_granularity, trend_window)) > charts.TREND_POINT_BUDGET:
+            with resolution_col:
+                if st.checkbox(
+                    "Full resolution",
+                    value=False,
+                    help=f"Plot every point in the zoom window (up to {charts.TREND_FULL_RESOLUTION_LIMIT:,}) instead of a shape-preserving sample.",
+                    key="trend_full_resolution"
+                ):
+                    trend_max_points = charts.TREND_FULL_RESOLUTION_LIMIT
+        fig_engagement_trend = cached_figure(
+            "engagement_trend",
+            lambda: charts.engagement_trend_figure(
+                aggs, window=trend_window, max_points=trend_max_points, granularity=trend_granularity, split=trend_split
+            ),
+            charts.trend_series(aggs, trend_window, trend_granularity, trend_split),
+            trend_max_points
+        )
+        with metrics.stage("render_engagement_trend"):
+            st.plotly_chart(fig_engagement_trend, use_container_width=True)
+        shown_trend_points = len(fig_engagement_trend.data[0].x)
+        window_trend_points = len(rollups.series(trend_granularity, trend_window))
+        if shown_trend_points < window_trend_points:
+            st.caption(f"Showing {shown_trend_points:,} of {window_trend_points:,} points (downsampled, peaks and dips preserved).")
+        chart_insights("engagement_trend", "Engagement Trend")
 
-# --- Section 3: Interactive Charts ---
-if cleaned_df is not None and not cleaned_df.empty:
+# --- Overall Campaign Recommendation ---
+generate_all_requested = False
+if aggs is not None and client:
     st.markdown(
         """
         <div class="chart-container">
-            <h2 title="Visualizes your media data through interactive charts and provides key insights.">3. Interactive Charts & Insights</h2>
-            <p>Explore the various aspects of your media data through these interactive visualizations. Each chart now comes with AI-generated insights to help you understand your media performance.</p>
+            <h2 title="Generates an overall campaign recommendation based on your media data.">Overall Campaign Recommendation</h2>
+            <p>This AI-powered recommendation provides insights into what's working and what needs improvement in your media campaigns.</p>
         </div>
         """,
         unsafe_allow_html=True
     )
 
-    # Function to generate chart insights
-    def get_chart_insights(chart_title, data_description, client_obj, model_id):
-        prompt = f"""
-        Given the following data for a "{chart_title}" chart:
-        {data_description}
+    # Outside the fragments on purpose: a full report fills every section, so it reruns the whole page
+    generate_all_requested = st.button(
+        "Generate All Insights",
+        key="generate_all_insights_btn",
+        help="Generates the campaign recommendation and every chart's insights in one go."
+    )
+    one_shot_report = st.checkbox(
+        "One-shot report",
+        value=True,
+        help="Asks for the whole report (every chart's insights plus what's working and what needs to be improved) in a single structured call, so the data summary is sent once. Sections the answer misses are re-requested individually. Untick to send one request per section, concurrently.",
+        key="one_shot_report"
+    )
+    generate_all_status = st.empty()
+    if generate_all_requested:
+        all_prompts = prompts.build_all_prompts(aggs, prompt_token_budget)
+        # Prompts the budget can't cover even with their summary cut are not sent
+        for slot, prompt in list(all_prompts.items()):
+            if prompts.prompt_over_budget(prompt, prompt_token_budget):
+                warn_over_budget(f"Skipped '{slot}'", all_prompts.pop(slot))
+        # Clear the slots being regenerated so stale results and token counts don't linger while new ones arrive
+        for slot in all_prompts:
+            ai_results.pop(slot, None)
+            ai_prompt_tokens.pop(slot, None)
+        report_prompt = prompts.build_report_prompt(aggs, prompt_token_budget) if one_shot_report else None
+        if report_prompt is not None and prompts.prompt_over_budget(report_prompt, prompt_token_budget * prompts.REPORT_BUDGET_SCALE):
+            # Too big for its budget: the sections go out as their own prompts instead
+            report_prompt = None
+        if report_prompt is not None:
+            total_prompt_tokens = count_prompt_tokens(prompts.REPORT_SLOT, report_prompt)
+            generate_all_status.info(f"Generating the full report in one call... (~{total_prompt_tokens} prompt tokens).")
+        else:
+            total_prompt_tokens = sum(count_prompt_tokens(slot, prompt) for slot, prompt in all_prompts.items())
+            generate_all_status.info(f"Generating all insights... 0/{len(all_prompts)} ready (~{total_prompt_tokens} prompt tokens).")
+    campaign_section()
+else:
+    if aggs is None and not filtered_out:
+        st.info("Upload a CSV and ensure data cleaning is complete to enable AI capabilities.")
+    elif not openrouter_api_key:
+        st.info("Please enter your OpenRouter API Key to enable AI capabilities.")
 
-        Provide 3 concise and actionable insights based on this data. Format them as a bulleted list.
-        """
-        return generate_text_with_ai(prompt, model_id, client_obj)
 
-    # --- Sentiment Breakdown Pie Chart ---
+# --- Section 3: Interactive Charts ---
+if aggs is not None:
     st.markdown(
         """
         <div class="chart-container">
-            <h3 title="A pie chart showing the distribution of positive, negative, and neutral sentiments in your data.">Sentiment Breakdown</h3>
+            <h2 title="Visualizes your media data through interactive charts and provides key insights.">3. Interactive Charts & Insights</h2>
+            <p>Explore the various aspects of your media data through these interactive visualizations. Each chart now comes with AI-generated insights to help you understand your media performance.</p>
         </div>
         """,
         unsafe_allow_html=True
     )
-    if 'sentiment' in cleaned_df.columns:
-        sentiment_counts = cleaned_df['sentiment'].value_counts().reset_index()
-        sentiment_counts.columns = ['Sentiment', 'Count']
-        fig_sentiment = px.pie(
-            sentiment_counts,
-            values='Count',
-            names='Sentiment',
-            hole=0.4,
-            color_discrete_sequence=[apple_colors['red'], apple_colors['orange'], apple_colors['green'], apple_colors['gray']],
-            title='Sentiment Breakdown'
-        )
-        fig_sentiment.update_layout(
-            font_family="Inter",
-            title_font_color=apple_colors['darkGray'],
-            title_x=0.5,
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            legend=dict(bgcolor='rgba(255,255,255,0.7)', bordercolor=apple_colors['lightGray'], borderwidth=1, font=dict(color=apple_colors['darkGray']))
-        )
-        st.plotly_chart(fig_sentiment, use_container_width=True)
-
-        if client:
-            if st.button(f"Generate Insights for Sentiment Breakdown", key="insights_sentiment"):
-                with st.spinner("Generating insights..."):
-                    insights = get_chart_insights(
-                        "Sentiment Breakdown",
-                        f"Sentiment distribution: {sentiment_counts.set_index('Sentiment').to_dict()['Count']}",
-                        client, selected_model_id
-                    )
-                    st.markdown(f"<h4 style='color: #4A4A4A; font-weight: 500; margin-top: 1.5rem; margin-bottom: 0.5rem;'>Top 3 Insights:</h4>", unsafe_allow_html=True)
-                    st.markdown(f"<ul style='color: #6B7280; list-style-type: disc; margin-left: 20px; padding-left: 0;'>{insights}</ul>", unsafe_allow_html=True)
-        else:
-            st.info("Enter API key and select model to generate AI insights for this chart.")
-    else:
-        st.warning("Sentiment column not found in the uploaded CSV. Cannot generate Sentiment Breakdown chart.")
 
-    # --- Engagement Trend over Time Line Chart ---
-    st.markdown(
-        """
-        <div class="chart-container">
-            <h3 title="A line chart illustrating how total engagements evolve over time.">Engagement Trend Over Time</h3>
-        </div>
-        """,
-        unsafe_allow_html=True
+    # --- Sentiment Breakdown Pie Chart ---
+    chart_section(
+        "sentiment",
+        "Sentiment Breakdown",
+        "A pie chart showing the distribution of positive, negative, and neutral sentiments in your data.",
+        "Sentiment Breakdown",
+        "Sentiment column not found in the uploaded CSV. Cannot generate Sentiment Breakdown chart."
     )
-    if 'date' in cleaned_df.columns and 'engagements' in cleaned_df.columns:
-        engagement_by_date = cleaned_df.groupby(cleaned_df['date'].dt.date)['engagements'].sum().reset_index()
-        engagement_by_date.columns = ['Date', 'Total Engagements']
-        fig_engagement_trend = px.line(
-            engagement_by_date,
-            x='Date',
-            y='Total Engagements',
-            title='Engagement Trend Over Time',
-            color_discrete_sequence=[apple_colors['blue']]
-        )
-        fig_engagement_trend.update_traces(mode='lines+markers', marker=dict(symbol='circle-open', size=6, line=dict(width=1, color=apple_colors['blue'])))
-        fig_engagement_trend.update_layout(
-            font_family="Inter",
-            title_font_color=apple_colors['darkGray'],
-            title_x=0.5,
-            xaxis_title_font_color=apple_colors['gray'],
-            yaxis_title_font_color=apple_colors['gray'],
-            xaxis_tickfont_color=apple_colors['gray'],
-            yaxis_tickfont_color=apple_colors['gray'],
-            xaxis_gridcolor=apple_colors['lightGray'],
-            yaxis_gridcolor=apple_colors['lightGray'],
-            xaxis_linecolor=apple_colors['lightGray'],
-            yaxis_linecolor=apple_colors['lightGray'],
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-        )
-        st.plotly_chart(fig_engagement_trend, use_container_width=True)
-
-        if client:
-            if st.button(f"Generate Insights for Engagement Trend", key="insights_engagement_trend"):
-                with st.spinner("Generating insights..."):
-                    # Provide a sample of the data to avoid sending too much
-                    data_sample = engagement_by_date.head(5).to_string(index=False) + "\n..." + engagement_by_date.tail(5).to_string(index=False)
-                    insights = get_chart_insights(
-                        "Engagement Trend Over Time",
-                        f"Engagement data over time (sample):\n{data_sample}",
-                        client, selected_model_id
-                    )
-                    st.markdown(f"<h4 style='color: #4A4A4A; font-weight: 500; margin-top: 1.5rem; margin-bottom: 0.5rem;'>Top 3 Insights:</h4>", unsafe_allow_html=True)
-                    st.markdown(f"<ul style='color: #6B7280; list-style-type: disc; margin-left: 20px; padding-left: 0;'>{insights}</ul>", unsafe_allow_html=True)
-        else:
-            st.info("Enter API key and select model to generate AI insights for this chart.")
-    else:
-        st.warning("Date or Engagements column not found in the uploaded CSV. Cannot generate Engagement Trend chart.")
+
+    # --- Engagement Trend over Time Line Chart ---
+    engagement_trend_section()
 
     # --- Platform Engagements Bar Chart ---
-    st.markdown(
-        """
-        <div class="chart-container">
-            <h3 title="A bar chart displaying the total engagements across different platforms.">Platform Engagements</h3>
-        </div>
-        """,
-        unsafe_allow_html=True
+    chart_section(
+        "platform",
+        "Platform Engagements",
+        "A bar chart displaying the total engagements across different platforms.",
+        "Platform Engagements",
+        "Platform or Engagements column not found in the uploaded CSV. Cannot generate Platform Engagements chart."
     )
-    if 'platform' in cleaned_df.columns and 'engagements' in cleaned_df.columns:
-        platform_engagements = cleaned_df.groupby('platform')['engagements'].sum().reset_index()
-        platform_engagements.columns = ['Platform', 'Total Engagements']
-        fig_platform = px.bar(
-            platform_engagements,
-            x='Platform',
-            y='Total Engagements',
-            title='Platform Engagements',
-            color_discrete_sequence=[apple_colors['purple']]
-        )
-        fig_platform.update_layout(
-            font_family="Inter",
-            title_font_color=apple_colors['darkGray'],
-            title_x=0.5,
-            xaxis_title_font_color=apple_colors['gray'],
-            yaxis_title_font_color=apple_colors['gray'],
-            xaxis_tickfont_color=apple_colors['gray'],
-            yaxis_tickfont_color=apple_colors['gray'],
-            xaxis_gridcolor=apple_colors['lightGray'],
-            yaxis_gridcolor=apple_colors['lightGray'],
-            xaxis_linecolor=apple_colors['lightGray'],
-            yaxis_linecolor=apple_colors['lightGray'],
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-        )
-        st.plotly_chart(fig_platform, use_container_width=True)
-
-        if client:
-            if st.button(f"Generate Insights for Platform Engagements", key="insights_platform"):
-                with st.spinner("Generating insights..."):
-                    insights = get_chart_insights(
-                        "Platform Engagements",
-                        f"Platform engagements: {platform_engagements.set_index('Platform').to_dict()['Total Engagements']}",
-                        client, selected_model_id
-                    )
-                    st.markdown(f"<h4 style='color: #4A4A4A; font-weight: 500; margin-top: 1.5rem; margin-bottom: 0.5rem;'>Top 3 Insights:</h4>", unsafe_allow_html=True)
-                    st.markdown(f"<ul style='color: #6B7280; list-style-type: disc; margin-left: 20px; padding-left: 0;'>{insights}</ul>", unsafe_allow_html=True)
-        else:
-            st.info("Enter API key and select model to generate AI insights for this chart.")
-    else:
-        st.warning("Platform or Engagements column not found in the uploaded CSV. Cannot generate Platform Engagements chart.")
 
     # --- Media Type Mix Pie Chart ---
-    st.markdown(
-        """
-        <div class="chart-container">
-            <h3 title="A pie chart showing the proportion of different media types in your dataset.">Media Type Mix</h3>
-        </div>
-        """,
-        unsafe_allow_html=True
+    chart_section(
+        "media_type",
+        "Media Type Mix",
+        "A pie chart showing the proportion of different media types in your dataset.",
+        "Media Type Mix",
+        "Media Type column not found in the uploaded CSV. Cannot generate Media Type Mix chart."
     )
-    if 'media_type' in cleaned_df.columns:
-        media_type_counts = cleaned_df['media_type'].value_counts().reset_index()
-        media_type_counts.columns = ['Media Type', 'Count']
-        fig_media_type = px.pie(
-            media_type_counts,
-            values='Count',
-            names='Media Type',
-            hole=0.4,
-            color_discrete_sequence=[apple_colors['orange'], apple_colors['green'], apple_colors['blue'], apple_colors['gray']],
-            title='Media Type Mix'
-        )
-        fig_media_type.update_layout(
-            font_family="Inter",
-            title_font_color=apple_colors['darkGray'],
-            title_x=0.5,
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            legend=dict(bgcolor='rgba(255,255,255,0.7)', bordercolor=apple_colors['lightGray'], borderwidth=1, font=dict(color=apple_colors['darkGray']))
-        )
-        st.plotly_chart(fig_media_type, use_container_width=True)
-
-        if client:
-            if st.button(f"Generate Insights for Media Type Mix", key="insights_media_type"):
-                with st.spinner("Generating insights..."):
-                    insights = get_chart_insights(
-                        "Media Type Mix",
-                        f"Media type distribution: {media_type_counts.set_index('Media Type').to_dict()['Count']}",
-                        client, selected_model_id
-                    )
-                    st.markdown(f"<h4 style='color: #4A4A4A; font-weight: 500; margin-top: 1.5rem; margin-bottom: 0.5rem;'>Top 3 Insights:</h4>", unsafe_allow_html=True)
-                    st.markdown(f"<ul style='color: #6B7280; list-style-type: disc; margin-left: 20px; padding-left: 0;'>{insights}</ul>", unsafe_allow_html=True)
-        else:
-            st.info("Enter API key and select model to generate AI insights for this chart.")
-    else:
-        st.warning("Media Type column not found in the uploaded CSV. Cannot generate Media Type Mix chart.")
 
     # --- Top 5 Locations Bar Chart ---
-    st.markdown(
-        """
-        <div class="chart-container">
-            <h3 title="A bar chart highlighting the top 5 geographical locations by total engagements.">Top 5 Locations by Engagement</h3>
-        </div>
-        """,
-        unsafe_allow_html=True
+    chart_section(
+        "locations",
+        "Top 5 Locations by Engagement",
+        "A bar chart highlighting the top 5 geographical locations by total engagements.",
+        "Top 5 Locations",
+        "Location or Engagements column not found in the uploaded CSV. Cannot generate Top 5 Locations chart."
     )
-    if 'location' in cleaned_df.columns and 'engagements' in cleaned_df.columns:
-        location_engagements = cleaned_df.groupby('location')['engagements'].sum().nlargest(5).reset_index()
-        location_engagements.columns = ['Location', 'Total Engagements']
-        fig_locations = px.bar(
-            location_engagements,
-            x='Location',
-            y='Total Engagements',
-            title='Top 5 Locations by Engagement',
-            color_discrete_sequence=[apple_colors['blue']]
-        )
-        fig_locations.update_layout(
-            font_family="Inter",
-            title_font_color=apple_colors['darkGray'],
-            title_x=0.5,
-            xaxis_title_font_color=apple_colors['gray'],
-            yaxis_title_font_color=apple_colors['gray'],
-            xaxis_tickfont_color=apple_colors['gray'],
-            yaxis_tickfont_color=apple_colors['gray'],
-            xaxis_gridcolor=apple_colors['lightGray'],
-            yaxis_gridcolor=apple_colors['lightGray'],
-            xaxis_linecolor=apple_colors['lightGray'],
-            yaxis_linecolor=apple_colors['lightGray'],
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-        )
-        st.plotly_chart(fig_locations, use_container_width=True)
-
-        if client:
-            if st.button(f"Generate Insights for Top 5 Locations", key="insights_locations"):
-                with st.spinner("Generating insights..."):
-                    insights = get_chart_insights(
-                        "Top 5 Locations by Engagement",
-                        f"Top 5 locations by engagement: {location_engagements.set_index('Location').to_dict()['Total Engagements']}",
-                        client, selected_model_id
-                    )
-                    st.markdown(f"<h4 style='color: #4A4A4A; font-weight: 500; margin-top: 1.5rem; margin-bottom: 0.5rem;'>Top 3 Insights:</h4>", unsafe_allow_html=True)
-                    st.markdown(f"<ul style='color: #6B7280; list-style-type: disc; margin-left: 20px; padding-left: 0;'>{insights}</ul>", unsafe_allow_html=True)
-        else:
-            st.info("Enter API key and select model to generate AI insights for this chart.")
-    else:
-        st.warning("Location or Engagements column not found in the uploaded CSV. Cannot generate Top 5 Locations chart.")
 
-elif uploaded_file is not None and (cleaned_df is None or cleaned_df.empty):
+elif uploaded_file is not None and aggs is None and not filtered_out:
     st.error("Could not process data. Please ensure your CSV file has the required columns and valid data.")
 
+# --- Full report: runs last so every chart's insight placeholder already exists ---
+if aggs is not None and client and generate_all_requested and all_prompts:
+    with metrics.stage("generate_all_insights"):
+        generate_all_insights(all_prompts, selected_model_id, openrouter_api_key, generate_all_status, report_prompt)
+
+# --- Diagnostics: finish and export this run's metrics ---
+if dataset is not None:
+    run_metrics.info["cleaned_row_count"] = dataset.cleaned_row_count
+    run_metrics.info["dataset_cache_hit"] = "dataset_cache_misses" not in run_metrics.counters
+finish_run(run_metrics)
+
+if show_diagnostics:
+    with st.sidebar:
+        st.subheader("Diagnostics")
+        rss = metrics.rss_bytes()
+        st.caption(f"Last full page run: {run_metrics.total_seconds:.2f}s" + (f", process RSS {rss / 1e6:.0f} MB" if rss else ""))
+        if run_metrics.stages:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Stage": name,
+                        "Seconds": entry["seconds"],
+                        "Calls": entry["calls"],
+                        "Δ RSS (MB)": entry["rss_delta_bytes"] / 1e6,
+                    }
+                    for name, entry in run_metrics.stages.items()
+                ]).round(4),
+                hide_index=True
+            )
+        if "dataset_cache_hit" in run_metrics.info:
+            st.caption("Dataset: " + ("served from cache" if run_metrics.info["dataset_cache_hit"] else "parsed this run"))
+        registry_stats = registry.stats()
+        st.markdown("**Resident datasets**")
+        st.caption(
+            f"{registry_stats['datasets']} datasets, {registry_stats['resident_bytes'] / 1e6:.0f} of {registry_stats['max_bytes'] / 1e6:.0f} MB, "
+            f"{registry_stats['sessions']} sessions, {registry_stats['evictions']} evictions"
+        )
+        resident = registry.entries()
+        if resident:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Dataset": entry["name"],
+                        "Rows": entry["rows"],
+                        "MB": entry["bytes"] / 1e6,
+                        "Sessions": entry["sessions"],
+                        "Hits": entry["hits"],
+                        "Last used": time.strftime("%H:%M:%S", time.localtime(entry["last_used"])),
+                    }
+                    for entry in resident
+                ]).round(1),
+                hide_index=True
+            )
+            if st.button("Evict unused datasets", key="evict_unused_datasets_btn"):
+                st.toast(f"Evicted {registry.evict_unused()} unused datasets.")
+        run_cache_stats = run_metrics.info["response_cache"]
+        st.caption(
+            f"Response cache: {run_cache_stats['hit_rate']:.0%} hit rate this process "
+            f"({run_cache_stats['memory_hits']} memory / {run_cache_stats['disk_hits']} disk hits, {run_cache_stats['misses']} misses)"
+        )
+        figure_cache_stats = run_metrics.info["figure_cache"]
+        st.caption(
+            f"Figure cache: {figure_cache_stats['hit_rate']:.0%} hit rate this process "
+            f"({figure_cache_stats['entries']} figures, {figure_cache_stats['bytes'] / 1e6:.1f} MB, {figure_cache_stats['misses']} built)"
+        )
+        recent_llm_calls = st.session_state["recent_llm_calls"]
+        if recent_llm_calls:
+            st.markdown("**Recent LLM calls**")
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Model": call["model"],
+                        "Cached": call["cached"],
+                        "Latency (s)": call["seconds"],
+                        "First token (s)": call["first_token_seconds"],
+                        "Prompt tokens": call["prompt_tokens"],
+                        "Completion tokens": call["completion_tokens"],
+                    }
+                    for call in reversed(recent_llm_calls)
+                ]).round(3),
+                hide_index=True
+            )
+        metrics_sink = get_metrics_sink()
+        if metrics_sink is not None:
+            st.caption(f"Metrics (including section-only reruns) are exported to `{metrics_sink.path}`.")
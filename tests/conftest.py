@@ -0,0 +1,107 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def completion(text, model="stub/model"):
+    """Body of a non-streamed chat completion answering `text`."""
+    return {
+        "id": "stub", "object": "chat.completion", "created": 0, "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+def chunk(text, model="stub/model"):
+    """One streamed chat completion chunk carrying `text`."""
+    return {
+        "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+    }
+
+
+def error_body(status, message="stub error"):
+    return {"error": {"code": status, "message": message}}
+
+
+class StubOpenRouter:
+    """Local stand-in for OpenRouter's chat completions endpoint.
+
+    Each request is answered by the next entry of `responses`, a dict with `status` (default 200),
+    `headers`, and either `body` (sent as JSON) or `events` (sent as server-sent events). With
+    `drop=True` the connection is closed before the announced body is complete. The JSON body of
+    every request is kept in `requests`.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests.append(json.loads(body))
+                stub._answer(self, stub.responses.pop(0))
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}/api/v1"
+        threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    def _answer(self, handler, response):
+        if "events" in response:
+            payload = "".join(f"data: {json.dumps(event)}\n\n" for event in response["events"])
+            if not response.get("drop"):
+                payload += "data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            payload = json.dumps(response.get("body", {}))
+            content_type = "application/json"
+        payload = payload.encode()
+        handler.send_response(response.get("status", 200))
+        handler.send_header("Content-Type", content_type)
+        for name, value in response.get("headers", {}).items():
+            handler.send_header(name, value)
+        # A dropped response announces more bytes than it sends, so the client sees a broken body
+        handler.send_header("Content-Length", str(len(payload) + (1024 if response.get("drop") else 0)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+        handler.wfile.flush()
+        if response.get("drop"):
+            handler.close_connection = True
+
+    @property
+    def models(self):
+        return [request["model"] for request in self.requests]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def openrouter(monkeypatch):
+    """A StubOpenRouter that clients from ai_client.create_client() talk to."""
+    import ai_client
+
+    stub = StubOpenRouter()
+    monkeypatch.setattr(ai_client, "OPENROUTER_BASE_URL", stub.base_url)
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Delays ai_client would have slept for between retries; nothing actually sleeps."""
+    import ai_client
+
+    delays = []
+    monkeypatch.setattr(ai_client.time, "sleep", delays.append)
+    return delays
@@ -0,0 +1,183 @@
+import asyncio
+
+import openai
+import pytest
+
+import ai_client
+from conftest import chunk, completion, error_body
+
+PRIMARY = "primary/model"
+SECONDARY = "secondary/model"
+
+
+def test_retries_server_errors_with_backoff(openrouter, sleeps):
+    openrouter.responses = [
+        {"status": 500, "body": error_body(500)},
+        {"status": 502, "body": error_body(502)},
+        {"body": completion("recovered")},
+    ]
+    client = ai_client.create_client("sk-test")
+
+    assert ai_client.complete(client, "prompt", PRIMARY) == "recovered"
+    assert openrouter.models == [PRIMARY] * 3
+    # Full jitter: each delay is drawn from [0, base * 2 ** attempt]
+    assert len(sleeps) == 2
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay <= ai_client.BACKOFF_BASE_SECONDS * 2 ** attempt
+
+
+def test_does_not_retry_client_errors(openrouter, sleeps):
+    openrouter.responses = [{"status": 401, "body": error_body(401, "bad key")}]
+    client = ai_client.create_client("sk-test")
+
+    with pytest.raises(openai.AuthenticationError):
+        ai_client.complete(client, "prompt", PRIMARY)
+    assert len(openrouter.requests) == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"Retry-After": "2"}, 2.0),
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"Retry-After": "600"}, ai_client.MAX_RETRY_AFTER_SECONDS),
+])
+def test_honours_retry_after(openrouter, sleeps, headers, expected):
+    openrouter.responses = [
+        {"status": 429, "headers": headers, "body": error_body(429)},
+        {"body": completion("ok")},
+    ]
+    client = ai_client.create_client("sk-test")
+
+    assert ai_client.complete(client, "prompt", PRIMARY) == "ok"
+    assert sleeps == [expected]
+
+
+def test_falls_back_to_secondary_model_on_429(openrouter, sleeps):
+    openrouter.responses = [
+        {"status": 429, "body": error_body(429)},
+        {"status": 429, "body": error_body(429)},
+        {"body": completion("from the fallback", model=SECONDARY)},
+    ]
+    fallbacks = []
+    client = ai_client.create_client("sk-test")
+
+    text = ai_client.complete(
+        client, "prompt", PRIMARY, fallback_models=[PRIMARY, SECONDARY],
+        on_fallback=lambda current, next_model, e: fallbacks.append((current, next_model, type(e))),
+    )
+
+    assert text == "from the fallback"
+    # The saturated model gets SATURATED_RETRIES_BEFORE_FALLBACK retries before the next one is tried
+    assert openrouter.models == [PRIMARY] * (ai_client.SATURATED_RETRIES_BEFORE_FALLBACK + 1) + [SECONDARY]
+    assert fallbacks == [(PRIMARY, SECONDARY, openai.RateLimitError)]
+
+
+def test_rate_limit_message_once_retries_run_out(openrouter, sleeps):
+    openrouter.responses = [
+        {"status": 429, "headers": {"Retry-After": "7"}, "body": error_body(429)}
+        for _ in range(ai_client.MAX_RETRIES + 1)
+    ]
+    client = ai_client.create_client("sk-test")
+
+    with pytest.raises(openai.RateLimitError) as excinfo:
+        ai_client.complete(client, "prompt", PRIMARY)
+    assert len(openrouter.requests) == ai_client.MAX_RETRIES + 1
+    assert sleeps == [7.0] * ai_client.MAX_RETRIES
+
+    message, fallback_text = ai_client.describe_error(excinfo.value)
+    assert "rate limit reached (429)" in message
+    assert "Try again in 7s" in message
+    assert fallback_text == "Error: Rate limited by API."
+
+
+def test_async_client_falls_back_on_429(openrouter, monkeypatch):
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(ai_client.asyncio, "sleep", no_sleep)
+    openrouter.responses = [
+        {"status": 429, "body": error_body(429)},
+        {"status": 429, "body": error_body(429)},
+        {"body": completion("async fallback", model=SECONDARY)},
+    ]
+
+    async def run():
+        client = ai_client.create_async_client("sk-test")
+        try:
+            return await ai_client.complete_async(client, "prompt", PRIMARY, fallback_models=[SECONDARY])
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == "async fallback"
+    assert openrouter.models[-1] == SECONDARY
+
+
+def _stream(client, pieces):
+    """Consumes ai_client.stream(); returns (text received, exception raised or None)."""
+    try:
+        for piece in ai_client.stream(client, "prompt", PRIMARY):
+            pieces.append(piece)
+    except Exception as e:
+        return "".join(pieces), e
+    return "".join(pieces), None
+
+
+def test_stream_yields_tokens_as_they_arrive(openrouter):
+    openrouter.responses = [{"events": [chunk("Hello"), chunk(", "), chunk("world")]}]
+    pieces = []
+
+    text, error = _stream(ai_client.create_client("sk-test"), pieces)
+
+    assert error is None
+    assert pieces == ["Hello", ", ", "world"]
+
+
+def test_stream_dropped_connection_keeps_partial_text(openrouter):
+    openrouter.responses = [{"events": [chunk("Partial "), chunk("answer")], "drop": True}]
+
+    text, error = _stream(ai_client.create_client("sk-test"), [])
+
+    assert text == "Partial answer"
+    assert isinstance(error, openai.APIConnectionError)
+    message, fallback_text = ai_client.describe_error(error)
+    assert message.startswith("Could not connect to OpenRouter API")
+    assert fallback_text == "Error: Could not connect to API."
+
+
+def test_stream_error_event_keeps_partial_text(openrouter):
+    openrouter.responses = [{"events": [chunk("Partial"), error_body(429, "Provider overloaded")]}]
+
+    text, error = _stream(ai_client.create_client("sk-test"), [])
+
+    assert text == "Partial"
+    assert isinstance(error, openai.APIError)
+    message, fallback_text = ai_client.describe_error(error)
+    assert message.startswith("OpenRouter API returned an error: Provider overloaded")
+    assert fallback_text == "Error: API call failed."
+
+
+def test_failed_combined_call_is_logged_before_falling_back(openrouter, caplog):
+    openrouter.responses = [
+        {"status": 401, "body": error_body(401, "bad key")},
+        {"body": completion("answer")},
+        {"body": completion("answer")},
+    ]
+
+    async def run():
+        client = ai_client.create_async_client("sk-test")
+        try:
+            return [
+                (key, text, error, combined)
+                async for key, text, error, combined in ai_client.complete_combined(
+                    client, "combined", {"a": "prompt a", "b": "prompt b"}, lambda text: {"a": text}, PRIMARY
+                )
+            ]
+        finally:
+            await client.close()
+
+    with caplog.at_level("WARNING", logger="ai_client"):
+        answers = asyncio.run(run())
+
+    assert sorted(answers) == [("a", "answer", None, False), ("b", "answer", None, False)]
+    assert "Combined request failed" in caplog.text
+    assert "bad key" in caplog.text
@@ -0,0 +1,142 @@
+"""The pandas, streaming and DuckDB ingest paths must agree on every count and aggregate."""
+import pandas as pd
+import pytest
+
+import data_pipeline
+import query_backends
+
+# Odd headers: stray spaces, and a second "media type" that only differs by case
+HEADER = ["Date ", " Platform", "Sentiment ", "Location", "Engagements", "Media Type", "media type"]
+DATES = [
+    "2024-03-01 09:15:00", "2024-03-01T10:00:00Z", "2024-03-02T23:30:00+02:00", "2024-03-03 00:00:00",
+    " 2024-03-04 08:00:00 ", "not a date", "", "2024-02-30 10:00:00", "2024-03-05 17:45:00", "2024-03-11 12:00:00",
+]
+ENGAGEMENTS = ["12", "3.7", "-2.5", "", "abc", "1e3", " 7 ", "inf", "1,234", "250"]
+PLATFORMS = ["Twitter", "Instagram", "", "TikTok"]
+SENTIMENTS = ["Positive", "Negative", "Neutral"]
+# Only numeric-looking locations (leading zeros) and one the CSV readers treat as missing, so
+# nothing forces a type-inferring reader to keep them as text
+LOCATIONS = ["01234", "02134", "NA", "00789"]
+MEDIA_TYPES = ["Video", "Image", "Text"]
+
+
+def _rows(count=60):
+    for i in range(count):
+        yield [
+            DATES[i % len(DATES)], PLATFORMS[i % len(PLATFORMS)], SENTIMENTS[i % len(SENTIMENTS)],
+            LOCATIONS[i % len(LOCATIONS)], ENGAGEMENTS[(i * 3) % len(ENGAGEMENTS)], MEDIA_TYPES[i % len(MEDIA_TYPES)],
+            MEDIA_TYPES[(i + 1) % len(MEDIA_TYPES)],
+        ]
+
+
+def _csv_bytes():
+    def cell(value):
+        return f'"{value}"' if "," in value else value
+    lines = [",".join(HEADER)] + [",".join(cell(v) for v in row) for row in _rows()]
+    return ("\n".join(lines) + "\n").encode()
+
+
+@pytest.fixture(scope="module")
+def sources(tmp_path_factory):
+    root = tmp_path_factory.mktemp("parity")
+    csv_path = root / "messy.csv"
+    csv_path.write_bytes(_csv_bytes())
+    paths = {"csv": str(csv_path)}
+    if data_pipeline.importlib.util.find_spec("pyarrow") is not None:
+        # The same cells as strings, as an export tool that writes every column as text would
+        strings = pd.DataFrame(list(_rows()), columns=HEADER).replace("", None)
+        strings.to_parquet(root / "strings.parquet", index=False)
+        paths["strings.parquet"] = str(root / "strings.parquet")
+        # Natively typed columns: tz-aware timestamps (with a gap) and float engagements with NaN
+        typed = pd.DataFrame({
+            "Date": pd.to_datetime(["2024-03-01T10:00:00Z", None, "2024-03-02T23:30:00+02:00", "2024-03-04T08:00:00Z"] * 5, utc=True),
+            "Platform": ["Twitter", "Instagram", None, "TikTok"] * 5,
+            "Sentiment": ["Positive", "Negative", "Neutral", "Positive"] * 5,
+            "Location": ["New York", "London", "Paris", "Lagos"] * 5,
+            "Engagements": [12.0, None, 3.7, -2.5] * 5,
+            "Media Type": ["Video", "Image", "Text", "Video"] * 5,
+        })
+        typed.to_parquet(root / "typed.parquet", index=False)
+        paths["typed.parquet"] = str(root / "typed.parquet")
+    return paths
+
+
+def _series(series):
+    return None if series is None else {str(key): int(value) for key, value in series.items()}
+
+
+def summarize(dataset):
+    aggs = dataset.aggregates
+    summary = {
+        "raw_row_count": dataset.raw_row_count,
+        "cleaned_row_count": dataset.cleaned_row_count,
+        "dropped_rows": dataset.dropped_rows.to_dict(),
+        "warnings": sorted(dataset.warnings),
+    }
+    if aggs is None:
+        return summary
+    summary.update(
+        total_rows=aggs.total_rows,
+        date_min=aggs.date_min,
+        date_max=aggs.date_max,
+        sentiment_counts=_series(aggs.sentiment_counts),
+        engagement_by_date=_series(aggs.engagement_by_date),
+        platform_engagements=_series(aggs.platform_engagements),
+        media_type_counts=_series(aggs.media_type_counts),
+        location_engagements=_series(aggs.location_engagements),
+        rollups={granularity: _series(totals) for granularity, totals in aggs.rollups.totals.items()},
+    )
+    return summary
+
+
+def _pandas(path):
+    return query_backends.get_backend("pandas").load_dataset(path)
+
+
+def _pandas_c_engine(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data_pipeline.load_frame(data_pipeline.read_csv_bytes(data, engine="c"), data_pipeline.content_hash(data))
+
+
+def _streaming(path):
+    with open(path, "rb") as f:
+        # Small chunks, so rows with the same date and dimensions land in different chunks
+        return data_pipeline.stream_dataset(f.read(), chunk_rows=7)
+
+
+def _duckdb(path):
+    if not query_backends.DuckDBBackend.available():
+        pytest.skip("duckdb is not installed")
+    return query_backends.get_backend("duckdb").load_dataset(path)
+
+
+@pytest.mark.parametrize("source, load", [
+    ("csv", _pandas_c_engine),
+    ("csv", _streaming),
+    ("csv", _duckdb),
+    ("strings.parquet", _duckdb),
+    ("typed.parquet", _duckdb),
+])
+def test_backends_agree_with_pandas(sources, source, load):
+    if source not in sources:
+        pytest.skip("writing Parquet needs pyarrow")
+    expected = summarize(_pandas(sources[source]))
+    assert expected.get("total_rows"), "the input should leave some valid rows"
+
+    assert summarize(load(sources[source])) == expected
+
+
+def test_messy_csv_is_cleaned_as_documented(sources):
+    dataset = _pandas(sources["csv"])
+
+    # "not a date", "2024-02-30 10:00:00" and the empty date are dropped; every other row is kept
+    assert dataset.dropped_rows.counts == {data_pipeline.MISSING_DATE: 6, data_pipeline.UNPARSEABLE_DATE: 12}
+    assert dataset.cleaned_row_count == 42
+    # Offsets are converted to UTC: 23:30+02:00 on the 2nd is 21:30 UTC the same day
+    assert pd.Timestamp("2024-03-02 21:30") in dataset.cleaned_df["date"].values
+    # The first of the two "media type" columns is used
+    assert set(dataset.aggregates.media_type_counts.index) == set(MEDIA_TYPES)
+    assert any("media_type" in warning for warning in dataset.warnings)
+    # Numeric-looking locations keep their leading zeros
+    assert set(dataset.aggregates.location_engagements.index) == {"01234", "02134", "00789"}
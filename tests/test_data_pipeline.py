@@ -0,0 +1,34 @@
+import pandas as pd
+
+import data_pipeline
+
+
+def test_parse_distinct_dates_normalizes_utc_offsets():
+    values = ["2024-01-01", "2024-01-02T10:00:00Z", "2024-01-02T11:00:00+02:00", "not a date"]
+
+    _, parsed = data_pipeline.parse_distinct_dates(values)
+
+    assert str(parsed.dtype) == data_pipeline.SCHEMA["date"]
+    assert list(parsed[:3]) == [
+        pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-02 10:00"), pd.Timestamp("2024-01-02 09:00"),
+    ]
+    assert pd.isna(parsed[3])
+
+
+def test_ambiguous_slash_dates_read_month_first():
+    _, parsed = data_pipeline.parse_distinct_dates(["01/02/2024", "03/04/2024"])
+
+    # As pd.to_datetime reads them
+    assert list(parsed) == [pd.Timestamp("2024-01-02"), pd.Timestamp("2024-03-04")]
+
+
+def test_mixed_file_reads_every_date_in_the_detected_order():
+    # 13/02 and 14/02 can only be day-first, so the ambiguous 01/02 is the 1st of February, both
+    # in the detected format and in the per-value fallback (the one with a time)
+    values = ["13/02/2024", "01/02/2024", "14/02/2024", "03/02/2024 10:00:00"]
+
+    _, parsed = data_pipeline.parse_distinct_dates(values)
+
+    assert list(parsed) == [
+        pd.Timestamp("2024-02-13"), pd.Timestamp("2024-02-01"), pd.Timestamp("2024-02-14"), pd.Timestamp("2024-02-03 10:00"),
+    ]
@@ -0,0 +1,45 @@
+import dataclasses
+
+import data_pipeline
+import dataset_registry
+
+HEADER = "Date,Platform,Sentiment,Location,Engagements,Media Type\n"
+CSV = (HEADER + "".join(f"2024-01-{day:02d},Twitter,Positive,NY,{day},Video\n" for day in range(1, 29))).encode()
+
+
+def test_derived_objects_are_kept_per_key_and_dropped_on_eviction():
+    registry = dataset_registry.DatasetRegistry()
+    dataset = data_pipeline.load_dataset(CSV)
+    registry.put("session", "hash", dataset)
+    registry.put("session", "hash:duckdb", dataset)
+    built = []
+
+    def build(tag):
+        built.append(tag)
+        return object()
+
+    first = registry.derived("hash", "filter_index", lambda: build("hash"))
+    assert registry.derived("hash", "filter_index", lambda: build("again")) is first
+    assert registry.derived("hash:duckdb", "filter_index", lambda: build("duckdb")) is not first
+    assert built == ["hash", "duckdb"]
+
+    registry.retain("session", [])
+    registry.evict_unused()
+    assert registry.derived("hash", "filter_index", lambda: build("reloaded")) is not first
+    assert built[-1] == "reloaded"
+
+
+def test_size_estimate_includes_the_time_rollups():
+    hourly = (HEADER + "".join(
+        f"2024-01-{1 + hour // 24:02d} {hour % 24:02d}:00:00,Twitter,Positive,NY,{hour},Video\n" for hour in range(24 * 28)
+    )).encode()
+    dataset = data_pipeline.load_dataset(hourly)
+    rollups = dataset.aggregates.rollups
+    assert "hour" in rollups.levels
+
+    without_rollups = dataset_registry.dataset_nbytes(dataclasses.replace(
+        dataset, aggregates=dataclasses.replace(dataset.aggregates, rollups=None)
+    ))
+    level_bytes = sum(int(level.memory_usage(deep=True).sum()) for level in rollups.levels.values())
+
+    assert dataset_registry.dataset_nbytes(dataset) >= without_rollups + level_bytes
@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+import ai_client
+import llm_cache
+from conftest import completion
+
+
+@pytest.fixture
+def locked_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = llm_cache.ResponseCache(path=path, busy_timeout=0.01)
+    cache.set("stored", "from disk")
+    cache._memory.clear()
+    # Another process (e.g. a batch_report worker) holding the write lock
+    other = sqlite3.connect(path)
+    other.execute("BEGIN EXCLUSIVE")
+    yield cache
+    other.rollback()
+    other.close()
+
+
+def test_locked_cache_reads_miss_and_writes_stay_in_memory(locked_cache, caplog):
+    with caplog.at_level("WARNING", logger="llm_cache"):
+        assert locked_cache.get("stored") is None
+        locked_cache.set("new", "answer")
+
+    assert locked_cache.get("new") == "answer"
+    assert locked_cache.stats()["misses"] == 1
+    assert "database is locked" in caplog.text
+
+
+def test_completion_is_returned_when_the_cache_is_locked(locked_cache, openrouter):
+    openrouter.responses = [{"body": completion("paid for")}]
+
+    assert ai_client.complete(ai_client.create_client("sk-test"), "prompt", "primary/model", cache=locked_cache) == "paid for"
+
+
+def test_corrupt_cache_file_falls_back_to_memory(tmp_path, caplog):
+    path = tmp_path / "cache.sqlite"
+    path.write_bytes(b"not a database" * 100)
+
+    with caplog.at_level("WARNING", logger="llm_cache"):
+        cache = llm_cache.ResponseCache(path=str(path))
+    cache.set("key", "answer")
+
+    assert cache.get("key") == "answer"
+    assert "unusable" in caplog.text
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import data_pipeline
+import prompts
+
+HEADER = "Date,Platform,Sentiment,Location,Engagements,Media Type\n"
+PLATFORMS = ["Twitter", "Instagram", "TikTok", "Facebook", "YouTube", "LinkedIn"]
+LOCATIONS = ["New York", "London", "Paris", "Tokyo", "Jakarta", "Sydney", "Berlin"]
+
+
+@pytest.fixture(scope="module")
+def aggs():
+    rows = [
+        f"2024-{1 + day // 28:02d}-{1 + day % 28:02d},{PLATFORMS[day % 6]},{['Positive', 'Negative', 'Neutral'][day % 3]},"
+        f"{LOCATIONS[day % 7]},{(day * 37) % 500},{['Video', 'Image', 'Text'][day % 3]}"
+        for day in range(200)
+    ]
+    return data_pipeline.load_dataset((HEADER + "\n".join(rows)).encode()).aggregates
+
+
+def _all_prompts(aggs, budget):
+    built = prompts.build_all_prompts(aggs, budget)
+    return [(prompt, budget) for prompt in built.values()] + [
+        (prompts.build_report_prompt(aggs, budget), budget * prompts.REPORT_BUDGET_SCALE)
+    ]
+
+
+@pytest.mark.parametrize("budget", [600, 300, 200, 150])
+def test_prompts_fit_the_budget(aggs, budget):
+    for prompt, prompt_budget in _all_prompts(aggs, budget):
+        assert prompts.estimate_tokens(prompt) <= prompt_budget
+        assert not prompts.prompt_over_budget(prompt, prompt_budget)
+
+
+def test_summary_is_cut_when_fewer_details_are_not_enough(aggs):
+    full = prompts.build_campaign_prompt(aggs, 0)
+    cut = prompts.build_campaign_prompt(aggs, 150)
+
+    assert prompts.estimate_tokens(full) > 150 >= prompts.estimate_tokens(cut)
+    assert prompts.TRUNCATION_NOTE in cut
+    # The instructions and the answer cue survive the cut
+    assert cut.startswith("Analyze the following media intelligence data.")
+    assert cut.rstrip().endswith("Campaign Recommendation:")
+
+
+def test_budget_below_the_instructions_is_reported(aggs):
+    prompt = prompts.build_campaign_prompt(aggs, 20)
+
+    assert prompts.prompt_over_budget(prompt, 20)
+    assert not prompts.prompt_over_budget(prompt, 0)
+
+
+@pytest.mark.parametrize("points", [
+    "A single string",
+    ["Only one", "and two"],
+    ["One", "two", "three", "four"],
+    ["One", "", "three"],
+    ["One", 2, "three"],
+])
+def test_report_sections_need_exactly_three_points(points):
+    good = ["One", "two", "three"]
+    response = json.dumps({"whats_working": good, "needs_improvement": good, "charts": {"sentiment": points}})
+
+    sections = prompts.parse_report_response(response, [prompts.CAMPAIGN_SLOT, "sentiment"])
+
+    assert list(sections) == [prompts.CAMPAIGN_SLOT]
+    assert sections[prompts.CAMPAIGN_SLOT].count("<li>") == 6
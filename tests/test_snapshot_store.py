@@ -0,0 +1,89 @@
+import os
+
+import pandas as pd
+import pytest
+
+import data_pipeline
+import snapshot_store
+
+pytestmark = pytest.mark.skipif(not snapshot_store.parquet_available(), reason="needs pyarrow or fastparquet")
+
+HEADER = "Date,Platform,Sentiment,Location,Engagements,Media Type\n"
+
+
+def _csv(rows):
+    return (HEADER + "".join(f"{row}\n" for row in rows)).encode()
+
+
+BASE = _csv([f"2024-01-{day:02d},Twitter,Positive,NY,{day},Video" for day in range(1, 29)])
+FIRST_APPEND = _csv(["2024-02-01,Instagram,Negative,LA,7,Image", "2024-01-01,Twitter,Positive,NY,1,Video"])
+SECOND_APPEND = _csv(["2024-02-02,TikTok,Neutral,Paris,3,Text"])
+
+
+def _assert_same(loaded, expected):
+    assert loaded.cleaned_row_count == expected.cleaned_row_count
+    assert loaded.raw_row_count == expected.raw_row_count
+    assert loaded.dropped_rows.to_dict() == expected.dropped_rows.to_dict()
+    pd.testing.assert_frame_equal(loaded.cleaned_df, expected.cleaned_df)
+    for name in ("engagement_by_date", "sentiment_counts", "platform_engagements", "location_engagements"):
+        assert getattr(loaded.aggregates, name).to_dict() == getattr(expected.aggregates, name).to_dict()
+
+
+def test_appends_are_snapshotted_as_deltas(tmp_path):
+    store = snapshot_store.SnapshotStore(root=str(tmp_path))
+    base = data_pipeline.load_dataset(BASE)
+    store.save(base, name="base.csv")
+    first = data_pipeline.append_dataset(base, FIRST_APPEND)
+    second = data_pipeline.append_dataset(first, SECOND_APPEND)
+
+    assert store.save_delta(first, base, name="base.csv + first.csv")
+    assert store.save_delta(second, first, name="base.csv + first.csv + second.csv")
+
+    # Only the appended rows are written for each delta
+    assert len(pd.read_parquet(os.path.join(str(tmp_path), f"{first.source_hash}.parquet"))) == 1
+    assert len(pd.read_parquet(os.path.join(str(tmp_path), f"{second.source_hash}.parquet"))) == 1
+    _assert_same(store.load(first.source_hash), first)
+    _assert_same(store.load(second.source_hash), second)
+
+
+def test_delta_needs_a_base_snapshot(tmp_path):
+    store = snapshot_store.SnapshotStore(root=str(tmp_path))
+    base = data_pipeline.load_dataset(BASE)
+    appended = data_pipeline.append_dataset(base, FIRST_APPEND)
+
+    assert not store.save_delta(appended, base)
+    assert store.load(appended.source_hash) is None
+
+
+def test_evicting_a_base_drops_its_deltas(tmp_path):
+    store = snapshot_store.SnapshotStore(root=str(tmp_path))
+    base = data_pipeline.load_dataset(BASE)
+    store.save(base)
+    appended = data_pipeline.append_dataset(base, FIRST_APPEND)
+    store.save_delta(appended, base)
+
+    other = data_pipeline.load_dataset(SECOND_APPEND)
+    store.max_bytes = 1
+    store.save(other)
+
+    assert [entry["source_hash"] for entry in store.entries()] == [other.source_hash]
+    assert not os.path.exists(os.path.join(str(tmp_path), f"{appended.source_hash}.parquet"))
+
+
+def test_snapshots_from_another_pipeline_version_are_misses(tmp_path, monkeypatch):
+    store = snapshot_store.SnapshotStore(root=str(tmp_path))
+    base = data_pipeline.load_dataset(BASE)
+    store.save(base)
+    store.save_delta(data_pipeline.append_dataset(base, FIRST_APPEND), base)
+
+    monkeypatch.setattr(snapshot_store, "PIPELINE_VERSION", data_pipeline.PIPELINE_VERSION + 1)
+
+    assert store.load(base.source_hash) is None
+    assert store.entries() == []
+    # A new store (the next app start) deletes the stale files
+    store = snapshot_store.SnapshotStore(root=str(tmp_path))
+    assert not any(name.endswith(".parquet") for name in os.listdir(str(tmp_path)))
+
+    # Saving again under the new rules makes it loadable
+    store.save(base)
+    _assert_same(store.load(base.source_hash), base)